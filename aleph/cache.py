@@ -32,6 +32,14 @@ class Cache(object):
         value = orjson.dumps(value, default=json_default)
         return self.set(key, value, expires=expires)
 
+    def set_many_complex(self, values, expires=None):
+        """Set a mapping of keys to values in a single round-trip."""
+        expires = expires or self.expires
+        pipe = self.kv.pipeline(transaction=False)
+        for key, value in values.items():
+            pipe.set(key, orjson.dumps(value, default=json_default), ex=expires)
+        pipe.execute()
+
     def set_list(self, key, values, expires=None):
         self.kv.delete(key)
         if len(values):
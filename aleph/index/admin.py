@@ -1,16 +1,28 @@
 import logging
 
+from banal import ensure_list
 from openaleph_search.index.admin import (
     configure_entities,
     entities_read_index,
 )
+from openaleph_search.index.indexer import MAX_REQUEST_TIMEOUT
+from openaleph_search.index.indexes import (
+    BUCKETS,
+    bucket_index,
+    get_bucket_shard_num,
+    make_schema_bucket_mapping,
+)
+from openaleph_search.index.util import index_name, index_settings
+from openaleph_search.settings import Settings as SearchSettings
 
 from aleph.core import es
 from aleph.index.collections import collections_index, configure_collections
 from aleph.index.notifications import configure_notifications, notifications_index
+from aleph.index.util import entities_version_index
 from aleph.index.xref import configure_xref, xref_index
 
 log = logging.getLogger(__name__)
+search_settings = SearchSettings()
 
 
 def upgrade_search():
@@ -21,6 +33,24 @@ def upgrade_search():
     configure_xref()
 
 
+def delete_legacy_xref(destructive: bool = False):
+    """The matches in the v1 xref index were not routed by collection, so
+    they cannot be read from the current index. Delete it if asked to, the
+    matches have to be regenerated by cross-referencing all collections."""
+    legacy = index_name("xref", "v1")
+    if not es.indices.exists(index=legacy):
+        return
+    if not destructive:
+        log.warning(
+            "Found the legacy xref index %s, run `aleph upgrade --destructive` "
+            "to delete it and re-run xref for all collections.",
+            legacy,
+        )
+        return
+    log.warning("Deleting the legacy xref index %s, re-run xref...", legacy)
+    es.indices.delete(index=legacy)
+
+
 def all_indexes():
     return ",".join(
         (
@@ -45,3 +75,78 @@ def clear_index():
         conflicts="proceed",
         ignore=[404],
     )
+
+
+def check_rebuild_version(version: str, alias: str):
+    """Make sure an index version can be rebuilt and swapped in under the
+    given alias, before spending hours on loading it."""
+    live = {search_settings.index_write, *ensure_list(search_settings.index_read)}
+    if version in live:
+        raise ValueError(f"Index version is in use: {version}")
+    if version == alias:
+        raise ValueError(f"Index version and alias are the same: {version}")
+    for bucket in BUCKETS:
+        name = bucket_index(bucket, alias)
+        if es.indices.exists(index=name) and not es.indices.exists_alias(name=name):
+            raise ValueError(f"Cannot create alias, an index has its name: {name}")
+
+
+def create_rebuild_indexes(version: str):
+    """Create the entity indexes of an index version for bulk loading, with
+    refreshes and replicas turned off. Existing indexes of the version are
+    kept, so that an interrupted rebuild can be run again."""
+    loading = {"refresh_interval": "-1", "number_of_replicas": "0"}
+    for bucket in BUCKETS:
+        index = bucket_index(bucket, version)
+        if es.indices.exists(index=index):
+            log.info("Loading into existing index: %s", index)
+            es.indices.put_settings(index=index, body={"index": loading})
+            continue
+        log.info("Creating index: %s", index)
+        settings = index_settings(shards=get_bucket_shard_num(bucket))
+        settings["index"].update(loading)
+        mapping = make_schema_bucket_mapping(bucket)
+        es.indices.create(index=index, body={"settings": settings, "mappings": mapping})
+
+
+def finish_rebuild_indexes(version: str):
+    """Restore the regular refresh interval and replicas of the indexes of a
+    rebuilt version, and wait for them to be searchable."""
+    index = entities_version_index(version)
+    regular = index_settings()["index"]
+    body = {
+        "index": {
+            "refresh_interval": regular["refresh_interval"],
+            "number_of_replicas": regular["number_of_replicas"],
+        }
+    }
+    es.indices.put_settings(index=index, body=body)
+    es.indices.refresh(index=index)
+    res = es.cluster.health(
+        index=index,
+        wait_for_status="green",
+        timeout="1h",
+        request_timeout=MAX_REQUEST_TIMEOUT,
+    )
+    if res.get("timed_out"):
+        log.warning("Replicas of %s are still being allocated", index)
+
+
+def swap_entities_alias(version: str, alias: str) -> list[str]:
+    """Point the alias of each entity bucket at the index of the given
+    version, all in one atomic request. Returns the indexes the aliases
+    pointed to before."""
+    actions = []
+    previous = []
+    for bucket in BUCKETS:
+        index = bucket_index(bucket, version)
+        name = bucket_index(bucket, alias)
+        if es.indices.exists_alias(name=name):
+            for old in es.indices.get_alias(name=name):
+                if old != index:
+                    previous.append(old)
+                    actions.append({"remove": {"index": old, "alias": name}})
+        add = {"index": index, "alias": name, "is_write_index": True}
+        actions.append({"add": add})
+    es.indices.update_aliases(body={"actions": actions})
+    return previous
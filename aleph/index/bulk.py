@@ -0,0 +1,243 @@
+"""Bulk indexing with adaptively sized requests.
+
+The entity documents of a collection range from tiny `Person` entities to
+`Pages` with megabytes of text, so a fixed number of documents per bulk
+request either overloads the search cluster or leaves it idle. Requests are
+cut by their size in bytes instead, and the size follows the feedback of the
+cluster: it grows while requests are accepted quickly, and is halved when
+they are rejected (HTTP 429, e.g. full write queues or a tripped circuit
+breaker) or time out, and shrunk when they get slow.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterable
+
+import orjson
+from elasticsearch import ApiError, ConnectionTimeout
+from elasticsearch.helpers import expand_action
+from followthemoney import EntityProxy
+from openaleph_search.core import get_ingest_es
+from openaleph_search.index.indexer import MAX_REQUEST_TIMEOUT, Actions, bulk_actions
+from openaleph_search.index.indexes import BUCKETS, bucket_index
+from openaleph_search.index.util import refresh_sync
+from openaleph_search.settings import Settings as SearchSettings
+from openaleph_search.transform.entity import format_parallel
+from prometheus_client import Counter, Gauge, Histogram
+
+from aleph.settings import SETTINGS
+from aleph.util import json_default
+
+log = logging.getLogger(__name__)
+search_settings = SearchSettings()
+
+BULK_REQUEST_BYTES = Gauge(
+    "aleph_index_bulk_request_bytes",
+    "Effective size in bytes that bulk indexing requests are cut to",
+)
+
+BULK_REJECTIONS = Counter(
+    "aleph_index_bulk_rejections_total",
+    "Number of bulk indexing requests and documents rejected by the search index",
+)
+
+BULK_REQUEST_DURATION = Histogram(
+    "aleph_index_bulk_request_duration_seconds",
+    "Duration of bulk indexing requests",
+)
+
+
+class BulkSizer:
+    """Track the size of bulk requests: grow it by a step after each fast
+    request, shrink it by a quarter after a slow one and halve it when the
+    search index rejects a request."""
+
+    def __init__(self, min_bytes: int, max_bytes: int, target_seconds: float):
+        self.min_bytes = min_bytes
+        self.max_bytes = max(min_bytes, max_bytes)
+        self.target_seconds = target_seconds
+        start = search_settings.indexer_max_chunk_bytes
+        self.size = min(max(start, self.min_bytes), self.max_bytes)
+        self.lock = threading.Lock()
+        BULK_REQUEST_BYTES.set(self.size)
+
+    def _resize(self, size: float):
+        self.size = int(min(max(size, self.min_bytes), self.max_bytes))
+        BULK_REQUEST_BYTES.set(self.size)
+
+    def accepted(self, took: float):
+        with self.lock:
+            if took > self.target_seconds:
+                self._resize(self.size * 0.75)
+            else:
+                self._resize(self.size + self.min_bytes)
+
+    def rejected(self, count: int = 1):
+        BULK_REJECTIONS.inc(count)
+        with self.lock:
+            self._resize(self.size / 2)
+            log.warning("Bulk request rejected, reducing size to %d bytes", self.size)
+
+
+_SIZER: BulkSizer | None = None
+
+
+def get_bulk_sizer() -> BulkSizer:
+    """Get the bulk sizer of this process, so that the size learned from the
+    search index carries over from one bulk stream to the next."""
+    global _SIZER
+    if _SIZER is None:
+        _SIZER = BulkSizer(
+            SETTINGS.INDEX_BULK_MIN_BYTES,
+            SETTINGS.INDEX_BULK_MAX_BYTES,
+            SETTINGS.INDEX_BULK_TARGET_SECONDS,
+        )
+    return _SIZER
+
+
+class BulkItem:
+    """An action serialized to the lines of a bulk request body. The action
+    metadata (e.g. `_routing`) is expanded like the `elasticsearch` bulk
+    helpers do it, so that actions are sent unchanged."""
+
+    __slots__ = ("is_delete", "lines", "size")
+
+    def __init__(self, action: dict):
+        meta, data = expand_action(action)
+        self.is_delete = "delete" in meta
+        self.lines = [orjson.dumps(meta)]
+        if data is not None:
+            self.lines.append(orjson.dumps(data, default=json_default))
+        self.size = sum(len(line) + 1 for line in self.lines)
+
+
+def _chunks(actions: Actions, sizer: BulkSizer):
+    """Cut the stream of actions into chunks of the current request size."""
+    chunk = []
+    size = 0
+    for action in actions:
+        item = BulkItem(action)
+        if len(chunk) and size + item.size > sizer.size:
+            yield chunk
+            chunk = []
+            size = 0
+        chunk.append(item)
+        size += item.size
+    if len(chunk):
+        yield chunk
+
+
+def _backoff(attempt: int):
+    time.sleep(min(2**attempt, 60))
+
+
+def _send(es, sizer: BulkSizer, chunk: list[BulkItem], sync: bool) -> int:
+    """Send a chunk of actions, splitting it after a rejection of the whole
+    request and retrying the rejected documents."""
+    pending = [chunk]
+    attempt = 0
+    indexed = 0
+    while len(pending):
+        chunk = pending.pop()
+        body = [line for item in chunk for line in item.lines]
+        start = time.time()
+        try:
+            res = es.bulk(
+                operations=body,
+                refresh=refresh_sync(sync),
+                timeout=f"{MAX_REQUEST_TIMEOUT}s",
+                request_timeout=MAX_REQUEST_TIMEOUT,
+            )
+        except (ApiError, ConnectionTimeout) as exc:
+            status = getattr(getattr(exc, "meta", None), "status", None)
+            rejected = isinstance(exc, ConnectionTimeout) or status == 429
+            if not rejected or attempt >= search_settings.max_retries:
+                raise
+            attempt += 1
+            sizer.rejected()
+            _backoff(attempt)
+            middle = len(chunk) // 2
+            pending.extend((chunk[middle:], chunk[:middle]) if middle else (chunk,))
+            continue
+        took = time.time() - start
+        BULK_REQUEST_DURATION.observe(took)
+
+        retry = []
+        for item, result in zip(chunk, res.get("items", [])):
+            _, result = next(iter(result.items()))
+            status = result.get("status", 200)
+            if status == 429:
+                retry.append(item)
+            elif status >= 300 and not (status == 404 and item.is_delete):
+                log.warning("Bulk index error: %r", result)
+            else:
+                indexed += 1
+        if not len(retry):
+            sizer.accepted(took)
+            continue
+        if attempt >= search_settings.max_retries:
+            raise RuntimeError(f"Bulk indexing rejected {len(retry)} documents")
+        attempt += 1
+        sizer.rejected(len(retry))
+        _backoff(attempt)
+        pending.append(retry)
+    return indexed
+
+
+def bulk_index(actions: Actions, sync: bool = False):
+    """Index a stream of actions with adaptively sized bulk requests, keeping
+    as many requests in flight as the search indexer concurrency allows."""
+    es = get_ingest_es()
+    sizer = get_bulk_sizer()
+    concurrency = max(1, search_settings.indexer_concurrency)
+    indexed = 0
+    with ThreadPoolExecutor(concurrency) as executor:
+        pending = set()
+
+        def _collect(return_when):
+            nonlocal pending, indexed
+            done, pending = wait(pending, return_when=return_when)
+            for future in done:
+                indexed += future.result()
+
+        for chunk in _chunks(actions, sizer):
+            if len(pending) >= concurrency:
+                _collect(FIRST_COMPLETED)
+            pending.add(executor.submit(_send, es, sizer, chunk, sync))
+        if len(pending):
+            _collect(ALL_COMPLETED)
+    log.debug("Bulk indexed %d documents (request size: %d)", indexed, sizer.size)
+    return indexed
+
+
+def _retarget(actions: Actions, version: str) -> Actions:
+    """Send the actions meant for the write indexes to the indexes of another
+    version, e.g. one that is being rebuilt."""
+    targets = {
+        bucket_index(bucket, search_settings.index_write): bucket_index(bucket, version)
+        for bucket in BUCKETS
+    }
+    for action in actions:
+        action["_index"] = targets.get(action["_index"], action["_index"])
+        yield action
+
+
+def index_bulk(
+    dataset: str,
+    entities: Iterable[EntityProxy],
+    sync: bool = False,
+    version: str | None = None,
+    **kwargs,
+):
+    """Index a set of entities, like `openaleph_search`'s `index_bulk`, with
+    adaptively sized bulk requests if they are enabled. If a `version` is
+    given, the entities go to the indexes of that version instead of the
+    write indexes."""
+    actions = format_parallel(dataset, entities, **kwargs)
+    if version is not None:
+        actions = _retarget(actions, version)
+    if not SETTINGS.INDEX_BULK_ADAPTIVE:
+        return bulk_actions(actions, sync=sync)
+    return bulk_index(actions, sync=sync)
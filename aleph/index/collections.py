@@ -1,4 +1,7 @@
 import logging
+import time
+from datetime import datetime, timezone
+from itertools import batched
 
 from followthemoney import model
 from normality import normalize
@@ -9,7 +12,7 @@ from openaleph_search.index.indexer import (
     query_delete,
 )
 from openaleph_search.index.indexes import entities_read_index
-from openaleph_search.index.mapping import FieldType
+from openaleph_search.index.mapping import Field, FieldType
 from openaleph_search.index.util import (
     index_name,
     index_settings,
@@ -17,7 +20,9 @@ from openaleph_search.index.util import (
 from openaleph_search.query.util import BoolQuery, bool_query
 
 from aleph.core import cache, es
+from aleph.index.util import entities_version_index
 from aleph.model import Collection, Entity
+from aleph.settings import SETTINGS
 
 STATS_FACETS = [
     "schema",
@@ -28,12 +33,17 @@ STATS_FACETS = [
     "countries",
     "languages",
 ]
+# Number of collections whose statistics are computed per multi-search
+STATS_BATCH_SIZE = 50
 log = logging.getLogger(__name__)
+TASK_POLL_SECONDS = 5
+# Entity context key under which the hash of an indexed entity is stored
+CONTENT_HASH = "content_hash"
 
 
-def _collection_things_count(collection_id: int) -> BoolQuery:
+def _things_count(collection_filter: dict) -> BoolQuery:
     query = bool_query()
-    query["bool"]["must"] = [{"term": {"collection_id": collection_id}}]
+    query["bool"]["must"] = [collection_filter]
     # don't count too much:
     query["bool"]["must_not"] = [
         {"term": {"schema": "Mention"}},
@@ -42,6 +52,10 @@ def _collection_things_count(collection_id: int) -> BoolQuery:
     return query
 
 
+def _collection_things_count(collection_id: int) -> BoolQuery:
+    return _things_count({"term": {"collection_id": collection_id}})
+
+
 def collections_index():
     """Combined index to run all queries against."""
     return index_name("collection", "v1")
@@ -127,23 +141,45 @@ def get_collection(collection_id):
     """Fetch a collection from the index."""
     if collection_id is None:
         return
-    key = cache.object_key(Collection, collection_id)
-    data = cache.get_complex(key)
-    if data is not None:
-        return data
+    return get_collections([collection_id]).get(collection_id)
 
-    collection = Collection.by_id(collection_id)
-    if collection is None:
-        return
 
-    data = collection.to_dict()
+def get_collections(collection_ids):
+    """Fetch many collections from the index. The things of all the
+    collections missing from the cache are counted with one aggregation."""
+    keys = {cache.object_key(Collection, c): c for c in collection_ids}
+    collections = {}
+    for key, data in cache.get_many_complex(list(keys.keys())):
+        if data is not None:
+            collections[keys[key]] = data
+    missing = {str(c): c for c in collection_ids if c not in collections}
+    if not len(missing):
+        return collections
 
-    index = entities_read_index(schema=Entity.THING)
-    query = _collection_things_count(collection_id)
-    result = es.count(index=index, body={"query": query})
-    data["count"] = result.get("count", 0)
-    cache.set_complex(key, data, expires=cache.EXPIRE)
-    return data
+    loaded = {}
+    for collection in Collection.all_by_ids(list(missing.keys())):
+        data = collection.to_dict()
+        data["count"] = 0
+        loaded[str(collection.id)] = data
+    if not len(loaded):
+        return collections
+
+    query = _things_count({"terms": {"collection_id": list(loaded.keys())}})
+    aggs = {"counts": {"terms": {"field": "collection_id", "size": len(loaded)}}}
+    body = {"size": 0, "query": query, "aggs": aggs}
+    result = es.search(index=entities_read_index(schema=Entity.THING), body=body)
+    buckets = result.get("aggregations", {}).get("counts", {}).get("buckets", [])
+    for bucket in buckets:
+        data = loaded.get(str(bucket["key"]))
+        if data is not None:
+            data["count"] = bucket["doc_count"]
+
+    values = {}
+    for collection_id, data in loaded.items():
+        collections[missing[collection_id]] = data
+        values[cache.object_key(Collection, collection_id)] = data
+    cache.set_many_complex(values, expires=cache.EXPIRE)
+    return collections
 
 
 def _facet_key(collection_id, facet):
@@ -160,8 +196,7 @@ def get_collection_stats(collection_id):
     return stats
 
 
-def update_collection_stats(collection_id, facets=STATS_FACETS):
-    """Compute some statistics on the content of a collection."""
+def _collection_stats_search(collection_id, facets):
     aggs = {}
     for facet in facets:
         # Regarding facet size, 300 would be optimal because it's
@@ -171,16 +206,51 @@ def update_collection_stats(collection_id, facets=STATS_FACETS):
         aggs[facet + ".values"] = {"terms": {"field": facet, "size": 100}}
         aggs[facet + ".total"] = {"cardinality": {"field": facet}}
     query = _collection_things_count(collection_id)
-    body = {"size": 0, "query": query, "aggs": aggs}
+    return {"size": 0, "query": query, "aggs": aggs, "timeout": "20m"}
+
+
+def update_collection_stats(collection_id, facets=STATS_FACETS):
+    """Compute some statistics on the content of a collection."""
+    update_collections_stats([collection_id], facets=facets)
+
+
+def update_collections_stats(collection_ids, facets=STATS_FACETS):
+    """Compute the statistics of many collections, with one multi-search
+    request per `STATS_BATCH_SIZE` collections, and store them in the cache
+    in a single round-trip per request."""
     index = entities_read_index()
-    result = es.search(index=index, body=body, request_timeout=3600, timeout="20m")
-    results = result.get("aggregations", {})
-    for facet in facets:
-        buckets = results.get(facet + ".values").get("buckets", [])
-        values = {b["key"]: b["doc_count"] for b in buckets}
-        total = results.get(facet + ".total", {}).get("value", 0)
-        data = {"values": values, "total": total}
-        cache.set_complex(_facet_key(collection_id, facet), data)
+    for chunk in batched(collection_ids, STATS_BATCH_SIZE):
+        body = []
+        for collection_id in chunk:
+            body.append({"index": index})
+            body.append(_collection_stats_search(collection_id, facets))
+        result = es.msearch(body=body, request_timeout=3600)
+        stats = {}
+        for collection_id, response in zip(chunk, result.get("responses", [])):
+            if "error" in response:
+                log.error(
+                    "[%s] Failed to compute stats: %r",
+                    collection_id,
+                    response["error"],
+                )
+                continue
+            results = response.get("aggregations", {})
+            for facet in facets:
+                buckets = results.get(facet + ".values").get("buckets", [])
+                values = {b["key"]: b["doc_count"] for b in buckets}
+                total = results.get(facet + ".total", {}).get("value", 0)
+                data = {"values": values, "total": total}
+                stats[_facet_key(collection_id, facet)] = data
+        cache.set_many_complex(stats)
+
+
+def _schema_things(schemata):
+    things = {}
+    for schema, count in schemata.get("values", {}).items():
+        schema = model.get(schema)
+        if schema is not None and schema.is_a(Entity.THING):
+            things[schema.name] = count
+    return things
 
 
 def get_collection_things(collection_id):
@@ -189,23 +259,214 @@ def get_collection_things(collection_id):
     schemata = cache.get_complex(_facet_key(collection_id, "schema"))
     if schemata is None:
         return {}
+    return _schema_things(schemata)
+
+
+def get_collections_things(collection_ids):
+    """Get the number of things in each of the given collections, with a
+    single cache lookup."""
+    keys = {_facet_key(c, "schema"): c for c in collection_ids}
     things = {}
-    for schema, count in schemata.get("values", {}).items():
-        schema = model.get(schema)
-        if schema is not None and schema.is_a(Entity.THING):
-            things[schema.name] = count
+    for key, schemata in cache.get_many_complex(list(keys.keys()), {}):
+        things[keys[key]] = _schema_things(schemata)
     return things
 
 
+def _ids_query(collection_id: int, entity_ids: list[str]) -> dict:
+    filters = [
+        {"term": {"collection_id": collection_id}},
+        {"ids": {"values": entity_ids}},
+    ]
+    return {"bool": {"filter": filters}}
+
+
+def count_entities(collection_id: int, index: str | None = None) -> int:
+    """Count all the entities of a collection in the index, or in the given
+    (comma-separated) indexes."""
+    query = {"term": {"collection_id": collection_id}}
+    index = index or entities_read_index()
+    result = es.count(index=index, body={"query": query})
+    return result.get("count", 0)
+
+
+def _indexed_at_utc(indexed_at: datetime) -> datetime:
+    """The search index writes the time an entity was indexed at as a naive
+    local time, while the aggregator keeps naive UTC fragment timestamps.
+    Convert the former to the clock of the latter, assuming the indexing
+    host runs in the same timezone as this one."""
+    return indexed_at.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _parse_indexed_at(value) -> datetime | None:
+    if value is None:
+        return None
+    return _indexed_at_utc(datetime.fromisoformat(value))
+
+
+def _min_indexed_at(aggregation: dict) -> datetime | None:
+    value = aggregation.get("value")
+    if value is None:
+        return None
+    # The naive local time is stored as if it was UTC
+    indexed_at = datetime.fromtimestamp(value / 1000, timezone.utc)
+    return _indexed_at_utc(indexed_at.replace(tzinfo=None))
+
+
+def count_entities_by_schema(
+    collection_id: int,
+) -> dict[str, tuple[int, datetime | None]]:
+    """Count the entities of each schema of a collection in the index, and
+    get the time the oldest of them was indexed at, with one aggregation."""
+    query = {"term": {"collection_id": collection_id}}
+    aggs = {
+        "schemata": {
+            "terms": {"field": Field.SCHEMA, "size": len(model.schemata)},
+            "aggs": {"indexed_at": {"min": {"field": Field.INDEX_TS}}},
+        }
+    }
+    body = {"size": 0, "query": query, "aggs": aggs}
+    result = es.search(index=entities_read_index(), body=body)
+    counts = {}
+    for bucket in result.get("aggregations", {}).get("schemata", {}).get("buckets", []):
+        indexed_at = _min_indexed_at(bucket.get("indexed_at", {}))
+        counts[bucket["key"]] = (bucket["doc_count"], indexed_at)
+    return counts
+
+
+def count_entities_by_ids(
+    collection_id: int, id_buckets: list[list[str]]
+) -> list[tuple[int, datetime | None]]:
+    """Count how many of the entity IDs in each bucket are in the index, and
+    get the time the oldest of them was indexed at, with a single
+    multi-search request."""
+    body = []
+    for entity_ids in id_buckets:
+        body.append({"index": entities_read_index()})
+        query = _ids_query(collection_id, entity_ids)
+        aggs = {"indexed_at": {"min": {"field": Field.INDEX_TS}}}
+        body.append({"size": 0, "track_total_hits": True, "query": query, "aggs": aggs})
+    if not len(body):
+        return []
+    results = es.msearch(body=body)
+    counts = []
+    for result in results.get("responses", []):
+        count = result.get("hits", {}).get("total", {}).get("value", 0)
+        indexed_at = result.get("aggregations", {}).get("indexed_at", {})
+        counts.append((count, _min_indexed_at(indexed_at)))
+    return counts
+
+
+def indexed_entity_ids(
+    collection_id: int, entity_ids: list[str]
+) -> dict[str, datetime | None]:
+    """Get those of the given entity IDs which are in the index, with the
+    time they were indexed at."""
+    query = _ids_query(collection_id, entity_ids)
+    body = {"size": len(entity_ids), "_source": [Field.INDEX_TS], "query": query}
+    result = es.search(index=entities_read_index(), body=body)
+    indexed = {}
+    for hit in result.get("hits", {}).get("hits", []):
+        value = hit.get("_source", {}).get(Field.INDEX_TS)
+        indexed[hit["_id"]] = _parse_indexed_at(value)
+    return indexed
+
+
+def get_content_hashes(
+    collection_id: int, entity_ids: list[str], version: str | None = None
+) -> dict[str, str]:
+    """Get the content hashes stored with the given entities in the indexes
+    being written (or those of the given version). The read indexes may be
+    an older version that is being rolled over from."""
+    query = _ids_query(collection_id, entity_ids)
+    body = {"size": len(entity_ids), "_source": [CONTENT_HASH], "query": query}
+    index = entities_version_index(version)
+    result = es.search(index=index, body=body, ignore_unavailable=True)
+    hashes = {}
+    for hit in result.get("hits", {}).get("hits", []):
+        value = hit.get("_source", {}).get(CONTENT_HASH)
+        if value is not None:
+            hashes[hit["_id"]] = value
+    return hashes
+
+
+def touch_entities(
+    collection_id: int,
+    entity_ids: list[str],
+    version: str | None = None,
+    sync: bool = False,
+):
+    """Update the time the given entities were indexed at, without indexing
+    them again. Entities left out of a reindex because they are unchanged
+    would otherwise look stale against their newer fragments."""
+    if not len(entity_ids):
+        return
+    # Same clock as the search index uses when formatting entities
+    now = datetime.now().isoformat()
+    script = {
+        "source": f"ctx._source.{Field.INDEX_TS} = params.now",
+        "params": {"now": now},
+    }
+    body = {"query": _ids_query(collection_id, entity_ids), "script": script}
+    es.update_by_query(
+        index=entities_version_index(version),
+        body=body,
+        conflicts="proceed",
+        refresh=sync,
+        ignore_unavailable=True,
+    )
+
+
 def delete_collection(collection_id, sync=False):
     """Delete all documents from a particular collection."""
     delete_safe(collections_index(), collection_id)
 
 
+def _wait_for_task(task_id: str) -> dict:
+    """Wait for a delete-by-query task of the search index to complete, and
+    log its progress while it runs. Raises a `TimeoutError` if it is not done
+    within `INDEX_DELETE_TIMEOUT` seconds, the task itself is left running."""
+    deadline = time.monotonic() + SETTINGS.INDEX_DELETE_TIMEOUT
+    while True:
+        res = es.tasks.get(task_id=task_id)
+        if res.get("completed"):
+            response = res.get("response", {})
+            for failure in response.get("failures", []):
+                log.warning("Delete failure: %r", failure)
+            return response
+        status = res.get("task", {}).get("status", {})
+        log.info(
+            "Deleted %d of %d documents...",
+            status.get("deleted", 0),
+            status.get("total", 0),
+        )
+        if time.monotonic() >= deadline:
+            raise TimeoutError(
+                f"Delete task {task_id} did not complete within "
+                f"{SETTINGS.INDEX_DELETE_TIMEOUT} seconds"
+            )
+        time.sleep(TASK_POLL_SECONDS)
+
+
 def delete_entities(collection_id, origin=None, schema=None, sync=False):
-    """Delete entities from a collection."""
+    """Delete entities from a collection. Deleting all of them is done with a
+    delete-by-query that is sliced across the shards of the indexes and, if
+    `sync` is set, waited for while its progress is logged. Deleting by
+    origin or schema waits for the request to complete."""
     filters = [{"term": {"collection_id": collection_id}}]
     if origin is not None:
         filters.append({"term": {"origin": origin}})
     query = {"bool": {"filter": filters}}
-    query_delete(entities_read_index(schema), query, sync=sync)
+    index = entities_read_index(schema)
+    if origin is not None or schema is not None:
+        query_delete(index, query, sync=sync)
+        return
+    res = query_delete(index, query, slices="auto")
+    if sync:
+        _wait_for_task(res["task"])
+        es.indices.refresh(index=index)
+
+
+def delete_entities_by_ids(collection_id, entity_ids, sync=False):
+    """Delete the given entities of a collection."""
+    query = _ids_query(collection_id, entity_ids)
+    query_delete(entities_read_index(), query, sync=sync)
@@ -1,7 +1,18 @@
 from openaleph_search.index.entities import index_proxy
+from openaleph_search.index.indexes import BUCKETS, bucket_index
+from openaleph_search.settings import Settings as SearchSettings
 
 from aleph.model.entity import Entity
 
+search_settings = SearchSettings()
+
+
+def entities_version_index(version: str | None = None) -> str:
+    """The entity indexes of an index version, comma-separated. By default,
+    those of the version being written."""
+    version = version or search_settings.index_write
+    return ",".join(bucket_index(bucket, version) for bucket in BUCKETS)
+
 
 def index_entity(entity: Entity):
     index_proxy(
@@ -15,16 +15,27 @@ from aleph.core import es
 log = logging.getLogger(__name__)
 XREF_SOURCE = {"excludes": ["text", "countries", "entityset_ids"]}
 MAX_NAMES = 30
+# Both entities of a pair from the same collection are matched against each
+# other, and the scores can differ. Only the higher scored match is kept.
+KEEP_BEST = """
+if (ctx._source.score == null || params.match.score > ctx._source.score) {
+    ctx._source = params.match;
+} else {
+    ctx.op = 'noop';
+}
+"""
 
 
 def xref_index():
-    return index_name("xref", "v1")
+    return index_name("xref", "v2")
 
 
 def configure_xref():
     mapping = {
         "date_detection": False,
         "dynamic": False,
+        # All matches of a collection live on one shard, see `xref_routing`
+        "_routing": {"required": True},
         "properties": {
             "score": {"type": "float"},
             "doubt": {"type": "float"},
@@ -47,33 +58,51 @@ def configure_xref():
     return configure_index(xref_index(), mapping, settings)
 
 
+def xref_routing(collection_id):
+    """Matches are routed by the collection they were generated for, so that
+    listing and deleting the matches of a collection only hit a single shard."""
+    return str(collection_id)
+
+
+def _xref_id(collection_id, entity_id, match_id):
+    """Get the canonical ID of a match. The pair of entities is unordered, so
+    a pair of entities from the same collection is only stored once no matter
+    which of them was matched against the other, see `KEEP_BEST`."""
+    return hash_data((collection_id, *sorted((entity_id, match_id))))
+
+
 def _index_form(collection, matches):
     now = datetime.utcnow().isoformat()
     for match in matches:
-        xref_id = hash_data((match.entity.id, collection.id, match.match.id))
+        xref_id = _xref_id(collection.id, match.entity.id, match.match.id)
         text = set([match.entity.caption, match.match.caption])
         text.update(match.entity.get_type_values(registry.name)[:MAX_NAMES])
         text.update(match.match.get_type_values(registry.name)[:MAX_NAMES])
         countries = set(match.entity.get_type_values(registry.country))
         countries.update(match.match.get_type_values(registry.country))
+        source = {
+            "score": match.score,
+            "doubt": match.doubt,
+            "method": match.method,
+            "random": randint(1, 2**31),
+            "entity_id": match.entity.id,
+            "schema": match.match.schema.name,
+            "collection_id": collection.id,
+            "entityset_ids": list(match.entityset_ids),
+            "match_id": match.match.id,
+            "match_collection_id": match.collection_id,
+            "countries": list(countries),
+            "text": list(text),
+            "created_at": now,
+        }
         yield {
+            "_op_type": "update",
             "_id": xref_id,
             "_index": xref_index(),
-            "_source": {
-                "score": match.score,
-                "doubt": match.doubt,
-                "method": match.method,
-                "random": randint(1, 2**31),
-                "entity_id": match.entity.id,
-                "schema": match.match.schema.name,
-                "collection_id": collection.id,
-                "entityset_ids": list(match.entityset_ids),
-                "match_id": match.match.id,
-                "match_collection_id": match.collection_id,
-                "countries": list(countries),
-                "text": list(text),
-                "created_at": now,
-            },
+            "_routing": xref_routing(collection.id),
+            "_retry_on_conflict": 3,
+            "script": {"source": KEEP_BEST, "params": {"match": source}},
+            "upsert": source,
         }
 
 
@@ -89,20 +118,40 @@ def iter_matches(collection, authz):
         authz.search_auth.datasets_query("match_collection_id"),
     ]
     query = {"query": {"bool": {"filter": filters}}, "_source": XREF_SOURCE}
-    for res in scan(es, index=xref_index(), query=query):
+    routing = xref_routing(collection.id)
+    for res in scan(es, index=xref_index(), query=query, routing=routing):
         yield unpack_result(res)
 
 
-def delete_xref(collection, entity_id=None, sync=False):
-    """Delete xref matches of an entity or a collection."""
-    shoulds = [
-        {"term": {"collection_id": collection.id}},
-        {"term": {"match_collection_id": collection.id}},
-    ]
+def delete_xref(
+    collection, entity_id=None, entity_ids=None, incoming=False, sync=False
+):
+    """Delete xref matches of an entity or a collection. If a list of
+    `entity_ids` is given, only the matches of these entities within the
+    collection are removed. Deleting the matches of a collection only touches
+    its own shard, unless `incoming` also removes the matches other
+    collections found in it."""
     if entity_id is not None:
+        # Other collections may have matched the entity, so this has to go
+        # to all shards.
         shoulds = [
             {"term": {"entity_id": entity_id}},
             {"term": {"match_id": entity_id}},
         ]
-    query = {"bool": {"should": shoulds, "minimum_should_match": 1}}
-    query_delete(xref_index(), query, sync=sync)
+        query = {"bool": {"should": shoulds, "minimum_should_match": 1}}
+        query_delete(xref_index(), query, sync=sync)
+        return
+
+    filters = [{"term": {"collection_id": collection.id}}]
+    if entity_ids is not None:
+        entity_ids = list(entity_ids)
+        shoulds = [
+            {"terms": {"entity_id": entity_ids}},
+            {"terms": {"match_id": entity_ids}},
+        ]
+        filters.append({"bool": {"should": shoulds, "minimum_should_match": 1}})
+    query = {"bool": {"filter": filters}}
+    query_delete(xref_index(), query, sync=sync, routing=xref_routing(collection.id))
+    if incoming and entity_ids is None:
+        query = {"term": {"match_collection_id": collection.id}}
+        query_delete(xref_index(), query, sync=sync)
@@ -1,6 +1,7 @@
 from ftmq.store.fragments import get_fragments
 from ftmq.store.fragments.dataset import Fragments
 from openaleph_procrastinate.settings import OpenAlephSettings
+from sqlalchemy import func, select, text
 
 MODEL_ORIGIN = "model"
 settings = OpenAlephSettings()
@@ -14,3 +15,102 @@ def get_aggregator(collection, origin="aleph") -> Fragments:
     """Connect to a followthemoney dataset."""
     dataset = get_aggregator_name(collection)
     return get_fragments(dataset, origin=origin, database_uri=settings.fragments_uri)
+
+
+def truncate_aggregator(aggregator: Fragments):
+    """Remove all fragments of an aggregator at once, instead of deleting
+    them row by row."""
+    table = aggregator.table
+    with aggregator.store.engine.connect() as conn:
+        if aggregator.store.is_postgres:
+            conn.execute(text(f'TRUNCATE TABLE "{table.name}"'))
+        else:
+            conn.execute(table.delete())
+        conn.commit()
+
+
+def _schema_column(aggregator: Fragments):
+    table = aggregator.table
+    if aggregator.store.is_postgres:
+        return table.c.entity["schema"].astext
+    return func.json_extract(table.c.entity, "$.schema")
+
+
+def get_sorted_id_batches_after(
+    aggregator: Fragments,
+    batch_size: int,
+    after: str | None = None,
+    schema: str | None = None,
+    since=None,
+    until=None,
+    origin: str | None = None,
+):
+    """Like `Fragments.get_sorted_id_batches`, but starting after the given
+    entity ID. The cursor is compared by the database, so that it follows
+    the same collation as the sort order of the batches."""
+    table = aggregator.table
+    last_id = after
+    while True:
+        stmt = select(table.c.id).distinct()
+        if origin is not None:
+            stmt = stmt.where(table.c.origin == origin)
+        if last_id is not None:
+            stmt = stmt.where(table.c.id > last_id)
+        if schema is not None:
+            stmt = stmt.where(_schema_column(aggregator) == schema)
+        if since is not None:
+            stmt = stmt.where(table.c.timestamp >= since)
+        if until is not None:
+            stmt = stmt.where(table.c.timestamp <= until)
+        stmt = stmt.order_by(table.c.id).limit(batch_size)
+        with aggregator.store.engine.connect() as conn:
+            entity_ids = [r.id for r in conn.execute(stmt).fetchall()]
+        if not entity_ids:
+            return
+        yield entity_ids
+        last_id = entity_ids[-1]
+
+
+def count_aggregator_entities(aggregator: Fragments) -> int:
+    """Count the distinct entities of an aggregator."""
+    table = aggregator.table
+    stmt = select(func.count(table.c.id.distinct()))
+    with aggregator.store.engine.connect() as conn:
+        return conn.execute(stmt).scalar() or 0
+
+
+def get_schema_timestamps(aggregator: Fragments) -> dict:
+    """Count the entities with fragments of each schema, and get the time of
+    the latest of these fragments, in a single grouped query. An entity with
+    fragments of several schemata is counted for each of them."""
+    table = aggregator.table
+    schema = _schema_column(aggregator)
+    stmt = select(
+        schema, func.count(table.c.id.distinct()), func.max(table.c.timestamp)
+    )
+    stmt = stmt.group_by(schema)
+    with aggregator.store.engine.connect() as conn:
+        return {name: (count, ts) for name, count, ts in conn.execute(stmt)}
+
+
+def get_bucket_timestamps(aggregator: Fragments, buckets: list[list[str]]) -> list:
+    """Get the time of the latest fragment written for each bucket of sorted
+    entity IDs, by the range of IDs the bucket spans."""
+    table = aggregator.table
+    timestamps = []
+    with aggregator.store.engine.connect() as conn:
+        for bucket in buckets:
+            stmt = select(func.max(table.c.timestamp))
+            stmt = stmt.where(table.c.id >= bucket[0], table.c.id <= bucket[-1])
+            timestamps.append(conn.execute(stmt).scalar())
+    return timestamps
+
+
+def get_entity_timestamps(aggregator: Fragments, entity_ids: list[str]) -> dict:
+    """Get the time of the latest fragment written for each of the given
+    entities."""
+    table = aggregator.table
+    stmt = select(table.c.id, func.max(table.c.timestamp))
+    stmt = stmt.where(table.c.id.in_(entity_ids)).group_by(table.c.id)
+    with aggregator.store.engine.connect() as conn:
+        return {entity_id: ts for entity_id, ts in conn.execute(stmt)}
@@ -0,0 +1,289 @@
+"""A local blocking index for cross-referencing.
+
+The blocking index maps the name fingerprint tokens, identifiers and email
+addresses of all matchable entities to their IDs, in an SQLite database on
+local disk which is memory-mapped for reading. Cross-referencing can use it
+to find the candidates of an entity by looking up the entities sharing the
+most keys with it, instead of running a match query against the index.
+
+Each collection is marked as built once all of its entities have been written
+to the index (`aleph xref-blocking`, or when it is created), and the index is
+only used while every collection is built. It is refreshed for every batch of
+entities indexed from the aggregator and every entity indexed on its own (e.g.
+when edited), and deleted entities and collections are removed from it.
+Entities removed from the search index in bulk otherwise may linger, they are
+dropped when the candidates are fetched by ID. Entities without any candidates
+in the blocking index are matched with a match query instead.
+
+The index is a file on local disk, so it only works if all indexing and
+cross-referencing runs on a single host. Parallel reindex processes write to it
+concurrently, and SQLite only lets one of them write at a time.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from itertools import batched
+from typing import Callable, Iterable
+
+from followthemoney import EntityProxy, model
+from followthemoney.types import registry
+from openaleph_search.index.entities import iter_proxies
+
+from aleph.logic.util import entity_fingerprints
+from aleph.model import Collection
+from aleph.settings import SETTINGS
+
+log = logging.getLogger(__name__)
+MMAP_SIZE = 2**30
+WRITE_BATCH = 1000
+# Seconds to wait for the write lock, and attempts to get it after that
+BUSY_TIMEOUT = 60
+WRITE_RETRIES = 5
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS collections (
+    collection_id INTEGER PRIMARY KEY,
+    built_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entities (
+    entity_id TEXT PRIMARY KEY,
+    collection_id INTEGER NOT NULL,
+    schema TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entities_collection ON entities (collection_id);
+CREATE TABLE IF NOT EXISTS blocks (
+    key TEXT NOT NULL,
+    entity_id TEXT NOT NULL,
+    PRIMARY KEY (key, entity_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS blocks_entity ON blocks (entity_id);
+"""
+
+
+def _normalize_identifier(value: str) -> str:
+    return "".join(c for c in value if c.isalnum()).lower()
+
+
+def entity_keys(proxy: EntityProxy) -> set[str]:
+    """Get the blocking keys of an entity: the tokens of its name
+    fingerprints, its identifiers and its email addresses."""
+    keys = set()
+    for fingerprint in entity_fingerprints(proxy):
+        keys.update(f"n:{t}" for t in fingerprint.split() if len(t) > 1)
+    for value in proxy.get_type_values(registry.identifier):
+        value = _normalize_identifier(value)
+        if len(value):
+            keys.add(f"i:{value}")
+    for value in proxy.get_type_values(registry.email):
+        keys.add(f"e:{value.lower()}")
+    return keys
+
+
+class BlockingIndex:
+    def __init__(self, path: str):
+        self.path = path
+        self.local = threading.local()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # SQLite connections cannot be shared across threads, e.g. those of
+        # the xref pipeline, so each thread opens its own.
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+            conn.executescript(SCHEMA)
+            self.local.conn = conn
+        return conn
+
+    def _write(self, func: Callable[[sqlite3.Connection], None]):
+        """Run a write in a transaction which takes the write lock upfront,
+        waiting for other processes to release it. If it cannot be acquired
+        within the busy timeout, the write is retried a few times."""
+        attempt = 0
+        while True:
+            try:
+                with self.conn:
+                    self.conn.execute("BEGIN IMMEDIATE")
+                    func(self.conn)
+                return
+            except sqlite3.OperationalError as exc:
+                busy = exc.sqlite_errorcode == sqlite3.SQLITE_BUSY
+                if not busy or attempt >= WRITE_RETRIES:
+                    raise
+                attempt += 1
+                log.warning(f"Xref blocking index is locked, retry {attempt}...")
+                time.sleep(min(2**attempt, 60))
+
+    def is_warm(self, collection_ids: Iterable[int]) -> bool:
+        """Check if the index has been built for all the given collections."""
+        query = "SELECT collection_id FROM collections"
+        built = {row[0] for row in self.conn.execute(query)}
+        return built.issuperset(collection_ids)
+
+    def set_built(self, collection_id: int):
+        """Mark a collection whose entities have all been written as built."""
+        built_at = datetime.utcnow().isoformat()
+        self._write(
+            lambda conn: conn.execute(
+                "INSERT OR REPLACE INTO collections VALUES (?, ?)",
+                (collection_id, built_at),
+            )
+        )
+
+    def put_many(self, collection_id: int, proxies: list[EntityProxy]):
+        """Replace the blocking keys of the given entities."""
+        entities = []
+        blocks = []
+        for proxy in proxies:
+            if proxy.id is None or not proxy.schema.matchable:
+                continue
+            entities.append((proxy.id, collection_id, proxy.schema.name))
+            blocks.extend((key, proxy.id) for key in entity_keys(proxy))
+        if not len(entities):
+            return
+
+        def _put(conn: sqlite3.Connection):
+            conn.executemany(
+                "DELETE FROM blocks WHERE entity_id = ?",
+                [(e[0],) for e in entities],
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO entities VALUES (?, ?, ?)", entities
+            )
+            conn.executemany("INSERT OR IGNORE INTO blocks VALUES (?, ?)", blocks)
+
+        self._write(_put)
+
+    def delete_entities(self, entity_ids: Iterable[str]):
+        params = [(entity_id,) for entity_id in entity_ids]
+
+        def _delete(conn: sqlite3.Connection):
+            conn.executemany("DELETE FROM blocks WHERE entity_id = ?", params)
+            conn.executemany("DELETE FROM entities WHERE entity_id = ?", params)
+
+        self._write(_delete)
+
+    def delete_collection(self, collection_id: int):
+        """Remove the entities of a collection and mark it as not built."""
+
+        def _delete(conn: sqlite3.Connection):
+            conn.execute(
+                "DELETE FROM blocks WHERE entity_id IN "
+                "(SELECT entity_id FROM entities WHERE collection_id = ?)",
+                (collection_id,),
+            )
+            conn.execute(
+                "DELETE FROM entities WHERE collection_id = ?", (collection_id,)
+            )
+            conn.execute(
+                "DELETE FROM collections WHERE collection_id = ?", (collection_id,)
+            )
+
+        self._write(_delete)
+
+    def _selective_keys(self, keys: set[str]) -> list[str]:
+        """Drop the keys shared by too many entities to tell them apart, like
+        common name tokens. Counting stops at the limit to keep this cheap."""
+        limit = SETTINGS.XREF_BLOCKING_MAX_BLOCK
+        query = "SELECT COUNT(*) FROM (SELECT 1 FROM blocks WHERE key = ? LIMIT ?)"
+        selective = []
+        for key in keys:
+            (count,) = self.conn.execute(query, (key, limit + 1)).fetchone()
+            if count <= limit:
+                selective.append(key)
+        return selective
+
+    def candidates(
+        self, proxy: EntityProxy, schemata: list[str], limit: int = 50
+    ) -> list[str]:
+        """Get the IDs of the entities of the given schemata which share the
+        most blocking keys with the given entity."""
+        keys = self._selective_keys(entity_keys(proxy))
+        if not len(keys) or not len(schemata):
+            return []
+        query = (
+            "SELECT b.entity_id FROM blocks b "
+            "JOIN entities e ON e.entity_id = b.entity_id "
+            f"WHERE b.key IN ({', '.join('?' * len(keys))}) "
+            "AND b.entity_id != ? "
+            f"AND e.schema IN ({', '.join('?' * len(schemata))}) "
+            "GROUP BY b.entity_id ORDER BY COUNT(*) DESC LIMIT ?"
+        )
+        params = [*keys, proxy.id, *schemata, limit]
+        return [row[0] for row in self.conn.execute(query, params)]
+
+    def writer(self, collection_id: int) -> "BlockingWriter":
+        return BlockingWriter(self, collection_id)
+
+
+class BlockingWriter:
+    """Buffer the entities of a collection and write them in batches."""
+
+    def __init__(self, index: BlockingIndex, collection_id: int):
+        self.index = index
+        self.collection_id = collection_id
+        self.buffer = []
+
+    def put(self, proxy: EntityProxy):
+        self.buffer.append(proxy)
+        if len(self.buffer) >= WRITE_BATCH:
+            self.flush()
+
+    def flush(self):
+        self.index.put_many(self.collection_id, self.buffer)
+        self.buffer = []
+
+
+_INDEXES: dict[str, BlockingIndex] = {}
+
+
+def get_blocking_index() -> BlockingIndex | None:
+    """Get the blocking index, if one is configured."""
+    path = SETTINGS.XREF_BLOCKING_PATH
+    if not path:
+        return None
+    if path not in _INDEXES:
+        _INDEXES[path] = BlockingIndex(path)
+    return _INDEXES[path]
+
+
+def get_warm_blocking_index() -> BlockingIndex | None:
+    """Get the blocking index if it can be used to generate candidates, which
+    is once it has been built for all collections."""
+    blocking = get_blocking_index()
+    if blocking is None:
+        return None
+    collection_ids = [collection_id for (collection_id,) in Collection.all_ids()]
+    if not blocking.is_warm(collection_ids):
+        return None
+    return blocking
+
+
+def update_blocking_collection(blocking: BlockingIndex, collection: Collection):
+    """Rebuild the blocking keys of all the entities in a collection."""
+    log.info(f"[{collection}] Building xref blocking index...")
+    blocking.delete_collection(collection.id)
+    proxies = iter_proxies(
+        collection_id=collection.id,
+        schemata=[s.name for s in model if s.matchable],
+        es_scroll=SETTINGS.XREF_SCROLL,
+        es_scroll_size=SETTINGS.XREF_SCROLL_SIZE,
+    )
+    for batch in batched(proxies, WRITE_BATCH):
+        blocking.put_many(collection.id, list(batch))
+    blocking.set_built(collection.id)
+
+
+def build_blocking_index():
+    """Build the blocking index for all collections."""
+    blocking = get_blocking_index()
+    if blocking is None:
+        log.warning("No xref blocking index configured.")
+        return
+    for collection in Collection.all():
+        update_blocking_collection(blocking, collection)
@@ -1,21 +1,46 @@
+import hashlib
+import json
+import multiprocessing
 import time
 from collections import defaultdict
-from datetime import datetime
+from concurrent.futures import (
+    ALL_COMPLETED,
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    wait,
+)
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from itertools import batched, chain
 from typing import Generator
 
 import dateparser
 from anystore.logging import get_logger
+from followthemoney import EntityProxy
 from followthemoney.dataset.util import dataset_name_check
 from openaleph_procrastinate.manage import cancel_jobs
 from openaleph_procrastinate.settings import OPENALEPH_MANAGEMENT_QUEUE
+from openaleph_search import __version__ as search_version
 from openaleph_search.index import entities as entities_index
 from servicelayer.jobs import Job
 
 from aleph.authz import Authz
 from aleph.core import cache, db
+from aleph.index import admin as index_admin
+from aleph.index import bulk
 from aleph.index import collections as index
 from aleph.index import xref as xref_index
-from aleph.logic.aggregator import get_aggregator, get_aggregator_name
+from aleph.logic.aggregator import (
+    count_aggregator_entities,
+    get_aggregator,
+    get_aggregator_name,
+    get_bucket_timestamps,
+    get_entity_timestamps,
+    get_schema_timestamps,
+    get_sorted_id_batches_after,
+    truncate_aggregator,
+)
+from aleph.logic.blocking import get_blocking_index
 from aleph.logic.discover import update_collection_discovery
 from aleph.logic.documents import (
     MODEL_ORIGIN,
@@ -36,11 +61,20 @@ from aleph.model import (
 from aleph.procrastinate.queues import (
     queue_cancel_collection,
     queue_index_batch,
-    queue_ingest,
+    queue_ingest_many,
 )
 from aleph.procrastinate.status import get_collection_status
+from aleph.settings import SETTINGS
 
 log = get_logger(__name__)
+TAGS_BLOCK_SIZE = 1000
+AGGREGATE_BATCH_SIZE = 1000
+DIFF_BUCKET_SIZE = 10_000
+DIFF_BUCKETS_PER_REQUEST = 10
+DIFF_LEAF_SIZE = 100
+# Fragment timestamps are set by the writing hosts, so look back a little
+# further than the watermark to allow for clock skew between them
+WATERMARK_OVERLAP = timedelta(minutes=5)
 
 
 def _parse_timestamp(timestamp_str: str | None) -> datetime | None:
@@ -75,6 +109,10 @@ def create_collection(data, authz, sync=False):
             actor_id=authz.id,
         )
     db.session.commit()
+    blocking = get_blocking_index()
+    if blocking is not None and collection.created_at == now:
+        # A new collection has no entities yet, they are added once indexed
+        blocking.set_built(collection.id)
     return update_collection(collection, sync=sync)
 
 
@@ -87,7 +125,13 @@ def update_collection(collection, sync=False):
 
 def refresh_collection(collection_id):
     """Operations to execute after updating a collection-related
-    domain object. This will refresh stats and flush cache."""
+    domain object. This will flush cache and mark the collection for its
+    stats to be refreshed by the next `compute_collections` run."""
+    _flush_collection_cache(collection_id)
+    mark_collection_dirty(collection_id)
+
+
+def _flush_collection_cache(collection_id):
     cache.kv.delete(
         cache.object_key(Collection, collection_id),
         cache.object_key(Collection, collection_id, "stats"),
@@ -95,6 +139,30 @@ def refresh_collection(collection_id):
     )
 
 
+def _dirty_key():
+    return cache.key(Collection.__name__, "dirty")
+
+
+def _sweep_key():
+    return cache.key(Collection.__name__, "sweep")
+
+
+def mark_collection_dirty(collection_id):
+    """Flag a collection as changed since the last `compute_collections`."""
+    cache.kv.sadd(_dirty_key(), collection_id)
+
+
+def _take_dirty_collections() -> set:
+    """Read and clear the dirty collections in one transaction, so that a
+    collection marked again while they are computed is kept for the next
+    run."""
+    pipe = cache.kv.pipeline(transaction=True)
+    pipe.smembers(_dirty_key())
+    pipe.delete(_dirty_key())
+    dirty, _ = pipe.execute()
+    return dirty
+
+
 def get_deep_collection(collection):
     mappings = Mapping.by_collection(collection.id).count()
     entitysets = EntitySet.type_counts(collection_id=collection.id)
@@ -109,23 +177,51 @@ def get_deep_collection(collection):
     }
 
 
-def compute_collections():
-    """Update collection caches, including the global stats cache."""
+def compute_collections(full=False):
+    """Update collection caches, including the global stats cache.
+
+    Only the collections marked as dirty since the last run are computed.
+    All of them are checked in a full sweep every `COLLECTION_STATS_SWEEP`
+    seconds, or if `full` is set, to catch changes that were not marked.
+    """
     authz = Authz.from_role(None)
     schemata = defaultdict(int)
     countries = defaultdict(int)
     categories = defaultdict(int)
 
-    for collection in Collection.all():
-        compute_collection(collection)
-
-        if authz.can(collection.id, authz.READ):
-            categories[collection.category] += 1
-            things = index.get_collection_things(collection.id)
-            for schema, count in things.items():
-                schemata[schema] += count
-            for country in collection.countries:
-                countries[country] += 1
+    full = full or cache.get(_sweep_key()) is None
+    dirty = _take_dirty_collections()
+    dirty_ids = {int(collection_id) for collection_id in dirty}
+    try:
+        public = []
+        pending = []
+        for collection in Collection.all():
+            if full or collection.id in dirty_ids:
+                pending.append(collection)
+
+            if authz.can(collection.id, authz.READ):
+                categories[collection.category] += 1
+                public.append(collection)
+                for country in collection.countries:
+                    countries[country] += 1
+
+        computed = _stats_computed([c.id for c in pending])
+        _compute_collections([c for c in pending if c.id not in computed])
+    except BaseException:
+        # Keep the collections for the next run if computing them failed
+        if len(dirty):
+            cache.kv.sadd(_dirty_key(), *dirty)
+        raise
+
+    # Fetch the cached counts of all public collections in one go
+    things = index.get_collections_things([c.id for c in public])
+    for collection_things in things.values():
+        for schema, count in collection_things.items():
+            schemata[schema] += count
+
+    if full:
+        sweep = datetime.utcnow().isoformat()
+        cache.set(_sweep_key(), sweep, expires=SETTINGS.COLLECTION_STATS_SWEEP)
 
     log.info("Updating global statistics cache...")
     data = {
@@ -139,20 +235,39 @@ def compute_collections():
     cache.set_complex(key, data, expires=cache.EXPIRE)
 
 
+def _stats_key(collection_id):
+    return cache.object_key(Collection, collection_id, "stats")
+
+
+def _stats_computed(collection_ids) -> set[int]:
+    """Get those of the given collections whose stats are up to date."""
+    keys = [_stats_key(collection_id) for collection_id in collection_ids]
+    if not len(keys):
+        return set()
+    values = cache.kv.mget(keys)
+    return {c for c, v in zip(collection_ids, values) if v is not None}
+
+
 def compute_collection(collection: Collection, force=False, sync=False):
-    key = cache.object_key(Collection, collection.id, "stats")
-    if cache.get(key) is not None and not force:
+    if not force and cache.get(_stats_key(collection.id)) is not None:
         return
-    refresh_collection(collection.id)
-    log.info(
-        f"[{collection.foreign_id}] Computing statistics...",
-        dataset=collection.name,
-    )
-    index.update_collection_stats(collection.id)
-    update_collection_discovery(collection.id, collection.name)
+    _compute_collections([collection], sync=sync)
+
 
-    cache.set(key, datetime.utcnow().isoformat())
-    index.index_collection(collection, sync=sync)
+def _compute_collections(collections: list[Collection], sync=False):
+    """Compute the statistics of the given collections, in batches, and
+    update their discovery data and collection documents."""
+    for collection in collections:
+        _flush_collection_cache(collection.id)
+        log.info(
+            f"[{collection.foreign_id}] Computing statistics...",
+            dataset=collection.name,
+        )
+    index.update_collections_stats([c.id for c in collections])
+    for collection in collections:
+        update_collection_discovery(collection.id, collection.name)
+        cache.set(_stats_key(collection.id), datetime.utcnow().isoformat())
+        index.index_collection(collection, sync=sync)
 
 
 def aggregate_model(collection: Collection, aggregator):
@@ -165,15 +280,41 @@ def aggregate_model(collection: Collection, aggregator):
             log.info(f"[model aggregate] Document {ix} ...")
         proxy = document.to_proxy(ns=collection.ns)
         writer.put(proxy, fragment="db", origin=MODEL_ORIGIN)
-    for ix, entity in enumerate(Entity.by_collection(collection.id), 1):
-        if ix % 10_000 == 0:
-            log.info(f"[model aggregate] Entity {ix} ...")
-        proxy = entity.to_proxy()
-        aggregator.delete(entity_id=proxy.id)
-        writer.put(proxy, fragment="db", origin=MODEL_ORIGIN)
+    ix = 0
+    entities = Entity.by_collection(collection.id)
+    for batch in batched(entities, AGGREGATE_BATCH_SIZE):
+        proxies = [entity.to_proxy() for entity in batch]
+        # Drop the previous fragments of the whole batch in one statement
+        aggregator.delete_many([proxy.id for proxy in proxies])
+        for proxy in proxies:
+            ix += 1
+            if ix % 10_000 == 0:
+                log.info(f"[model aggregate] Entity {ix} ...")
+            writer.put(proxy, fragment="db", origin=MODEL_ORIGIN)
     writer.flush()
 
 
+def _tags_map(collection: Collection, entity_ids: list[str]) -> dict[str, set[str]]:
+    """Get the tags of a block of entities in the collection."""
+    tags_map = defaultdict(set)
+    tags_query = db.session.query(Tag.entity_id, Tag.tag).filter(
+        Tag.collection_id == collection.id, Tag.entity_id.in_(entity_ids)
+    )
+    for entity_id, tag in tags_query:
+        tags_map[entity_id].add(tag)
+    return tags_map
+
+
+def content_hash(collection: Collection, proxy: EntityProxy) -> str:
+    """Hash everything the indexed document of an entity is built from, so
+    that unchanged entities can be told apart without formatting them."""
+    data = proxy.to_dict()
+    data.pop(index.CONTENT_HASH, None)
+    key = [search_version, collection.name, collection.id, data]
+    encoded = json.dumps(key, sort_keys=True, default=str)
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
+
 def index_aggregator(
     collection: Collection,
     aggregator,
@@ -181,53 +322,75 @@ def index_aggregator(
     skip_errors=False,
     sync=False,
     schema=None,
+    skip_unchanged: bool | None = None,
+    version: str | None = None,
 ):
+    started = datetime.utcnow()
+    blocking = get_blocking_index()
+    if skip_unchanged is None:
+        skip_unchanged = SETTINGS.INDEX_SKIP_UNCHANGED
+
     def _generate():
         idx = 0
+        skipped = 0
+        writer = blocking.writer(collection.id) if blocking is not None else None
         entities = aggregator.iterate(
             entity_id=entity_ids, skip_errors=skip_errors, schema=schema
         )
 
-        # Batch fetch all tags for all entities at once
-        tags_map = defaultdict(set)
-        if entity_ids:
-            tags_query = db.session.query(Tag).filter(
-                Tag.entity_id.in_(entity_ids), Tag.collection_id == collection.id
-            )
-            for tag in tags_query.all():
-                tags_map[tag.entity_id].add(tag.tag)
-        else:
-            # If no specific entity_ids, prefetch all tags for the collection
-            tags_query = db.session.query(Tag).filter(
-                Tag.collection_id == collection.id
-            )
-            for tag in tags_query.all():
-                tags_map[tag.entity_id].add(tag.tag)
-
-        # Now iterate through entities and add tags
-        for idx, proxy in enumerate(entities, 1):
-            if idx > 0 and idx % 1000 == 0:
-                log.debug(
-                    f"[{collection}] Index: {idx}...",
-                    dataset=collection.name,
+        # Join the tags block by block as the entities stream past, instead
+        # of loading every tag of the collection up front.
+        for block in batched(entities, TAGS_BLOCK_SIZE):
+            block_ids = [proxy.id for proxy in block]
+            tags_map = _tags_map(collection, block_ids)
+            hashes = {}
+            if skip_unchanged:
+                hashes = index.get_content_hashes(
+                    collection.id, block_ids, version=version
                 )
-
-            # Add tags to entity context if any exist
-            if proxy.id in tags_map:
-                proxy.context["tags"] = list(tags_map[proxy.id])
-
-            yield proxy
+            unchanged = []
+            for proxy in block:
+                idx += 1
+                if idx % 1000 == 0:
+                    log.debug(
+                        f"[{collection}] Index: {idx}...",
+                        dataset=collection.name,
+                    )
+
+                # Add tags to entity context if any exist
+                if proxy.id in tags_map:
+                    proxy.context["tags"] = sorted(tags_map[proxy.id])
+
+                if writer is not None:
+                    writer.put(proxy)
+
+                # Leave out entities whose indexed document would not change
+                digest = content_hash(collection, proxy)
+                if hashes.get(proxy.id) == digest:
+                    unchanged.append(proxy.id)
+                    continue
+                proxy.context[index.CONTENT_HASH] = digest
+                yield proxy
+            # Their fragments may still be newer than when they were indexed
+            index.touch_entities(collection.id, unchanged, version=version, sync=sync)
+            skipped += len(unchanged)
+        if writer is not None:
+            writer.flush()
         log.debug(
-            f"[{collection}] Indexed {idx} entities",
+            f"[{collection}] Indexed {idx - skipped} entities, " f"{skipped} unchanged",
             dataset=collection.name,
         )
 
-    entities_index.index_bulk(
+    bulk.index_bulk(
         collection.name,
         _generate(),
         sync=sync,
+        version=version,
         collection_id=collection.id,
     )
+    # All fragments written before this started are indexed now
+    if entity_ids is None and schema is None and version is None:
+        _set_index_watermark(collection, started)
 
 
 def reingest_collection(collection, job_id=None, index_flush=True, ingest_flush=True):
@@ -239,9 +402,12 @@ def reingest_collection(collection, job_id=None, index_flush=True, ingest_flush=
         _ingest_flush(collection)
     if index_flush:
         _index_flush(collection)
-    for document in Document.by_collection(collection.id):
-        proxy = document.to_proxy(ns=collection.ns)
-        queue_ingest(collection, proxy, batch=job_id, namespace=collection.foreign_id)
+    documents = Document.by_collection(collection.id)
+    proxies = (document.to_proxy(ns=collection.ns) for document in documents)
+    for batch in batched(proxies, SETTINGS.CRAWL_BATCH_SIZE):
+        queue_ingest_many(
+            collection, list(batch), batch=job_id, namespace=collection.foreign_id
+        )
 
 
 def _process_mappings(collection: Collection, aggregator):
@@ -321,6 +487,7 @@ def _index_batch(
     skip_errors: bool | None = True,
     sync: bool | None = False,
     schema: str | None = None,
+    version: str | None = None,
 ) -> None:
     aggregator = get_aggregator(collection)
     if queue_batches:
@@ -341,9 +508,126 @@ def _index_batch(
             skip_errors=bool(skip_errors),
             sync=bool(sync),
             schema=schema,
+            version=version,
         )
 
 
+def _init_index_worker():
+    """Give a reindex worker process its own app context and connections."""
+    from aleph.core import create_app
+
+    create_app().app_context().push()
+
+
+def _index_batch_worker(
+    collection_id: int,
+    entity_ids: list[str],
+    skip_errors: bool,
+    sync: bool,
+    schema: str | None,
+    version: str | None = None,
+) -> int:
+    collection = Collection.by_id(collection_id)
+    _index_batch(collection, entity_ids, False, skip_errors, sync, schema, version)
+    return len(entity_ids)
+
+
+class IndexWorkerPool(ProcessPoolExecutor):
+    """A pool of processes to reindex batches of entities (or diff collections)
+    in parallel. Each process runs its own bulk stream, with as many requests
+    in flight as the search indexer concurrency allows."""
+
+    def __init__(self, workers: int):
+        super().__init__(
+            workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_index_worker,
+        )
+        self.workers = workers
+
+
+def _index_batches_parallel(
+    collection: Collection,
+    batches,
+    pool: IndexWorkerPool,
+    skip_errors: bool,
+    sync: bool,
+    schema: str | None = None,
+    checkpoint: dict | None = None,
+    version: str | None = None,
+):
+    """Index batches of entity IDs across a pool of worker processes, keeping
+    at most two batches per worker pending, and report the progress."""
+    start_time = time.time()
+    max_pending = pool.workers * 2
+    pending = {}
+    finished_batches = {}
+    acknowledged = 0
+    done = 0
+
+    def _collect(return_when):
+        nonlocal done, acknowledged
+        finished, _ = wait(pending, return_when=return_when)
+        for future in finished:
+            done += future.result()
+            seq, cursor, count = pending.pop(future)
+            finished_batches[seq] = (cursor, count)
+        # Batches finish out of order, only checkpoint past a batch once all
+        # the batches before it are done as well.
+        while acknowledged in finished_batches:
+            cursor, count = finished_batches.pop(acknowledged)
+            if checkpoint is not None:
+                _advance_reindex_checkpoint(collection, checkpoint, cursor, count)
+            acknowledged += 1
+        elapsed = max(time.time() - start_time, 0.001)
+        log.info(
+            f"[{collection}] Reindexed {done} entities ({done / elapsed:.0f}/s)",
+            dataset=collection.name,
+        )
+
+    for seq, batch in enumerate(batches):
+        if len(pending) >= max_pending:
+            _collect(FIRST_COMPLETED)
+        future = pool.submit(
+            _index_batch_worker,
+            collection.id,
+            batch,
+            skip_errors,
+            sync,
+            schema,
+            version,
+        )
+        pending[future] = (seq, batch[-1], len(batch))
+    if len(pending):
+        _collect(ALL_COMPLETED)
+
+
+def _index_batches(
+    collection: Collection,
+    batches,
+    queue_batches: bool,
+    skip_errors: bool,
+    sync: bool,
+    schema: str | None = None,
+    pool: IndexWorkerPool | None = None,
+    checkpoint: dict | None = None,
+    version: str | None = None,
+):
+    if pool is not None and not queue_batches:
+        _index_batches_parallel(
+            collection, batches, pool, skip_errors, sync, schema, checkpoint, version
+        )
+        return
+    for batch in batches:
+        _index_batch(
+            collection, batch, queue_batches, skip_errors, sync, schema, version
+        )
+        # Queued batches are indexed by other workers, so they can't be
+        # checkpointed here
+        if checkpoint is not None and not queue_batches:
+            _advance_reindex_checkpoint(collection, checkpoint, batch[-1], len(batch))
+
+
 def _process_batches(
     collection: Collection,
     entity_ids: list[str] | None,
@@ -355,8 +639,12 @@ def _process_batches(
     since=None,
     until=None,
     origin: str | None = None,
+    pool: IndexWorkerPool | None = None,
+    checkpoint: dict | None = None,
+    version: str | None = None,
 ):
-    """Process entities in batches."""
+    """Process entities in batches, into the indexes of the given version
+    instead of the write indexes if one is set."""
     aggregator = get_aggregator(collection)
     if entity_ids:
         batches = (
@@ -364,12 +652,53 @@ def _process_batches(
             for i in range(0, len(entity_ids), batch_size)
         )
     else:
-        batches = aggregator.get_sorted_id_batches(
-            batch_size, schema=schema, since=since, until=until, origin=origin
+        cursor = checkpoint.get("cursor") if checkpoint is not None else None
+        batches = get_sorted_id_batches_after(
+            aggregator,
+            batch_size,
+            after=cursor,
+            schema=schema,
+            since=since,
+            until=until,
+            origin=origin,
         )
 
-    for batch in batches:
-        _index_batch(collection, batch, queue_batches, skip_errors, sync, schema)
+    _index_batches(
+        collection,
+        batches,
+        queue_batches,
+        skip_errors,
+        sync,
+        schema,
+        pool=pool,
+        checkpoint=checkpoint,
+        version=version,
+    )
+
+
+def _reindex_checkpoint_key(collection: Collection) -> str:
+    return cache.object_key(Collection, collection.id, "reindex_checkpoint")
+
+
+def get_reindex_checkpoint(collection: Collection) -> dict | None:
+    """Get the progress of an unfinished reindex of a collection."""
+    return cache.get_complex(_reindex_checkpoint_key(collection))
+
+
+def _save_reindex_checkpoint(collection: Collection, checkpoint: dict):
+    cache.set_complex(_reindex_checkpoint_key(collection), checkpoint)
+
+
+def _advance_reindex_checkpoint(
+    collection: Collection, checkpoint: dict, cursor: str, count: int
+):
+    checkpoint["cursor"] = cursor
+    checkpoint["entities"] += count
+    _save_reindex_checkpoint(collection, checkpoint)
+
+
+def clear_reindex_checkpoint(collection: Collection):
+    cache.delete(_reindex_checkpoint_key(collection))
 
 
 def reindex_collection(
@@ -387,9 +716,16 @@ def reindex_collection(
     since=None,
     until=None,
     origin=None,
+    pool=None,
+    resume=False,
 ):
     """Re-index all entities from the model, mappings and aggregator cache.
 
+    The last ID of each indexed batch is checkpointed, so that a run which
+    dies halfway can be resumed after it. The checkpoint is cleared once the
+    run finishes. Runs that queue their batches are not checkpointed, as the
+    batches are only indexed later on by the workers.
+
     Args:
         collection: The collection to reindex
         skip_errors: Skip entities that fail to index
@@ -404,40 +740,82 @@ def reindex_collection(
         since: Optional timestamp filter for aggregator (ISO format or timestamp)
         until: Optional timestamp filter for aggregator (ISO format or timestamp)
         origin: Filter entities by aggregator origin (e.g., 'xref', 'aleph')
+        pool: An `IndexWorkerPool` to index the batches in parallel processes
+        resume: Continue an unfinished reindex with the same filters from its
+            last checkpoint, skipping the aggregation and flush steps
     """
     from aleph.logic.profiles import profile_fragments
 
-    # Parse timestamp strings to datetime objects for ftmq
-    since_dt = _parse_timestamp(since)
-    until_dt = _parse_timestamp(until)
-
-    aggregator = get_aggregator(collection)
-    if mappings:
-        _process_mappings(collection, aggregator)
-    if model:
-        aggregate_model(collection, aggregator)
-    if profiles:
-        profile_fragments(collection, aggregator)
+    started = datetime.utcnow()
+    options = {"schema": schema, "since": since, "until": until, "origin": origin}
+    checkpoint = get_reindex_checkpoint(collection)
+    if checkpoint is not None:
+        mismatch = checkpoint.get("options") != options
+        if not resume or diff_only or queue_batches or mismatch:
+            clear_reindex_checkpoint(collection)
+            checkpoint = None
 
-    if flush:
-        log.debug(f"[{collection}] Flushing...", dataset=collection.name)
-        index.delete_entities(collection.id, sync=True)
+    if checkpoint is not None:
+        log.info(
+            f"[{collection}] Resuming reindex after {checkpoint['entities']} "
+            f"entities (cursor: {checkpoint['cursor']})...",
+            dataset=collection.name,
+        )
+        started = datetime.fromisoformat(checkpoint["started"])
+        # Relative timestamps are kept as they were parsed by the first run
+        since_dt, until_dt = (
+            datetime.fromisoformat(ts) if ts is not None else None
+            for ts in (checkpoint["since"], checkpoint["until"])
+        )
+    else:
+        # Parse timestamp strings to datetime objects for ftmq
+        since_dt = _parse_timestamp(since)
+        until_dt = _parse_timestamp(until)
+
+        aggregator = get_aggregator(collection)
+        if mappings:
+            _process_mappings(collection, aggregator)
+        if model:
+            aggregate_model(collection, aggregator)
+        if profiles:
+            profile_fragments(collection, aggregator)
+
+        if flush:
+            log.debug(f"[{collection}] Flushing...", dataset=collection.name)
+            index.delete_entities(collection.id, sync=True)
+
+        if not diff_only and not queue_batches:
+            checkpoint = {
+                "options": options,
+                "since": since_dt.isoformat() if since_dt is not None else None,
+                "until": until_dt.isoformat() if until_dt is not None else None,
+                "cursor": None,
+                "entities": 0,
+                "started": started.isoformat(),
+            }
+            _save_reindex_checkpoint(collection, checkpoint)
 
     # Handle diff-only mode separately - it yields batches directly
     if diff_only:
         batches = _get_diff_reindex_batches(
             collection, batch_size=batch_size, since=since_dt, until=until_dt
         )
-        has_batches = False
-        for batch in batches:
-            has_batches = True
-            _index_batch(collection, batch, queue_batches, skip_errors, sync, schema)
-
-        if not has_batches:
+        first = next(batches, None)
+        if first is None:
             log.info(
                 f"[{collection}] Diff-only mode: no entities to reindex",
                 dataset=collection.name,
             )
+        else:
+            _index_batches(
+                collection,
+                chain([first], batches),
+                queue_batches,
+                skip_errors,
+                sync,
+                schema,
+                pool=pool,
+            )
 
         if not queue_batches:
             compute_collection(collection, force=True)
@@ -455,19 +833,207 @@ def reindex_collection(
         since_dt,
         until_dt,
         origin=origin,
+        pool=pool,
+        checkpoint=checkpoint,
     )
+    clear_reindex_checkpoint(collection)
     if not queue_batches:
+        if not any((schema, since, until, origin)):
+            _set_index_watermark(collection, started)
         compute_collection(collection, force=True)
 
 
+def _index_watermark_key(collection: Collection) -> str:
+    return cache.object_key(Collection, collection.id, "index_watermark")
+
+
+def get_index_watermark(collection: Collection) -> datetime | None:
+    """Get the time up to which all aggregator fragments of a collection are
+    known to be indexed."""
+    watermark = cache.get(_index_watermark_key(collection))
+    if watermark is None:
+        return None
+    return datetime.fromisoformat(watermark)
+
+
+def _set_index_watermark(collection: Collection, watermark: datetime):
+    cache.set(_index_watermark_key(collection), watermark.isoformat())
+
+
+def _unindexed_changes(
+    collection: Collection, aggregator, entity_ids: list[str]
+) -> list[str]:
+    """Get those of the given entities which are missing from the index, or
+    were indexed before their latest aggregator fragment was written. The
+    others have been indexed already, e.g. by the tasks that wrote them."""
+    indexed = index.indexed_entity_ids(collection.id, entity_ids)
+    updated = get_entity_timestamps(aggregator, entity_ids)
+    changes = []
+    for entity_id in entity_ids:
+        indexed_at = indexed.get(entity_id)
+        updated_at = updated.get(entity_id)
+        if indexed_at is None or (updated_at is not None and updated_at > indexed_at):
+            changes.append(entity_id)
+    return changes
+
+
+def delta_reindex_collection(
+    collection: Collection, batch_size=10_000, pool: IndexWorkerPool | None = None
+):
+    """Index the entities whose aggregator fragments changed since the index
+    watermark of the collection and that are not indexed with these changes
+    yet, in sorted ID batches, and move the watermark up to the start of this
+    run. A collection without a watermark only gets one set, as there is no
+    telling what it is missing. Entities deleted from the aggregator are not
+    removed from the index, `index_diff` finds those."""
+    started = datetime.utcnow()
+    watermark = get_index_watermark(collection)
+    if watermark is None:
+        log.info(
+            f"[{collection}] No index watermark, starting from now",
+            dataset=collection.name,
+        )
+        _set_index_watermark(collection, started)
+        return
+
+    log.info(
+        f"[{collection}] Reindexing changes since {watermark.isoformat()}...",
+        dataset=collection.name,
+    )
+    aggregator = get_aggregator(collection)
+    changed = aggregator.get_sorted_id_batches(
+        batch_size, since=watermark - WATERMARK_OVERLAP
+    )
+    batches = (_unindexed_changes(collection, aggregator, ids) for ids in changed)
+    _index_batches(
+        collection, (b for b in batches if len(b)), False, True, False, pool=pool
+    )
+    _set_index_watermark(collection, started)
+    refresh_collection(collection.id)
+
+
+def delta_reindex_collections():
+    """Reindex the changes to all collections since their index watermarks."""
+    for collection in Collection.all():
+        try:
+            delta_reindex_collection(collection)
+        except Exception:
+            log.exception(
+                f"[{collection}] Delta reindex failed", dataset=collection.name
+            )
+
+
+def _rebuild_catch_up(version: str, since: datetime, batch_size: int, pool=None):
+    for collection in Collection.all():
+        _process_batches(
+            collection,
+            None,
+            batch_size,
+            False,
+            True,
+            False,
+            since=since - WATERMARK_OVERLAP,
+            pool=pool,
+            version=version,
+        )
+
+
+def _rebuild_mismatches(version: str) -> list[dict]:
+    mismatches = []
+    version_index = index_admin.entities_version_index(version)
+    for collection in Collection.all():
+        aggregator = len(get_aggregator(collection))
+        indexed = index.count_entities(collection.id, index=version_index)
+        if aggregator != indexed:
+            mismatches.append(
+                {
+                    "collection_id": collection.id,
+                    "foreign_id": collection.foreign_id,
+                    "aggregator": aggregator,
+                    "index": indexed,
+                }
+            )
+    return mismatches
+
+
+def rebuild_index(
+    version: str,
+    alias: str,
+    batch_size=10_000,
+    pool: IndexWorkerPool | None = None,
+    force=False,
+) -> list[dict]:
+    """Rebuild the entity indexes as a new version from the aggregator and
+    swap the aliases of the entity buckets over to it (blue/green).
+
+    The indexes of the new version are loaded with refreshes and replicas
+    turned off, caught up with what was written to the aggregator in the
+    meantime and restored to their regular settings. Then the entity count
+    of every collection is compared with the aggregator. Only if all of them
+    match (or `force` is set) the aliases are swapped, in a single atomic
+    request, and the changes made since the catch-up are indexed once more.
+
+    Returns the collections whose counts differ.
+    """
+    index_admin.check_rebuild_version(version, alias)
+    started = datetime.utcnow()
+    index_admin.create_rebuild_indexes(version)
+    for collection in Collection.all():
+        log.info(
+            f"[{collection}] Loading into index version {version}...",
+            dataset=collection.name,
+        )
+        _process_batches(
+            collection, None, batch_size, False, True, False, pool=pool, version=version
+        )
+    caught_up = datetime.utcnow()
+    _rebuild_catch_up(version, started, batch_size, pool)
+    index_admin.finish_rebuild_indexes(version)
+
+    mismatches = _rebuild_mismatches(version)
+    if len(mismatches) and not force:
+        log.error(f"{len(mismatches)} collections differ, not swapping to {version}")
+        return mismatches
+
+    swapped = datetime.utcnow()
+    previous = index_admin.swap_entities_alias(version, alias)
+    log.info(f"Swapped alias {alias} to {version}, from: {', '.join(previous)}")
+    _rebuild_catch_up(version, caught_up, batch_size, pool)
+    for collection in Collection.all():
+        _set_index_watermark(collection, swapped)
+        refresh_collection(collection.id)
+    return mismatches
+
+
 def delete_collection(collection, keep_metadata=False, sync=False):
+    """Delete the contents of a collection, and the collection itself unless
+    `keep_metadata` is set. The aggregator table is dropped (or truncated)
+    and the index documents and database rows are deleted in bulk."""
+    started = time.time()
     deleted_at = collection.deleted_at or datetime.utcnow()
     queue_cancel_collection(collection)
+
+    def _progress(step):
+        log.info(
+            f"[{collection}] Delete: {step} ({time.time() - started:.1f}s)",
+            dataset=collection.name,
+        )
+
     aggregator = get_aggregator(collection)
-    aggregator.delete()
+    if keep_metadata:
+        truncate_aggregator(aggregator)
+    else:
+        aggregator.drop()
+    _progress("aggregator cleared")
     flush_notifications(collection, sync=sync)
     index.delete_entities(collection.id, sync=sync)
-    xref_index.delete_xref(collection, sync=sync)
+    xref_index.delete_xref(collection, incoming=True, sync=sync)
+    _progress("index cleared")
+    blocking = get_blocking_index()
+    if blocking is not None:
+        blocking.delete_collection(collection.id)
+        if keep_metadata:
+            blocking.set_built(collection.id)
     Mapping.delete_by_collection(collection.id)
     EntitySet.delete_by_collection(collection.id, deleted_at)
     Entity.delete_by_collection(collection.id)
@@ -476,9 +1042,9 @@ def delete_collection(collection, keep_metadata=False, sync=False):
         Permission.delete_by_collection(collection.id)
         collection.delete(deleted_at=deleted_at)
     db.session.commit()
+    _progress("database cleared")
     if not keep_metadata:
         index.delete_collection(collection.id, sync=True)
-        aggregator.drop()
     refresh_collection(collection.id)
     Authz.flush()
 
@@ -635,3 +1201,236 @@ def index_diff(  # noqa: C901
                     index_id = next(index_ids, None)
                     if index_id is None:
                         break
+
+
+@dataclass
+class IndexDiff:
+    """The result of comparing the entities of a collection between the
+    aggregator and the search index."""
+
+    aggregator: int = 0
+    index: int = 0
+    only_in_aggregator: list[str] = field(default_factory=list)
+    only_in_index: list[str] = field(default_factory=list)
+    stale: list[str] = field(default_factory=list)
+
+    @property
+    def in_both(self) -> int:
+        return self.aggregator - len(self.only_in_aggregator)
+
+
+def _is_stale(indexed_at: datetime | None, updated_at: datetime | None) -> bool:
+    """Check if a fragment was written after the entity was indexed."""
+    return None not in (indexed_at, updated_at) and updated_at > indexed_at
+
+
+def _buckets_differ(aggregator, collection: Collection, buckets: list[list[str]]):
+    """Check buckets of sorted entity IDs against the index: a bucket differs
+    if the index holds fewer of its IDs, or if a fragment in it was written
+    after the oldest of its documents was indexed."""
+    counts = index.count_entities_by_ids(collection.id, buckets)
+    timestamps = get_bucket_timestamps(aggregator, buckets)
+    for bucket, (count, indexed_at), updated_at in zip(buckets, counts, timestamps):
+        yield bucket, count != len(bucket) or _is_stale(indexed_at, updated_at)
+
+
+def _bisect_diff(
+    aggregator, collection: Collection, buckets: list[list[str]], diff: IndexDiff
+):
+    """Find the IDs missing from the index or indexed before their latest
+    fragment in buckets that differ, by splitting them in halves and only
+    descending into the halves that still differ. Small buckets are resolved
+    by fetching the indexed time of each of their IDs."""
+    while len(buckets):
+        leaves = [b for b in buckets if len(b) <= DIFF_LEAF_SIZE]
+        for leaf in leaves:
+            indexed = index.indexed_entity_ids(collection.id, leaf)
+            updated = get_entity_timestamps(aggregator, leaf)
+            for entity_id in leaf:
+                if entity_id not in indexed:
+                    diff.only_in_aggregator.append(entity_id)
+                    continue
+                if _is_stale(indexed[entity_id], updated.get(entity_id)):
+                    diff.stale.append(entity_id)
+        halves = []
+        for bucket in buckets:
+            if len(bucket) > DIFF_LEAF_SIZE:
+                middle = len(bucket) // 2
+                halves.extend((bucket[:middle], bucket[middle:]))
+        buckets = [
+            h
+            for h, differs in _buckets_differ(aggregator, collection, halves)
+            if differs
+        ]
+
+
+def index_checksum_diff(collection: Collection) -> IndexDiff:
+    """Compare the entities of a collection between the aggregator and the
+    search index without streaming every entity ID.
+
+    The entities are first compared by schema, with a single aggregating
+    query on each side: the number of entities against the number of
+    indexed documents, and the time of the latest fragment against the time
+    the oldest document was indexed. Only the schemata that differ are split
+    into buckets of sorted IDs, which are checked the same way (several per
+    multi-search request) and bisected to find the missing and the stale
+    IDs. Entities only in the index are looked for with a full `index_diff`
+    if the index holds more entities than were matched.
+    """
+    log.info(
+        f"[{collection.name}] Comparing entity schemata of aggregator and index...",
+        dataset=collection.name,
+    )
+    aggregator = get_aggregator(collection)
+    diff = IndexDiff(
+        aggregator=count_aggregator_entities(aggregator),
+        index=index.count_entities(collection.id),
+    )
+    indexed = index.count_entities_by_schema(collection.id)
+    for schema, (count, updated_at) in get_schema_timestamps(aggregator).items():
+        index_count, indexed_at = indexed.get(schema, (0, None))
+        if count == index_count and not _is_stale(indexed_at, updated_at):
+            continue
+        log.info(
+            f"[{collection.name}] Comparing the IDs of schema {schema}...",
+            dataset=collection.name,
+        )
+        buckets = get_sorted_id_batches_after(
+            aggregator, DIFF_BUCKET_SIZE, schema=schema
+        )
+        for chunk in batched(buckets, DIFF_BUCKETS_PER_REQUEST):
+            differ = [
+                bucket
+                for bucket, differs in _buckets_differ(
+                    aggregator, collection, list(chunk)
+                )
+                if differs
+            ]
+            _bisect_diff(aggregator, collection, differ, diff)
+    # Entities with fragments of several schemata are compared for each
+    diff.only_in_aggregator = sorted(set(diff.only_in_aggregator))
+    diff.stale = sorted(set(diff.stale))
+
+    if diff.index > diff.in_both:
+        log.info(
+            f"[{collection.name}] Index holds {diff.index - diff.in_both} entities "
+            "not in the aggregator, scanning all IDs...",
+            dataset=collection.name,
+        )
+        for aggregator_id, index_id in index_diff(collection):
+            if aggregator_id is None:
+                diff.only_in_index.append(index_id)
+    return diff
+
+
+def compute_index_diff(collection: Collection, full=False) -> IndexDiff:
+    """Compare a collection between the aggregator and the search index, by
+    checksums of ID buckets or, if `full` is set, by every entity ID."""
+    if not full:
+        return index_checksum_diff(collection)
+    diff = IndexDiff()
+    for aggregator_id, index_id in index_diff(collection):
+        if aggregator_id is not None:
+            diff.aggregator += 1
+            if index_id is None:
+                diff.only_in_aggregator.append(aggregator_id)
+        if index_id is not None:
+            diff.index += 1
+            if aggregator_id is None:
+                diff.only_in_index.append(index_id)
+    return diff
+
+
+def _index_diff_record(collection: Collection, full: bool) -> dict:
+    record = {
+        "collection_id": collection.id,
+        "foreign_id": collection.foreign_id,
+        "label": collection.label,
+    }
+    try:
+        diff = compute_index_diff(collection, full=full)
+    except Exception as exc:
+        log.exception(f"[{collection}] Failed to compute diff", dataset=collection.name)
+        record["error"] = str(exc)
+        return record
+    record.update(
+        {
+            "aggregator": diff.aggregator,
+            "index": diff.index,
+            "in_both": diff.in_both,
+            "only_in_aggregator": diff.only_in_aggregator,
+            "only_in_index": diff.only_in_index,
+            "stale": diff.stale,
+        }
+    )
+    return record
+
+
+def _index_diff_worker(collection_id: int, full: bool) -> dict:
+    collection = Collection.by_id(collection_id)
+    return _index_diff_record(collection, full)
+
+
+def index_diff_collections(
+    collections, full=False, pool: IndexWorkerPool | None = None
+) -> Generator[dict, None, None]:
+    """Diff many collections, concurrently across the processes of a pool if
+    one is given, and yield a record for each as soon as it is done. The
+    records hold the counts and the IDs found only on one side."""
+    if pool is None:
+        for collection in collections:
+            yield _index_diff_record(collection, full)
+        return
+
+    max_pending = pool.workers * 2
+    pending = set()
+    for collection in collections:
+        if len(pending) >= max_pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+        pending.add(pool.submit(_index_diff_worker, collection.id, full))
+    for future in wait(pending, return_when=ALL_COMPLETED).done:
+        yield future.result()
+
+
+def repair_index_diff(
+    collection: Collection,
+    only_in_aggregator: list[str],
+    only_in_index: list[str],
+    queue_batches=False,
+    batch_size=10_000,
+    sync=False,
+    pool: IndexWorkerPool | None = None,
+    stale: list[str] | None = None,
+):
+    """Repair the drift between the aggregator and the search index found by
+    an index diff: index the entities missing from the index or indexed
+    before their latest change, and delete the orphaned ones."""
+    stale = stale or []
+    if len(only_in_aggregator) or len(stale):
+        log.info(
+            f"[{collection}] Indexing {len(only_in_aggregator)} missing and "
+            f"{len(stale)} stale entities...",
+            dataset=collection.name,
+        )
+        _process_batches(
+            collection,
+            sorted(set(only_in_aggregator).union(stale)),
+            batch_size,
+            queue_batches,
+            True,
+            sync,
+            pool=pool,
+        )
+    if len(only_in_index):
+        log.info(
+            f"[{collection}] Deleting {len(only_in_index)} orphaned entities...",
+            dataset=collection.name,
+        )
+        blocking = get_blocking_index()
+        for batch in batched(only_in_index, batch_size):
+            index.delete_entities_by_ids(collection.id, list(batch), sync=sync)
+            if blocking is not None:
+                blocking.delete_entities(batch)
+    refresh_collection(collection.id)
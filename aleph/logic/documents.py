@@ -1,5 +1,7 @@
 import logging
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 from openaleph_search.index.indexer import query_delete
 from openaleph_search.index.indexes import entities_read_index
@@ -8,7 +10,8 @@ from servicelayer.jobs import Job
 from aleph.core import archive, db
 from aleph.logic.aggregator import MODEL_ORIGIN, get_aggregator
 from aleph.model import Document
-from aleph.procrastinate.queues import OP_ANALYZE, OP_INGEST, queue_ingest
+from aleph.procrastinate.queues import OP_ANALYZE, OP_INGEST, queue_ingest_many
+from aleph.settings import SETTINGS
 
 log = logging.getLogger(__name__)
 
@@ -21,6 +24,13 @@ def ingest_flush(collection, entity_id=None):
     aggregator.delete(entity_id=entity_id, origin=OP_ANALYZE)
 
 
+def ingest_flush_many(collection, entity_ids):
+    """Clear the ingest fragments of many entities at once."""
+    aggregator = get_aggregator(collection)
+    for origin in (MODEL_ORIGIN, OP_INGEST, OP_ANALYZE):
+        aggregator.delete_many(entity_ids, origin=origin)
+
+
 def index_flush(collection, entity_id=None):
     """Clear entities from search index generated by the ingest process."""
     filters = [
@@ -33,40 +43,122 @@ def index_flush(collection, entity_id=None):
     query_delete(entities_read_index(), query)
 
 
-def crawl_directory(collection, path, parent=None, job_id=None):
-    """Crawl the contents of the given path."""
-    try:
-        content_hash = None
-        if not path.is_dir():
-            content_hash = archive.archive_file(path)
-        foreign_id = path.name
-        if parent is not None:
-            foreign_id = os.path.join(parent.foreign_id, foreign_id)
-
-        # if the job_id is not set yet and path.is_dir(), we know it is the
-        # first iteration and we don't create an initial root folder as parent
-        # to be consistent with the behaviour of alephclient
-        if path.is_dir() and job_id is None:
-            document = None
-            job_id = Job.random_id()
-        else:
-            meta = {"file_name": path.name}
-            document = Document.save(
-                collection,
-                parent=parent,
-                foreign_id=foreign_id,
-                content_hash=content_hash,
-                meta=meta,
-            )
-            db.session.commit()
-            job_id = job_id or Job.random_id()
-            proxy = document.to_proxy()
-            ingest_flush(collection, entity_id=proxy.id)
-            queue_ingest(collection, proxy, batch=job_id)
-            log.info("Crawl [%s]: %s -> %s", collection.id, path, document.id)
+class CrawlWriter:
+    """Save the files and folders found by a crawl as documents in batches,
+    with one lookup of the existing documents, one commit and one batched
+    insert of ingest jobs per batch."""
+
+    def __init__(self, collection, parent, job_id):
+        self.collection = collection
+        self.ns = collection.ns
+        self.job_id = job_id
+        # The IDs of the folders saved so far, by their foreign ID
+        self.folders = {None: parent.id if parent is not None else None}
+        self.buffer = []
+
+    def put(self, path, parent_key, foreign_id, content_hash):
+        # Documents refer to their folder by ID, which it only gets once
+        # it has been written.
+        if parent_key not in self.folders:
+            self.flush()
+        self.buffer.append((path, parent_key, foreign_id, content_hash))
+        if len(self.buffer) >= SETTINGS.CRAWL_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not len(self.buffer):
+            return
+        items = [
+            (self.folders[parent_key], foreign_id, content_hash, {"file_name": p.name})
+            for p, parent_key, foreign_id, content_hash in self.buffer
+        ]
+        documents = Document.save_many(self.collection, items)
+        updated = [d.id for d in documents if d.id is not None]
+        db.session.flush()
+        proxies = [document.to_proxy(ns=self.ns) for document in documents]
+        for document in documents:
+            if document.schema == Document.SCHEMA_FOLDER:
+                self.folders[document.foreign_id] = document.id
+        db.session.commit()
+        for document in documents:
+            db.session.expunge(document)
+
+        if len(updated):
+            ingest_flush_many(self.collection, [self.ns.sign(i) for i in updated])
+        queue_ingest_many(self.collection, proxies, batch=self.job_id)
+        log.info("Crawl [%s]: saved %d documents", self.collection.id, len(proxies))
+        self.buffer = []
 
+
+def _crawl_entries(path, prefix, skip_root):
+    """Walk a path breadth-first, so that every folder comes before its
+    contents. Yields the path, the foreign ID of its folder and its own
+    foreign ID for each file and folder."""
+    folders = deque()
+    if skip_root:
+        folders.append((path, None, None))
+    else:
+        foreign_id = os.path.join(prefix, path.name) if prefix else path.name
+        yield path, None, foreign_id
         if path.is_dir():
-            for child in path.iterdir():
-                crawl_directory(collection, child, document, job_id)
-    except OSError:
-        log.exception("Cannot crawl directory: %s", path)
+            folders.append((path, foreign_id, foreign_id))
+    while len(folders):
+        folder, parent_key, prefix = folders.popleft()
+        try:
+            children = sorted(folder.iterdir())
+        except OSError:
+            log.exception("Cannot crawl directory: %s", folder)
+            continue
+        for child in children:
+            foreign_id = os.path.join(prefix, child.name) if prefix else child.name
+            yield child, parent_key, foreign_id
+            if child.is_dir():
+                folders.append((child, foreign_id, foreign_id))
+
+
+def _archive_entries(entries, pool):
+    """Archive the files among the crawled entries in a thread pool, up to a
+    batch ahead of the documents being saved, and add their content hash."""
+    pending = deque()
+
+    def _resolve():
+        path, parent_key, foreign_id, future = pending.popleft()
+        try:
+            content_hash = future.result() if future is not None else None
+        except OSError:
+            log.exception("Cannot crawl file: %s", path)
+            return None
+        return path, parent_key, foreign_id, content_hash
+
+    for path, parent_key, foreign_id in entries:
+        future = None
+        if not path.is_dir():
+            future = pool.submit(archive.archive_file, path)
+        pending.append((path, parent_key, foreign_id, future))
+        if len(pending) >= SETTINGS.CRAWL_BATCH_SIZE:
+            entry = _resolve()
+            if entry is not None:
+                yield entry
+    while len(pending):
+        entry = _resolve()
+        if entry is not None:
+            yield entry
+
+
+def crawl_directory(collection, path, parent=None, job_id=None):
+    """Crawl the contents of the given path. Files are archived by a pool of
+    threads while the documents of earlier ones are saved in batches."""
+    # if the job_id is not set yet and path.is_dir(), we know it is the
+    # first iteration and we don't create an initial root folder as parent
+    # to be consistent with the behaviour of alephclient
+    skip_root = path.is_dir() and job_id is None
+    if skip_root:
+        parent = None
+    job_id = job_id or Job.random_id()
+    writer = CrawlWriter(collection, parent, job_id)
+    prefix = parent.foreign_id if parent is not None else None
+    entries = _crawl_entries(path, prefix, skip_root)
+    with ThreadPoolExecutor(max(1, SETTINGS.CRAWL_HASH_WORKERS)) as pool:
+        for entry in _archive_entries(entries, pool):
+            writer.put(*entry)
+    writer.flush()
@@ -14,6 +14,7 @@ from openaleph_search.index import entities as index
 from aleph.core import cache, db
 from aleph.index import xref as xref_index
 from aleph.logic.aggregator import get_aggregator
+from aleph.logic.blocking import get_blocking_index
 from aleph.logic.collections import MODEL_ORIGIN, refresh_collection
 from aleph.logic.notifications import flush_notifications
 from aleph.logic.util import latin_alt
@@ -68,6 +69,9 @@ def upsert_entity(data, collection, authz=None, sync=False, sign=False, job_id=N
     profile_fragments(collection, aggregator, entity_id=proxy.id)
 
     index.index_proxy(collection.name, proxy, sync=sync, collection_id=collection.id)
+    blocking = get_blocking_index()
+    if blocking is not None:
+        blocking.put_many(collection.id, [proxy])
     refresh_entity(collection, proxy.id)
     queue_update_entity(collection, entity_id=proxy.id, batch=job_id)
     return entity.id
@@ -104,6 +108,9 @@ def index_entity(collection, entity_id):
         index.index_proxy(
             collection.name, proxy, sync=True, collection_id=collection.id
         )
+        blocking = get_blocking_index()
+        if blocking is not None:
+            blocking.put_many(collection.id, [proxy])
         log.info(f"[{collection.name}] Indexed Entity `{entity_id}`.")
 
 
@@ -241,6 +248,9 @@ def delete_entity(collection, entity, sync=False, job_id=None):
     """Delete entity from index and redis, queue full prune."""
     entity_id = collection.ns.sign(entity.get("id"))
     index.delete_entity(entity_id, sync=sync)
+    blocking = get_blocking_index()
+    if blocking is not None:
+        blocking.delete_entities([entity_id])
     refresh_entity(collection, entity_id)
     queue_prune_entity(collection, entity_id=entity_id, batch=job_id)
 
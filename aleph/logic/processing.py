@@ -8,6 +8,7 @@ from followthemoney.types import registry
 from openaleph_search.index import entities as entities_index
 
 from aleph.logic.aggregator import get_aggregator
+from aleph.logic.blocking import get_blocking_index
 from aleph.model.collection import Collection
 from aleph.util import make_entity_proxy
 
@@ -59,8 +60,19 @@ def bulk_write(
             yield entity
         writer.flush()
     else:  # "external" collection, straight to the index without DB
+        blocking = get_blocking_index()
+        writer = blocking.writer(collection.id) if blocking is not None else None
+
+        def _blocked():
+            for entity in _entities:
+                if writer is not None:
+                    writer.put(entity)
+                yield entity
+            if writer is not None:
+                writer.flush()
+
         entities_index.index_bulk(
             collection.name,
-            _entities,
+            _blocked(),
             collection_id=collection.id,
         )
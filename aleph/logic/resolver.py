@@ -11,7 +11,7 @@ from normality import stringify
 from openaleph_search.index.entities import entities_by_ids
 
 from aleph.core import cache
-from aleph.index.collections import get_collection
+from aleph.index.collections import get_collections
 from aleph.logic.alerts import get_alert
 from aleph.logic.entitysets import get_entityset
 from aleph.logic.export import get_export
@@ -21,7 +21,6 @@ from aleph.model import Alert, Collection, Entity, EntitySet, Export, Role
 log = logging.getLogger(__name__)
 LOADERS = {
     Role: get_role,
-    Collection: get_collection,
     Alert: get_alert,
     EntitySet: get_entityset,
     Export: get_export,
@@ -84,17 +83,26 @@ def resolve(stub):
 
     keys = list(cache_keys.keys())
     entity_misses = defaultdict(list)
+    collection_misses = []
     for cid, value in cache.get_many_complex(keys):
         clazz, key = cache_keys.get(cid)
         if value is None:
             if clazz == Entity:
                 entity_misses[schemata.get(cid)].append(key)
+            elif clazz == Collection:
+                collection_misses.append(key)
             else:
                 loader = LOADERS.get(clazz)
                 if loader is not None:
                     value = loader(key)
         stub._rx_cache[(clazz, key)] = value
 
+    # Load collection cache misses together, counting their things at once
+    if len(collection_misses):
+        collections = get_collections(collection_misses)
+        for key in collection_misses:
+            stub._rx_cache[(Collection, key)] = collections.get(key)
+
     # Fetch entity cache misses directly from ES (single mget), cache results
     for schema, ids in entity_misses.items():
         for entity in entities_by_ids(ids, schema):
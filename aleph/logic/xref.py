@@ -1,8 +1,17 @@
+import csv
+import functools
 import logging
+import multiprocessing
 import shutil
+import threading
 import typing
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
 from dataclasses import dataclass
-from functools import cache
+from datetime import datetime
+from itertools import batched, islice
+from queue import Empty, Full, Queue
 from tempfile import mkdtemp
 from timeit import default_timer
 
@@ -14,8 +23,24 @@ from followthemoney.helpers import name_entity
 from followthemoney.proxy import EntityProxy
 from followthemoney.types import registry
 from followthemoney_compare.models import GLMBernoulli2EEvaluator
-from nomenklatura.matching import ScoringConfig, get_algorithm
+from nomenklatura.matching import (
+    EntityResolveRegression,
+    RegressionV1,
+    ScoringConfig,
+    get_algorithm,
+)
+from nomenklatura.matching.compare.util import (
+    extract_numbers,
+    has_overlap,
+    is_disjoint,
+)
+from nomenklatura.matching.compat import clean_name_ascii
+from nomenklatura.matching.regression_v1 import misc as nk_misc
+from nomenklatura.matching.regression_v1 import names as nk_names
+from nomenklatura.matching.regression_v1.util import compare_levenshtein, tokenize
 from nomenklatura.matching.types import ScoringAlgorithm
+from nomenklatura.matching.util import max_in_sets
+from openaleph_procrastinate import defer
 from openaleph_search.index.entities import ENTITY_SOURCE, iter_proxies
 from openaleph_search.index.indexes import entities_read_index
 from openaleph_search.index.util import unpack_result
@@ -23,18 +48,22 @@ from openaleph_search.query import none_query
 from openaleph_search.query.matching import match_query
 from openaleph_search.settings import BULK_PAGE
 from prometheus_client import Counter, Histogram
+from rigour.mime.types import CSV, XLSX
 from servicelayer.archive.util import ensure_path
+from servicelayer.jobs import Job
 
 from aleph.authz import Authz
-from aleph.core import db, es
+from aleph.core import cache, db, es
 from aleph.index.collections import delete_entities
 from aleph.index.xref import delete_xref, index_matches, iter_matches
 from aleph.logic import resolver
-from aleph.logic.aggregator import get_aggregator
+from aleph.logic.aggregator import get_aggregator, get_sorted_id_batches_after
+from aleph.logic.blocking import get_warm_blocking_index
 from aleph.logic.collections import reindex_collection
 from aleph.logic.export import complete_export
 from aleph.logic.util import entity_url
 from aleph.model import Collection, Entity, EntitySet, Export, Role, Status
+from aleph.procrastinate.queues import queue_xref_mentions, queue_xref_shard
 from aleph.settings import SETTINGS
 from aleph.util import make_entity_proxy
 
@@ -43,6 +72,20 @@ ORIGIN = "xref"
 MODEL = None
 FTM_VERSION_STR = f"ftm-{followthemoney.__version__}"
 SCORE_CUTOFF = 0.5
+PARQUET = "application/vnd.apache.parquet"
+EXPORT_HEADERS = [
+    "Score",
+    "Doubt",
+    "Entity Name",
+    "Entity Date",
+    "Entity Countries",
+    "Candidate Collection",
+    "Candidate Name",
+    "Candidate Date",
+    "Candidate Countries",
+    "Entity Link",
+    "Candidate Link",
+]
 
 XREF_ENTITIES = Counter(
     "aleph_xref_entities_total",
@@ -70,17 +113,211 @@ XREF_CANDIDATES_QUERY_DURATION = Histogram(
 
 XREF_CANDIDATES_QUERY_ROUNDTRIP_DURATION = Histogram(
     "aleph_xref_candidates_query_roundtrip_duration_seconds",
-    "Roundtrip duration of the candidates query (incl. network, serialization etc.)",
+    "Roundtrip duration of the candidates multi-search request for a block of "
+    "entities (incl. network, serialization etc.)",
+)
+
+XREF_PIPELINE_ITEMS = Counter(
+    "aleph_xref_pipeline_items_total",
+    "Number of items that passed through a stage of the xref pipeline",
+    ["stage"],
 )
 
+XREF_PIPELINE_DURATION = Histogram(
+    "aleph_xref_pipeline_stage_duration_seconds",
+    "Time spent on a block of items in a stage of the xref pipeline",
+    ["stage"],
+)
+
+# End marker passed down the queues of the xref pipeline
+_DONE = object()
 
-@cache
+
+@functools.cache
 def _get_nk_algorithm() -> type[ScoringAlgorithm] | None:
     if SETTINGS.XREF_ALGORITHM is not None:
         return get_algorithm(SETTINGS.XREF_ALGORITHM)
 
 
 NK_SCORING_CONFIG = ScoringConfig.defaults()
+# Number of entities whose feature values are kept around during a run
+FEATURE_CACHE_SIZE = 10_000
+
+
+class _FeatureEntity(EntityProxy):
+    """An entity whose property and type values, and the values the matching
+    features derive from them, are only computed once. The features read the
+    same values of an entity again for every pair it is part of, and
+    candidates often turn up for many entities of a run."""
+
+    __slots__ = ["_values"]
+
+    def __init__(self, proxy: EntityProxy):
+        super().__init__(proxy.schema, proxy.to_dict())
+        self._values = {}
+
+    def get(self, prop, quiet=False):
+        key = ("get", prop, quiet)
+        if key not in self._values:
+            self._values[key] = super().get(prop, quiet=quiet)
+        return list(self._values[key])
+
+    def get_type_values(self, type_, matchable=False):
+        key = ("type", type_, matchable)
+        if key not in self._values:
+            self._values[key] = super().get_type_values(type_, matchable=matchable)
+        return list(self._values[key])
+
+    def feature(self, extract):
+        """Get a value derived from the entity by a feature, e.g. its
+        normalized names, computed on first use."""
+        key = ("feature", extract)
+        if key not in self._values:
+            self._values[key] = extract(self)
+        return self._values[key]
+
+
+_FEATURE_CACHE: OrderedDict[str, _FeatureEntity] = OrderedDict()
+
+
+def _feature_entity(proxy: EntityProxy) -> _FeatureEntity:
+    """Get the feature entity of a proxy, cached for the current run."""
+    entity = _FEATURE_CACHE.get(proxy.id)
+    if entity is not None:
+        _FEATURE_CACHE.move_to_end(proxy.id)
+        return entity
+    entity = _FeatureEntity(proxy)
+    _FEATURE_CACHE[proxy.id] = entity
+    if len(_FEATURE_CACHE) > FEATURE_CACHE_SIZE:
+        _FEATURE_CACHE.popitem(last=False)
+    return entity
+
+
+def _clear_feature_cache():
+    """Forget the cached entities, so that a run never scores entities as
+    they were in an earlier one."""
+    _FEATURE_CACHE.clear()
+
+
+def _prop_values(entity, *props):
+    values = set()
+    for prop in props:
+        if prop in entity.schema.properties:
+            values.update(entity.get(prop, quiet=True))
+    return values
+
+
+def _names(entity):
+    return entity.get_type_values(registry.name, matchable=True)
+
+
+def _addresses(entity):
+    return entity.get_type_values(registry.address, matchable=True)
+
+
+def _normalized_names(entity):
+    return nk_names.normalize_names(_names(entity))
+
+
+def _name_tokens(entity):
+    return tokenize(_names(entity))
+
+
+def _name_numbers(entity):
+    return extract_numbers(_names(entity))
+
+
+def _first_name_tokens(entity):
+    return tokenize(_prop_values(entity, "firstName"))
+
+
+def _family_name_tokens(entity):
+    return tokenize(_prop_values(entity, "lastName"))
+
+
+def _birth_place_tokens(entity):
+    return tokenize(_prop_values(entity, "birthPlace"))
+
+
+def _clean_addresses(entity):
+    return [clean_name_ascii(v) for v in _addresses(entity)]
+
+
+def _address_numbers(entity):
+    return extract_numbers(_addresses(entity))
+
+
+def _feature_pair(left: _FeatureEntity, right: _FeatureEntity, extract):
+    return left.feature(extract), right.feature(extract)
+
+
+def _name_match(left, right):
+    lv, rv = _feature_pair(left, right, _normalized_names)
+    return 0.0 if lv.isdisjoint(rv) else 1.0
+
+
+def _name_token_overlap(left, right):
+    lv, rv = _feature_pair(left, right, _name_tokens)
+    tokens = min(len(lv), len(rv))
+    return float(len(lv.intersection(rv))) / float(max(2.0, tokens))
+
+
+def _name_numbers_disjoint(left, right):
+    lv, rv = _feature_pair(left, right, _name_numbers)
+    return 1.0 if is_disjoint(lv, rv) else 0.0
+
+
+def _name_levenshtein(left, right):
+    lv, rv = _feature_pair(left, right, _normalized_names)
+    return max_in_sets(lv, rv, compare_levenshtein)
+
+
+def _first_name_match(left, right):
+    lv, rv = _feature_pair(left, right, _first_name_tokens)
+    return 1.0 if has_overlap(lv, rv) else 0.0
+
+
+def _family_name_match(left, right):
+    lv, rv = _feature_pair(left, right, _family_name_tokens)
+    return 1.0 if has_overlap(lv, rv) else 0.0
+
+
+def _birth_place(left, right):
+    lv, rv = _feature_pair(left, right, _birth_place_tokens)
+    tokens = min(len(lv), len(rv))
+    return float(len(lv.intersection(rv))) / float(max(2.0, tokens))
+
+
+def _address_match(left, right):
+    lv, rv = _feature_pair(left, right, _clean_addresses)
+    return max_in_sets(lv, rv, compare_levenshtein)
+
+
+def _address_numbers_match(left, right):
+    lv, rv = _feature_pair(left, right, _address_numbers)
+    return len(lv.intersection(rv)) - len(lv.difference(rv))
+
+
+# The regression-v1 features which normalize, tokenize or parse the values of
+# both entities for every pair, computed from the cached values of each
+# entity instead. Each must return the same as the nomenklatura function.
+_CACHED_FEATURES = {
+    nk_names.name_match: _name_match,
+    nk_names.name_token_overlap: _name_token_overlap,
+    nk_names.name_numbers: _name_numbers_disjoint,
+    nk_names.name_levenshtein: _name_levenshtein,
+    nk_names.first_name_match: _first_name_match,
+    nk_names.family_name_match: _family_name_match,
+    nk_misc.birth_place: _birth_place,
+    nk_misc.address_match: _address_match,
+    nk_misc.address_numbers: _address_numbers_match,
+}
+
+
+def _encode_pair(algorithm, left: _FeatureEntity, right: _FeatureEntity):
+    """Encode a pair of feature entities like `algorithm.encode_pair`, using
+    the cached entity values for the features that derive them."""
+    return [_CACHED_FEATURES.get(f, f)(left, right) for f in algorithm.FEATURES]
 
 
 @dataclass
@@ -109,10 +346,20 @@ def _bulk_compare_nomenklatura(
     proxies: list[tuple[E, E]],
 ) -> typing.Generator[tuple[float, None, str], None, None]:
     algorithm = _get_nk_algorithm()
-    if algorithm is not None:
-        for entity, candidate in proxies:
-            result = algorithm.compare(entity, candidate, NK_SCORING_CONFIG)
-            yield result.score, None, algorithm.NAME
+    if algorithm is None:
+        return
+    proxies = [(_feature_entity(e), _feature_entity(c)) for e, c in proxies]
+    if issubclass(algorithm, (RegressionV1, EntityResolveRegression)):
+        # Regression models score a feature vector per pair; encode all the
+        # pairs first and run the classifier once over the whole block.
+        pipe, _ = algorithm.load()
+        encoded = [_encode_pair(algorithm, e, c) for e, c in proxies]
+        for proba in pipe.predict_proba(encoded):
+            yield float(proba[1]), None, algorithm.NAME
+        return
+    for entity, candidate in proxies:
+        result = algorithm.compare(entity, candidate, NK_SCORING_CONFIG)
+        yield result.score, None, algorithm.NAME
 
 
 def _bulk_compare(proxies):
@@ -146,40 +393,48 @@ def _merge_schemata(proxy, schemata):
             proxy.schema = model.get(Entity.LEGAL_ENTITY)
 
 
-def _query_item(entity, entitysets=True):
-    """Cross-reference an entity or document, given as an indexed document."""
-    query = match_query(entity)
-    if query == none_query():
-        return
-
-    entityset_ids = EntitySet.entity_entitysets(entity.id) if entitysets else []
-    query = {"query": query, "size": 50, "_source": ENTITY_SOURCE}
+def _candidates_query(entity, blocking=None):
+    """Build the multi-search header and body used to find candidates for
+    the given entity, or `None` if the entity cannot be matched. With a warm
+    blocking index, the candidates are looked up in it and only fetched from
+    the search index by their IDs. Entities without candidates in the blocking
+    index fall back to a match query."""
     schemata = list(entity.schema.matchable_schemata)
     index = entities_read_index(schema=schemata, expand=False)
+    header = {"index": index}
+    candidate_ids = []
+    if blocking is not None:
+        names = [s.name for s in schemata]
+        candidate_ids = blocking.candidates(entity, names, limit=50)
+    if len(candidate_ids):
+        query = {"ids": {"values": candidate_ids}}
+    else:
+        query = match_query(entity)
+        if query == none_query():
+            return None
+    body = {"query": query, "size": 50, "_source": ENTITY_SOURCE}
+    return header, body
 
-    start_time = default_timer()
-    result = es.search(index=index, body=query)
-    roundtrip_duration = max(0, default_timer() - start_time)
-    query_duration = result.get("took")
-    if query_duration is not None:
-        # ES returns milliseconds, but we track query time in seconds
-        query_duration = result.get("took") / 1000
 
+def _parse_candidates(result, parsed):
+    """Get the candidate proxies from a search result. Popular candidates are
+    returned for many entities, so proxies already parsed for other entities
+    in the same block are re-used."""
     candidates = []
-    for hit in result.get("hits").get("hits"):
-        hit = unpack_result(hit)
-        if hit is None:
-            continue
-        candidate = make_entity_proxy(hit)
+    for hit in result.get("hits", {}).get("hits", []):
+        candidate = parsed.get(hit.get("_id"))
+        if candidate is None:
+            hit = unpack_result(hit)
+            if hit is None:
+                continue
+            candidate = make_entity_proxy(hit)
+            parsed[candidate.id] = candidate
         candidates.append(candidate)
-    log.debug(
-        "Candidate [%s]: %s: %d possible matches",
-        entity.schema.name,
-        entity.caption,
-        len(candidates),
-    )
+    return candidates
+
 
-    results = _bulk_compare([(entity, c) for c in candidates])
+def _match_candidates(entity, candidates, results, entityset_ids):
+    """Generate matches from the scored candidates of an entity."""
     match_count = 0
     for match, (score, doubt, method) in zip(candidates, results):
         log.debug(
@@ -208,9 +463,86 @@ def _query_item(entity, entitysets=True):
 
     XREF_ENTITIES.inc()
     XREF_MATCHES.observe(match_count)
+
+
+def _fetch_candidates(entities, blocking=None):
+    """Fetch the candidates for a block of entities with a single multi-search
+    request. Returns a list of tuples of each entity and its candidates."""
+    queried = []
+    body = []
+    for entity in entities:
+        query = _candidates_query(entity, blocking=blocking)
+        if query is None:
+            continue
+        queried.append(entity)
+        body.extend(query)
+    if not len(queried):
+        return []
+
+    start_time = default_timer()
+    response = es.msearch(body=body)
+    roundtrip_duration = max(0, default_timer() - start_time)
     XREF_CANDIDATES_QUERY_ROUNDTRIP_DURATION.observe(roundtrip_duration)
-    if query_duration:
-        XREF_CANDIDATES_QUERY_DURATION.observe(query_duration)
+
+    blocks = []
+    parsed = {}
+    for entity, result in zip(queried, response.get("responses", [])):
+        if "error" in result:
+            log.error(
+                "Candidate query failed [%s]: %s: %r",
+                entity.schema.name,
+                entity.id,
+                result.get("error"),
+            )
+            continue
+        query_duration = result.get("took")
+        if query_duration:
+            # ES returns milliseconds, but we track query time in seconds
+            XREF_CANDIDATES_QUERY_DURATION.observe(query_duration / 1000)
+        candidates = _parse_candidates(result, parsed)
+        log.debug(
+            "Candidate [%s]: %s: %d possible matches",
+            entity.schema.name,
+            entity.caption,
+            len(candidates),
+        )
+        blocks.append((entity, candidates))
+    return blocks
+
+
+def _block_pairs(blocks):
+    return [(entity, c) for entity, candidates in blocks for c in candidates]
+
+
+def _match_blocks(blocks, scores, entitysets=True):
+    """Generate the matches of a block of entities from the scores of all its
+    pairs. Yields a tuple of each entity and the list of its matches."""
+    memberships = {}
+    if entitysets:
+        memberships = EntitySet.entities_entitysets([e.id for e, _ in blocks])
+    scores = iter(scores)
+    for entity, candidates in blocks:
+        results = list(islice(scores, len(candidates)))
+        entityset_ids = memberships.get(entity.id, set()) if entitysets else []
+        matches = list(_match_candidates(entity, candidates, results, entityset_ids))
+        yield entity, matches
+
+
+def _query_batch(entities, entitysets=True, blocking=None):
+    """Cross-reference a block of entities, fetching the candidates for all of
+    them with a single multi-search request and scoring all pairs of the block
+    at once. Yields a tuple of each entity and the list of its matches."""
+    blocks = _fetch_candidates(entities, blocking=blocking)
+    if not len(blocks):
+        return
+    scores = _bulk_compare(_block_pairs(blocks))
+    yield from _match_blocks(blocks, scores, entitysets=entitysets)
+
+
+def _query_item(entity, entitysets=True, blocking=None):
+    """Cross-reference an entity or document, given as an indexed document."""
+    for _, matches in _query_batch([entity], entitysets=entitysets, blocking=blocking):
+        yield from matches
 
 
 def _iter_mentions(collection):
@@ -237,14 +569,13 @@ def _iter_mentions(collection):
         yield proxy
 
 
-def _query_mentions(collection):
-    aggregator = get_aggregator(collection, origin=ORIGIN)
-    aggregator.delete(origin=ORIGIN)
-    writer = aggregator.bulk()
-    for proxy in _iter_mentions(collection):
+def _reify_mentions(writer, proxies, blocking=None):
+    """Match a block of mention-based pseudo-entities and write those with
+    matches back to the aggregator."""
+    for proxy, matches in _query_batch(proxies, entitysets=False, blocking=blocking):
         schemata = set()
         countries = set()
-        for match in _query_item(proxy, entitysets=False):
+        for match in matches:
             schemata.add(match.match.schema)
             countries.update(match.match.get_type_values(registry.country))
             match.entityset_ids = []
@@ -262,20 +593,229 @@ def _query_mentions(collection):
             log.debug("Reifying [%s]: %s", proxy.schema.name, proxy)
             writer.put(proxy, fragment="mention")
             # pprint(proxy.to_dict())
+
+
+def _query_mentions(collection, blocking=None):
+    aggregator = get_aggregator(collection, origin=ORIGIN)
+    aggregator.delete(origin=ORIGIN)
+    writer = aggregator.bulk()
+    batches = batched(_iter_mentions(collection), SETTINGS.XREF_BATCH_SIZE)
+    for batch in batches:
+        yield from _reify_mentions(writer, batch, blocking=blocking)
     writer.flush()
 
 
-def _query_entities(collection):
-    """Generate matches for indexing."""
+def _iter_entities(collection, entity_ids=None):
+    """Scroll the matchable entities of a collection, optionally limited to a
+    shard of entity IDs."""
     log.info("[%s] Generating entity-based xref...", collection)
     matchable = [s.name for s in model if s.matchable]
-    for proxy in iter_proxies(
+    filters = []
+    if entity_ids is not None:
+        filters.append({"ids": {"values": list(entity_ids)}})
+    return iter_proxies(
         collection_id=collection.id,
         schemata=matchable,
+        filters=filters,
         es_scroll=SETTINGS.XREF_SCROLL,
         es_scroll_size=SETTINGS.XREF_SCROLL_SIZE,
-    ):
-        yield from _query_item(proxy)
+    )
+
+
+def _query_entities(collection, entity_ids=None, blocking=None):
+    """Generate matches for indexing, optionally limited to a shard of
+    entity IDs."""
+    proxies = _iter_entities(collection, entity_ids=entity_ids)
+    for batch in batched(proxies, SETTINGS.XREF_BATCH_SIZE):
+        for _, matches in _query_batch(batch, blocking=blocking):
+            yield from matches
+
+
+def _observe_stage(stage, count, start_time):
+    XREF_PIPELINE_ITEMS.labels(stage).inc(count)
+    XREF_PIPELINE_DURATION.labels(stage).observe(default_timer() - start_time)
+
+
+def _put(queue, item, stop):
+    """Put an item on a bounded queue unless the pipeline has been stopped."""
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=1)
+            return True
+        except Full:
+            continue
+    return False
+
+
+def _get(queue, stop):
+    """Get the next item from a queue, or the end marker if the pipeline has
+    been stopped."""
+    while not stop.is_set():
+        try:
+            return queue.get(timeout=1)
+        except Empty:
+            continue
+    return _DONE
+
+
+def _run_stage(stop, func, *args):
+    """Run a pipeline stage, stopping all others if it fails."""
+    try:
+        func(*args, stop)
+    except BaseException:
+        stop.set()
+        raise
+
+
+def _scroll_stage(proxies, blocks, stop):
+    start_time = default_timer()
+    try:
+        for batch in batched(proxies, SETTINGS.XREF_BATCH_SIZE):
+            _observe_stage("scroll", len(batch), start_time)
+            if not _put(blocks, batch, stop):
+                return
+            start_time = default_timer()
+    finally:
+        _put(blocks, _DONE, stop)
+
+
+def _query_stage(blocks, fetched, blocking, stop):
+    try:
+        while True:
+            batch = _get(blocks, stop)
+            if batch is _DONE:
+                # Hand the end marker on to the next query thread
+                _put(blocks, _DONE, stop)
+                return
+            start_time = default_timer()
+            candidates = _fetch_candidates(batch, blocking=blocking)
+            _observe_stage("query", len(batch), start_time)
+            if not _put(fetched, candidates, stop):
+                return
+    finally:
+        _put(fetched, _DONE, stop)
+
+
+def _score_pairs(pairs):
+    """Score serialized pairs of entities, run in the scoring processes."""
+    proxies = [(make_entity_proxy(e), make_entity_proxy(c)) for e, c in pairs]
+    return list(_bulk_compare(proxies))
+
+
+def _scoring_pool():
+    """Create the pool of scoring processes for an xref run, or a null context
+    if scoring is not fanned out. The pool is shared by all the batches of the
+    run, so that the processes (and the loaded models) are only started once.
+    The processes are spawned rather than forked, as the other stages are
+    running in threads already."""
+    processes = SETTINGS.XREF_PIPELINE_PROCESSES
+    if SETTINGS.XREF_PIPELINE_THREADS <= 0 or processes <= 0:
+        return nullcontext()
+    return ProcessPoolExecutor(
+        processes,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_clear_feature_cache,
+    )
+
+
+def _score_stage(fetched, scored, threads, executor, stop):
+    """Score the fetched candidates and look up the entity set memberships.
+    This runs on the calling thread, which owns the database session. With
+    a pool of scoring processes, up to two blocks per process are scored
+    ahead while the oldest one is turned into matches."""
+    processes = SETTINGS.XREF_PIPELINE_PROCESSES
+    pending = deque()
+
+    def _complete(blocks, scores, start_time):
+        matches = []
+        for _, entity_matches in _match_blocks(blocks, scores):
+            matches.extend(entity_matches)
+        _observe_stage("score", len(blocks), start_time)
+        return _put(scored, matches, stop)
+
+    try:
+        running = threads
+        while running > 0:
+            blocks = _get(fetched, stop)
+            if blocks is _DONE:
+                running -= 1
+                continue
+            if not len(blocks):
+                continue
+            start_time = default_timer()
+            pairs = _block_pairs(blocks)
+            if executor is None:
+                if not _complete(blocks, _bulk_compare(pairs), start_time):
+                    return
+                continue
+            data = [(e.to_dict(), c.to_dict()) for e, c in pairs]
+            pending.append((blocks, executor.submit(_score_pairs, data), start_time))
+            if len(pending) >= processes * 2:
+                blocks, future, start_time = pending.popleft()
+                if not _complete(blocks, future.result(), start_time):
+                    return
+        while len(pending):
+            blocks, future, start_time = pending.popleft()
+            if not _complete(blocks, future.result(), start_time):
+                return
+    finally:
+        # The pool outlives this batch, only drop its queued work on failure
+        for _, future, _ in pending:
+            future.cancel()
+        _put(scored, _DONE, stop)
+
+
+def _index_stage(collection, scored, stop):
+    def _matches():
+        while True:
+            matches = _get(scored, stop)
+            if matches is _DONE:
+                return
+            start_time = default_timer()
+            yield from matches
+            _observe_stage("index", len(matches), start_time)
+
+    index_matches(collection, _matches())
+
+
+def _pipeline_entities(collection, entity_ids=None, blocking=None, executor=None):
+    """Cross-reference the entities of a collection in overlapping stages,
+    connected by bounded queues: a thread scrolling the entities, a pool of
+    threads fetching candidates, the scoring on the calling thread (optionally
+    fanned out to the pool of processes of the run) and a thread
+    bulk-indexing the matches."""
+    threads = max(1, SETTINGS.XREF_PIPELINE_THREADS)
+    proxies = _iter_entities(collection, entity_ids=entity_ids)
+    blocks = Queue(maxsize=threads * 2)
+    fetched = Queue(maxsize=threads * 2)
+    scored = Queue(maxsize=threads * 2)
+    stop = threading.Event()
+    with ThreadPoolExecutor(threads + 2, thread_name_prefix="xref") as pool:
+        futures = [pool.submit(_run_stage, stop, _scroll_stage, proxies, blocks)]
+        for _ in range(threads):
+            futures.append(
+                pool.submit(_run_stage, stop, _query_stage, blocks, fetched, blocking)
+            )
+        futures.append(pool.submit(_run_stage, stop, _index_stage, collection, scored))
+        try:
+            _score_stage(fetched, scored, threads, executor, stop)
+        except BaseException:
+            stop.set()
+            raise
+        for future in futures:
+            future.result()
+
+
+def _index_entities(collection, entity_ids=None, blocking=None, executor=None):
+    """Generate and index the matches of the entities in a collection, using
+    the blocking index and the scoring pool of the run (if there are any)."""
+    if SETTINGS.XREF_PIPELINE_THREADS > 0:
+        _pipeline_entities(
+            collection, entity_ids=entity_ids, blocking=blocking, executor=executor
+        )
+        return
+    matches = _query_entities(collection, entity_ids=entity_ids, blocking=blocking)
+    index_matches(collection, matches)
 
 
 def xref_entity(collection, proxy):
@@ -283,21 +823,197 @@ def xref_entity(collection, proxy):
     if not proxy.schema.matchable:
         return
     log.info("[%s] Generating xref: %s...", collection, proxy.id)
+    _clear_feature_cache()
     delete_xref(collection, entity_id=proxy.id, sync=True)
-    index_matches(collection, _query_item(proxy))
+    blocking = get_warm_blocking_index()
+    index_matches(collection, _query_item(proxy, blocking=blocking))
 
 
-def xref_collection(collection):
-    """Cross-reference all the entities and documents in a collection."""
-    log.info(
-        f"[{collection}] xref_collection scroll settings: scroll={SETTINGS.XREF_SCROLL}, "
-        f"scroll_size={SETTINGS.XREF_SCROLL_SIZE}"
-    )
-    log.info(f"[{collection}] Clearing previous xref state....")
-    delete_xref(collection, sync=True)
+def _shards_key(collection):
+    return cache.object_key(Collection, collection.id, "xref_shards")
+
+
+def _shards_run_key(collection):
+    return cache.object_key(Collection, collection.id, "xref_shards_run")
+
+
+def _shards_failed_key(collection):
+    return cache.object_key(Collection, collection.id, "xref_shards_failed")
+
+
+def _shard_attempts_key(collection, shard):
+    return cache.object_key(Collection, collection.id, "xref_shard", shard)
+
+
+def _started_key(collection):
+    return cache.object_key(Collection, collection.id, "xref_started")
+
+
+def _watermark_key(collection):
+    return cache.object_key(Collection, collection.id, "xref_watermark")
+
+
+def _checkpoint_key(collection):
+    return cache.object_key(Collection, collection.id, "xref_checkpoint")
+
+
+def get_xref_checkpoint(collection) -> dict | None:
+    """Get the progress of an unfinished xref run of a collection."""
+    return cache.get_complex(_checkpoint_key(collection))
+
+
+def _save_checkpoint(collection, checkpoint):
+    cache.set_complex(_checkpoint_key(collection), checkpoint)
+
+
+def get_xref_watermark(collection) -> datetime | None:
+    """Get the start time of the last completed xref run of a collection."""
+    watermark = cache.get(_watermark_key(collection))
+    if watermark is None:
+        return None
+    return datetime.fromisoformat(watermark)
+
+
+def _update_watermark(collection):
+    """Promote the start time of the finished run to the xref watermark, so
+    that the next incremental run picks up any change made since then."""
+    started = cache.get(_started_key(collection))
+    if started is not None:
+        cache.set(_watermark_key(collection), started)
+        cache.delete(_started_key(collection))
+
+
+def _entity_batches(collection, since=None):
+    aggregator = get_aggregator(collection)
+    return aggregator.get_sorted_id_batches(SETTINGS.XREF_SHARD_SIZE, since=since)
+
+
+def _claim_shards(collection, run_id) -> bool:
+    """Claim the sharded xref of a collection for a run. Only one sharded run
+    is in flight per collection, until its reducer completes or the claim
+    expires (e.g. after a worker was lost). A retry of the same run keeps its
+    claim."""
+    key = _shards_run_key(collection)
+    expires = SETTINGS.XREF_SHARDS_EXPIRE
+    if cache.kv.set(key, run_id, nx=True, ex=expires):
+        cache.kv.delete(_shards_failed_key(collection))
+        return True
+    return cache.kv.get(key) == run_id
+
+
+def _release_shards(collection):
+    cache.kv.delete(_shards_run_key(collection))
+    cache.kv.delete(_shards_failed_key(collection))
+
+
+def _queue_shards(collection, batches, run_id):
+    """Defer one xref job per shard of entity IDs. The IDs of the pending
+    shards are kept in a set, which also holds the dispatcher itself so that
+    the reducer is not triggered before all shards have been queued. The
+    shard IDs are prefixed with the run, so that a late shard of an earlier,
+    expired run is never taken for one of this run."""
+    key = _shards_key(collection)
+    cache.kv.delete(key)
+    cache.kv.sadd(key, run_id)
+    cache.kv.expire(key, SETTINGS.XREF_SHARDS_EXPIRE)
+    shards = 0
+    for entity_ids in batches:
+        shard = f"{run_id}:{entity_ids[0]}"
+        cache.kv.sadd(key, shard)
+        queue_xref_shard(collection, entity_ids, shard)
+        shards += 1
+    log.info(f"[{collection}] Queued {shards} xref shards.")
+    _shard_done(collection, run_id)
+
+
+def _shard_done(collection, shard):
+    """Mark a shard as complete and queue the reducer after the last one. A
+    shard that is done twice (e.g. a retry after it already completed) does
+    not count again."""
+    key = _shards_key(collection)
+    pipe = cache.kv.pipeline()
+    pipe.srem(key, shard)
+    pipe.scard(key)
+    removed, remaining = pipe.execute()
+    cache.kv.delete(_shard_attempts_key(collection, shard))
+    if removed and remaining == 0:
+        log.info(f"[{collection}] All xref shards done, queuing mentions...")
+        queue_xref_mentions(collection)
+
+
+def _shard_failed(collection, shard) -> bool:
+    """Count a failed attempt of a shard. After the last retry, the shard is
+    given up and marked as done, so that the reducer still runs. The failure
+    is recorded, so the run does not promote the xref watermark."""
+    key = _shard_attempts_key(collection, shard)
+    attempts = cache.kv.incr(key)
+    cache.kv.expire(key, SETTINGS.XREF_SHARDS_EXPIRE)
+    # Like the task retries: `-1` (or `0`) means the shard is not retried
+    if attempts <= max(0, defer.tasks.xref.max_retries):
+        return False
+    log.error(f"[{collection}] Xref shard {shard} failed {attempts} times, skipping.")
+    cache.kv.set(_shards_failed_key(collection), shard, ex=SETTINGS.XREF_SHARDS_EXPIRE)
+    _shard_done(collection, shard)
+    return True
+
+
+def _clear_changed(collection, since):
+    """Remove the matches of the entities changed since the given time once,
+    before any of them is re-matched. Deleting them per shard would also
+    remove the pairs that other shards have already written."""
+    for entity_ids in _entity_batches(collection, since=since):
+        delete_xref(collection, entity_ids=entity_ids, sync=True)
+
+
+def _clear_mentions(collection):
+    """Remove the matches and index entries of the entities reified from
+    mentions in a previous run, ahead of recomputing them."""
+    aggregator = get_aggregator(collection, origin=ORIGIN)
+    for entity_ids in aggregator.get_sorted_id_batches(
+        SETTINGS.XREF_SHARD_SIZE, origin=ORIGIN
+    ):
+        delete_xref(collection, entity_ids=entity_ids, sync=True)
     delete_entities(collection.id, origin=ORIGIN, sync=True)
-    index_matches(collection, _query_entities(collection))
-    index_matches(collection, _query_mentions(collection))
+
+
+def xref_shard(collection, entity_ids, shard=None):
+    """Cross-reference one shard of the entities in a collection. Shards
+    queued without an ID (by an earlier version) are not counted."""
+    log.info(f"[{collection}] Xref shard: {len(entity_ids)} entities...")
+    _clear_feature_cache()
+    blocking = get_warm_blocking_index()
+    try:
+        with _scoring_pool() as executor:
+            _index_entities(
+                collection, entity_ids=entity_ids, blocking=blocking, executor=executor
+            )
+    except Exception:
+        if shard is not None:
+            _shard_failed(collection, shard)
+        raise
+    if shard is not None:
+        _shard_done(collection, shard)
+
+
+def xref_mentions(collection):
+    """Cross-reference the mentions in a collection and re-index the reified
+    entities. This concludes the sharded xref runs, and releases their claim
+    on the collection."""
+    failed = cache.kv.get(_shards_failed_key(collection))
+    if failed is not None:
+        log.warning(
+            f"[{collection}] Xref shards failed (e.g. {failed}), "
+            "keeping the previous xref watermark."
+        )
+    _xref_mentions(collection, get_warm_blocking_index(), watermark=failed is None)
+    _release_shards(collection)
+
+
+def _xref_mentions(collection, blocking, watermark=True):
+    """Cross-reference the mentions in a collection and re-index the reified
+    entities. This concludes both the local and the sharded xref runs."""
+    _clear_feature_cache()
+    index_matches(collection, _query_mentions(collection, blocking=blocking))
     log.info(f"[{collection}] Xref done, re-indexing to reify mentions...")
     reindex_collection(
         collection,
@@ -307,6 +1023,101 @@ def xref_collection(collection):
         profiles=False,
         origin="xref",
     )
+    if watermark:
+        _update_watermark(collection)
+
+
+def xref_collection(
+    collection, shards=False, incremental=False, resume=False, run_id=None
+):
+    """Cross-reference all the entities and documents in a collection.
+
+    The entities are matched in sorted batches and the progress is
+    checkpointed after each one, so that a retried run resumes after the last
+    completed batch instead of clearing the matches and starting over. A run
+    only resumes when asked to, and only from the checkpoint of the same run
+    if a `run_id` is given.
+
+    Args:
+        collection: The collection to cross-reference
+        shards: Split the entities into shards which are distributed across
+            the workers instead of being matched in this process
+        incremental: Only re-match the entities whose aggregator fragments
+            changed since the last completed run (if there is one)
+        resume: Continue an unfinished run from its last checkpoint
+        run_id: The ID of the run (e.g. set once when the job is queued, so
+            that its retries share it), stored with the checkpoint. A sharded
+            run claims the collection until its shards are done, and another
+            sharded run is refused meanwhile
+    """
+    log.info(
+        f"[{collection}] xref_collection scroll settings: scroll={SETTINGS.XREF_SCROLL}, "
+        f"scroll_size={SETTINGS.XREF_SCROLL_SIZE}"
+    )
+    _clear_feature_cache()
+    if shards:
+        run_id = run_id or Job.random_id()
+        if not _claim_shards(collection, run_id):
+            log.warning(f"[{collection}] A sharded xref run is in flight, skipping.")
+            return
+    checkpoint = get_xref_checkpoint(collection)
+    if checkpoint is not None:
+        mode = checkpoint.get("incremental") != incremental
+        other = run_id is not None and checkpoint.get("run_id") != run_id
+        if shards or mode or other or not resume:
+            cache.delete(_checkpoint_key(collection))
+            checkpoint = None
+
+    if checkpoint is None:
+        since = get_xref_watermark(collection) if incremental else None
+        started = datetime.utcnow()
+        cache.set(_started_key(collection), started.isoformat())
+        if since is None:
+            log.info(f"[{collection}] Clearing previous xref state....")
+            delete_xref(collection, sync=True)
+            delete_entities(collection.id, origin=ORIGIN, sync=True)
+        else:
+            log.info(f"[{collection}] Incremental xref of changes since {since}...")
+            _clear_mentions(collection)
+            _clear_changed(collection, since)
+        checkpoint = {
+            "run_id": run_id,
+            "incremental": incremental,
+            "since": since.isoformat() if since is not None else None,
+            "batches": 0,
+            "entities": 0,
+            "cursor": None,
+        }
+    else:
+        since = checkpoint.get("since")
+        since = datetime.fromisoformat(since) if since is not None else None
+        log.info(
+            f"[{collection}] Resuming xref after {checkpoint['entities']} "
+            f"entities (cursor: {checkpoint['cursor']})..."
+        )
+
+    if shards:
+        _queue_shards(collection, _entity_batches(collection, since=since), run_id)
+        return
+
+    _save_checkpoint(collection, checkpoint)
+    blocking = get_warm_blocking_index()
+    aggregator = get_aggregator(collection)
+    batches = get_sorted_id_batches_after(
+        aggregator, SETTINGS.XREF_SHARD_SIZE, after=checkpoint["cursor"], since=since
+    )
+    with _scoring_pool() as executor:
+        for entity_ids in batches:
+            _index_entities(
+                collection, entity_ids=entity_ids, blocking=blocking, executor=executor
+            )
+            checkpoint["batches"] += 1
+            checkpoint["entities"] += len(entity_ids)
+            checkpoint["cursor"] = entity_ids[-1]
+            _save_checkpoint(collection, checkpoint)
+            log.info(f"[{collection}] Xref: {checkpoint['entities']} entities...")
+    _xref_mentions(collection, blocking)
+    cache.delete(_checkpoint_key(collection))
 
 
 def _format_date(proxy):
@@ -321,7 +1132,7 @@ def _format_country(proxy):
     return ", ".join(countries)
 
 
-def _iter_match_batch(stub, sheet, batch):
+def _iter_match_batch(stub, batch):
     matchable = [s.name for s in model if s.matchable]
     entities = set()
     for match in batch:
@@ -342,63 +1153,111 @@ def _iter_match_batch(stub, sheet, batch):
             continue
         eproxy = make_entity_proxy(entity)
         mproxy = make_entity_proxy(match)
-        sheet.append(
-            [
-                obj.get("score"),
-                obj.get("doubt"),
-                eproxy.caption,
-                _format_date(eproxy),
-                _format_country(eproxy),
-                collection.get("label"),
-                mproxy.caption,
-                _format_date(mproxy),
-                _format_country(mproxy),
-                entity_url(eproxy.id),
-                entity_url(mproxy.id),
-            ]
-        )
+        yield [
+            obj.get("score"),
+            obj.get("doubt"),
+            eproxy.caption,
+            _format_date(eproxy),
+            _format_country(eproxy),
+            collection.get("label"),
+            mproxy.caption,
+            _format_date(mproxy),
+            _format_country(mproxy),
+            entity_url(eproxy.id),
+            entity_url(mproxy.id),
+        ]
+
+
+class ExcelMatchWriter:
+    """Write matches to a write-only workbook, which openpyxl spools to disk
+    row by row instead of keeping the sheet in memory."""
+
+    extension = "xlsx"
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.excel = ExcelWriter()
+        self.sheet = self.excel.make_sheet("Cross-reference", EXPORT_HEADERS)
+
+    def write(self, rows):
+        for row in rows:
+            self.sheet.append(row)
+
+    def close(self):
+        self.excel.workbook.save(self.file_path)
+
+
+class CSVMatchWriter:
+    extension = "csv"
+
+    def __init__(self, file_path):
+        self.fh = open(file_path, "w", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.fh)
+        self.writer.writerow(EXPORT_HEADERS)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.fh.close()
+
+
+class ParquetMatchWriter:
+    """Write matches as one Parquet row group per batch of matches."""
+
+    extension = "parquet"
+
+    def __init__(self, file_path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        fields = [pa.field(h, pa.float64()) for h in EXPORT_HEADERS[:2]]
+        fields.extend(pa.field(h, pa.string()) for h in EXPORT_HEADERS[2:])
+        self.schema = pa.schema(fields)
+        self.pa = pa
+        self.writer = pq.ParquetWriter(file_path, self.schema)
+
+    def write(self, rows):
+        rows = list(rows)
+        if not len(rows):
+            return
+        data = dict(zip(EXPORT_HEADERS, map(list, zip(*rows))))
+        table = self.pa.Table.from_pydict(data, schema=self.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        self.writer.close()
+
+
+EXPORT_WRITERS = {
+    XLSX: ExcelMatchWriter,
+    CSV: CSVMatchWriter,
+    PARQUET: ParquetMatchWriter,
+}
 
 
 def export_matches(export_id):
     """Export the top N matches of cross-referencing for the given collection
-    to an Excel formatted export."""
+    to an Excel, CSV or Parquet formatted export, streaming the rows to disk
+    as the matches are scrolled."""
     export = Export.by_id(export_id)
     export_dir = ensure_path(mkdtemp(prefix="aleph.export."))
     try:
         role = Role.by_id(export.creator_id)
         authz = Authz.from_role(role)
         collection = Collection.by_id(export.collection_id)
-        file_name = "%s - Crossreference.xlsx" % collection.label  # codespell:ignore
-        file_path = export_dir.joinpath(f"{export_id}.xslx")
-        excel = ExcelWriter()
-        headers = [
-            "Score",
-            "Doubt",
-            "Entity Name",
-            "Entity Date",
-            "Entity Countries",
-            "Candidate Collection",
-            "Candidate Name",
-            "Candidate Date",
-            "Candidate Countries",
-            "Entity Link",
-            "Candidate Link",
-        ]
-        sheet = excel.make_sheet("Cross-reference", headers)
-        batch = []
-
-        for match in iter_matches(collection, authz):
-            batch.append(match)
-            if len(batch) >= BULK_PAGE:
-                _iter_match_batch(excel, sheet, batch)
-                batch = []
-        if len(batch):
-            _iter_match_batch(excel, sheet, batch)
-
-        with open(file_path, "wb") as fp:
-            buffer = excel.get_bytesio()
-            for data in buffer:
-                fp.write(data)
+        writer_cls = EXPORT_WRITERS.get(export.mime_type, ExcelMatchWriter)
+        file_name = "%s - Crossreference.%s" % (  # codespell:ignore
+            collection.label,
+            writer_cls.extension,
+        )
+        file_path = export_dir.joinpath(f"{export_id}.{writer_cls.extension}")
+        writer = writer_cls(file_path)
+        try:
+            for batch in batched(iter_matches(collection, authz), BULK_PAGE):
+                writer.write(_iter_match_batch(writer, batch))
+        finally:
+            writer.close()
 
         complete_export(export_id, file_path, file_name)
     except Exception:
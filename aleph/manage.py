@@ -1,5 +1,6 @@
 import json
 import logging
+from contextlib import nullcontext
 from itertools import count
 from pathlib import Path
 from typing import Any, TextIO
@@ -22,19 +23,27 @@ from tabulate import tabulate
 
 from aleph.authz import Authz
 from aleph.core import cache, create_app, db
+from aleph.index.admin import delete_legacy_xref, search_settings
 from aleph.index.collections import get_collection as _get_index_collection
 from aleph.logic.aggregator import get_aggregator, get_aggregator_name
 from aleph.logic.archive import cleanup_archive
+from aleph.logic.blocking import build_blocking_index
 from aleph.logic.collections import (
+    IndexWorkerPool,
     aggregate_model,
     compute_collection,
+    compute_index_diff,
     create_collection,
     delete_collection,
+    delta_reindex_collection,
 )
 from aleph.logic.collections import index_diff as _index_diff
 from aleph.logic.collections import (
+    index_diff_collections,
+    rebuild_index,
     reindex_collection,
     reingest_collection,
+    repair_index_diff,
     update_collection,
     upgrade_collections,
     validate_collection_foreign_ids,
@@ -257,6 +266,8 @@ def _reindex_collection(
     since=None,
     until=None,
     origin=None,
+    pool=None,
+    resume=False,
 ):
     log.info("[%s] Starting to re-index", collection)
     try:
@@ -273,11 +284,20 @@ def _reindex_collection(
             since=since,
             until=until,
             origin=origin,
+            pool=pool,
+            resume=resume,
         )
     except Exception:
         log.exception("Failed to re-index: %s", collection)
 
 
+def _index_pool(workers):
+    """Get a pool of worker processes to reindex in parallel, if requested."""
+    if workers > 1:
+        return IndexWorkerPool(workers)
+    return nullcontext()
+
+
 @cli.command()
 @click.argument("foreign_id")
 @click.option("--flush", is_flag=True, default=False)
@@ -333,6 +353,19 @@ def _reindex_collection(
     default=None,
     help="Filter entities by aggregator origin (e.g., 'xref', 'aleph')",
 )
+@click.option(
+    "-w",
+    "--workers",
+    type=int,
+    default=1,
+    help="Number of processes indexing batches in parallel (default: 1)",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="Continue an unfinished reindex from its last checkpoint",
+)
 def reindex(
     foreign_id,
     flush=False,
@@ -346,23 +379,28 @@ def reindex(
     since=None,
     until=None,
     origin=None,
+    workers=1,
+    resume=False,
 ):
     """Index all the aggregator contents for a collection."""
     collection = get_collection(foreign_id)
-    _reindex_collection(
-        collection,
-        flush=flush,
-        diff_only=diff_only,
-        model=model,
-        mappings=mappings,
-        profiles=profiles,
-        queue_batches=queue_batches,
-        batch_size=batch_size,
-        schema=schema,
-        since=since,
-        until=until,
-        origin=origin,
-    )
+    with _index_pool(workers) as pool:
+        _reindex_collection(
+            collection,
+            flush=flush,
+            diff_only=diff_only,
+            model=model,
+            mappings=mappings,
+            profiles=profiles,
+            queue_batches=queue_batches,
+            batch_size=batch_size,
+            schema=schema,
+            since=since,
+            until=until,
+            origin=origin,
+            pool=pool,
+            resume=resume,
+        )
 
 
 def _write_entity_ids(entity_ids, output_file, description):
@@ -373,37 +411,20 @@ def _write_entity_ids(entity_ids, output_file, description):
     log.info("Wrote %d %s to %s", len(sorted_ids), description, output_file.name)
 
 
-def _compute_diff_stats(collection) -> dict[str, int]:
-    """Compute diff statistics from the streaming index_diff generator.
+def _compute_diff_stats(collection, full=False) -> dict[str, int]:
+    """Compute diff statistics, either by comparing checksums of ID buckets or,
+    if `full` is set, from the streaming index_diff generator.
 
-    Returns a dict with counts and lists of entity IDs.
+    Returns a dict with counts of entity IDs.
     """
-    aggregator_ids = 0
-    index_ids = 0
-    in_both = 0
-    only_in_aggregator = 0
-    only_in_index = 0
-
-    for aggregator_id, index_id in _index_diff(collection):
-        if aggregator_id is not None and index_id is not None:
-            aggregator_ids += 1
-            index_ids += 1
-            in_both += 1
-        elif aggregator_id is not None:
-            # Only in aggregator
-            aggregator_ids += 1
-            only_in_aggregator += 1
-        elif index_id is not None:
-            # Only in index
-            index_ids += 1
-            only_in_index += 1
-
+    diff = compute_index_diff(collection, full=full)
     return {
-        "aggregator_ids": aggregator_ids,
-        "index_ids": index_ids,
-        "in_both": in_both,
-        "only_in_aggregator": only_in_aggregator,
-        "only_in_index": only_in_index,
+        "aggregator_ids": diff.aggregator,
+        "index_ids": diff.index,
+        "in_both": diff.in_both,
+        "only_in_aggregator": len(diff.only_in_aggregator),
+        "only_in_index": len(diff.only_in_index),
+        "stale": len(diff.stale),
     }
 
 
@@ -438,7 +459,13 @@ def _collect_diff_ids(collection) -> dict[str, list[str]]:
 
 @cli.command("index-diff")
 @click.argument("foreign_id")
-def index_diff(foreign_id):
+@click.option(
+    "--full",
+    is_flag=True,
+    default=False,
+    help="Compare every entity ID instead of checksums of ID buckets",
+)
+def index_diff(foreign_id, full=False):
     """Compare entity IDs between aggregator and search index (streaming stats only).
 
     For exporting IDs to files, use the 'export-index-diff' command instead.
@@ -446,7 +473,7 @@ def index_diff(foreign_id):
     collection = get_collection(foreign_id)
 
     log.info("[%s] Computing diff counts...", collection)
-    diff = _compute_diff_stats(collection)
+    diff = _compute_diff_stats(collection, full=full)
 
     # Display results
     log.info(
@@ -455,13 +482,15 @@ def index_diff(foreign_id):
         "  Total in index:             %10d\n"
         "  In both:                    %10d\n"
         "  Only in aggregator:         %10d\n"
-        "  Only in index:              %10d",
+        "  Only in index:              %10d\n"
+        "  Stale in index:             %10d",
         collection,
         diff["aggregator_ids"],
         diff["index_ids"],
         diff["in_both"],
         diff["only_in_aggregator"],
         diff["only_in_index"],
+        diff["stale"],
     )
 
 
@@ -547,43 +576,74 @@ def export_index_diff(
     default=None,
     help="Filter by casefiles (None means all)",
 )
-def index_diff_all(casefile=None):
+@click.option(
+    "--full",
+    is_flag=True,
+    default=False,
+    help="Compare every entity ID instead of checksums of ID buckets",
+)
+@click.option(
+    "-w",
+    "--workers",
+    type=int,
+    default=1,
+    help="Number of processes diffing collections in parallel (default: 1)",
+)
+@click.option(
+    "--manifest",
+    type=click.File("w"),
+    default=None,
+    help="Output file for the diff of each collection (JSON lines), "
+    "to be repaired with 'index-diff-repair'",
+)
+def index_diff_all(casefile=None, full=False, workers=1, manifest=None):
     """Compare entity IDs between aggregator and search index for all collections."""
+    collections = (
+        collection
+        for collection in Collection.all()
+        if casefile is None or collection.casefile == casefile
+    )
     collections_list = []
 
-    for collection in Collection.all():
-        if casefile is not None and collection.casefile != casefile:
-            continue
-
-        try:
-            log.info("Processing %s...", collection.foreign_id)
-            diff = _compute_diff_stats(collection)
-            collections_list.append(
-                {
-                    "foreign_id": collection.foreign_id,
-                    "label": collection.label,
-                    "aggregator": diff["aggregator_ids"],
-                    "index": diff["index_ids"],
-                    "in_both": diff["in_both"],
-                    "only_aggregator": diff["only_in_aggregator"],
-                    "only_index": diff["only_in_index"],
-                }
-            )
-        except Exception as e:
-            log.error("[%s] Failed to compute diff: %s", collection, e)
+    with _index_pool(workers) as pool:
+        for record in index_diff_collections(collections, full=full, pool=pool):
+            log.info("Processed %s.", record["foreign_id"])
+            if manifest is not None:
+                manifest.write(json.dumps(record) + "\n")
+            if "error" in record:
+                log.error(
+                    "[%s] Failed to compute diff: %s",
+                    record["foreign_id"],
+                    record["error"],
+                )
+                collections_list.append(
+                    {
+                        "foreign_id": record["foreign_id"],
+                        "label": record["label"],
+                        "aggregator": "ERROR",
+                        "index": "ERROR",
+                        "in_both": "ERROR",
+                        "only_aggregator": "ERROR",
+                        "only_index": "ERROR",
+                        "stale": "ERROR",
+                    }
+                )
+                continue
             collections_list.append(
                 {
-                    "foreign_id": collection.foreign_id,
-                    "label": collection.label,
-                    "aggregator": "ERROR",
-                    "index": "ERROR",
-                    "in_both": "ERROR",
-                    "only_aggregator": "ERROR",
-                    "only_index": "ERROR",
+                    "foreign_id": record["foreign_id"],
+                    "label": record["label"],
+                    "aggregator": record["aggregator"],
+                    "index": record["index"],
+                    "in_both": record["in_both"],
+                    "only_aggregator": len(record["only_in_aggregator"]),
+                    "only_index": len(record["only_in_index"]),
+                    "stale": len(record["stale"]),
                 }
             )
 
     # Display summary table
+    collections_list.sort(key=lambda c: c["foreign_id"])
     headers = [
         "Foreign ID",
         "Label",
@@ -592,6 +652,7 @@ def index_diff_all(casefile=None):
         "In Both",
         "Missing from Index",
         "Orphaned in Index",
+        "Stale in Index",
     ]
     rows = []
     for coll in collections_list:
@@ -604,6 +665,7 @@ def index_diff_all(casefile=None):
                 coll["in_both"],
                 coll["only_aggregator"],
                 coll["only_index"],
+                coll["stale"],
             ]
         )
 
@@ -624,6 +686,9 @@ def index_diff_all(casefile=None):
     total_only_index = sum(
         c["only_index"] for c in collections_list if isinstance(c["only_index"], int)
     )
+    total_stale = sum(
+        c["stale"] for c in collections_list if isinstance(c["stale"], int)
+    )
 
     log.info(
         "Index Diff Summary for All Collections:\n\n%s\n\n"
@@ -631,16 +696,146 @@ def index_diff_all(casefile=None):
         "  Total entities in aggregator:      %10d\n"
         "  Total entities in index:           %10d\n"
         "  Total missing from index:          %10d\n"
-        "  Total orphaned in index:           %10d",
+        "  Total orphaned in index:           %10d\n"
+        "  Total stale in index:              %10d",
         table,
         len(collections_list),
         total_aggregator,
         total_index,
         total_only_aggregator,
         total_only_index,
+        total_stale,
     )
 
 
+@cli.command("index-diff-repair")
+@click.argument("manifest", type=click.File("r"))
+@click.option(
+    "--orphans/--no-orphans",
+    is_flag=True,
+    default=True,
+    help="Delete the entities that are only in the index",
+)
+@click.option(
+    "--queue-batches",
+    is_flag=True,
+    default=False,
+    help="Queue batches for parallel processing",
+)
+@click.option(
+    "--batch-size",
+    type=int,
+    default=10_000,
+    help="Batch size for processing entities (default: 10000)",
+)
+@click.option(
+    "-w",
+    "--workers",
+    type=int,
+    default=1,
+    help="Number of processes indexing batches in parallel (default: 1)",
+)
+def index_diff_repair(
+    manifest, orphans=True, queue_batches=False, batch_size=10_000, workers=1
+):
+    """Repair the drift recorded in a manifest written by 'index-diff-all'."""
+    with _index_pool(workers) as pool:
+        for line in manifest:
+            record = json.loads(line)
+            if "error" in record:
+                continue
+            only_in_index = record["only_in_index"] if orphans else []
+            stale = record.get("stale", [])
+            missing = record["only_in_aggregator"]
+            if not len(missing) and not len(only_in_index) and not len(stale):
+                continue
+            collection = Collection.by_id(record["collection_id"])
+            if collection is None:
+                log.warning("Collection not found: %s", record["foreign_id"])
+                continue
+            repair_index_diff(
+                collection,
+                missing,
+                only_in_index,
+                queue_batches=queue_batches,
+                batch_size=batch_size,
+                pool=pool,
+                stale=stale,
+            )
+            if not queue_batches:
+                compute_collection(collection, force=True)
+
+
+@cli.command("reindex-delta")
+@click.argument("foreign_id", required=False)
+@click.option(
+    "--batch-size",
+    type=int,
+    default=10_000,
+    help="Batch size for processing entities (default: 10000)",
+)
+@click.option(
+    "-w",
+    "--workers",
+    type=int,
+    default=1,
+    help="Number of processes indexing batches in parallel (default: 1)",
+)
+def reindex_delta(foreign_id=None, batch_size=10_000, workers=1):
+    """Index the changes since the index watermark of a collection (or all)."""
+    if foreign_id is not None:
+        collections = [get_collection(foreign_id)]
+    else:
+        collections = Collection.all()
+    with _index_pool(workers) as pool:
+        for collection in collections:
+            delta_reindex_collection(collection, batch_size=batch_size, pool=pool)
+
+
+@cli.command("index-rebuild")
+@click.argument("version")
+@click.option(
+    "--alias",
+    default=None,
+    help="Index version name of the aliases to swap (default: the write version)",
+)
+@click.option(
+    "--batch-size",
+    type=int,
+    default=10_000,
+    help="Batch size for processing entities (default: 10000)",
+)
+@click.option(
+    "-w",
+    "--workers",
+    type=int,
+    default=1,
+    help="Number of processes indexing batches in parallel (default: 1)",
+)
+@click.option(
+    "--force",
+    is_flag=True,
+    default=False,
+    help="Swap the aliases even if entity counts differ from the aggregator",
+)
+def index_rebuild(version, alias=None, batch_size=10_000, workers=1, force=False):
+    """Rebuild the entity indexes as VERSION and swap the aliases over to it."""
+    alias = alias or search_settings.index_write
+    try:
+        with _index_pool(workers) as pool:
+            mismatches = rebuild_index(
+                version, alias, batch_size=batch_size, pool=pool, force=force
+            )
+    except ValueError as exc:
+        raise click.ClickException(str(exc))
+    if len(mismatches):
+        headers = ["Collection ID", "Foreign ID", "Aggregator", "Index"]
+        rows = [list(m.values()) for m in mismatches]
+        print(tabulate(rows, headers=headers, tablefmt="simple"))
+        if not force:
+            raise click.ClickException(f"Not swapping aliases to {version}")
+
+
 @cli.command("reindex-full")
 @click.option("--flush", is_flag=True, default=False)
 @click.option("--model/--no-model", is_flag=True, default=True)
@@ -694,6 +889,19 @@ def index_diff_all(casefile=None):
         "Accepts: ISO dates, Unix timestamps, relative dates (e.g., '1d', '2 weeks ago')"
     ),
 )
+@click.option(
+    "-w",
+    "--workers",
+    type=int,
+    default=1,
+    help="Number of processes indexing batches in parallel (default: 1)",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="Continue unfinished reindexes from their last checkpoints",
+)
 def reindex_full(
     flush=False,
     diff_only=False,
@@ -705,31 +913,37 @@ def reindex_full(
     schema=None,
     since=None,
     until=None,
+    workers=1,
+    resume=False,
 ):
     """Re-index all collections."""
-    for collection in Collection.all():
-        if queue:
-            queue_reindex(
-                collection,
-                flush=flush,
-                diff_only=diff_only,
-                schema=schema,
-                since=since,
-                until=until,
-            )
-        else:
-            _reindex_collection(
-                collection,
-                flush=flush,
-                diff_only=diff_only,
-                model=model,
-                mappings=mappings,
-                queue_batches=queue_batches,
-                batch_size=batch_size,
-                schema=schema,
-                since=since,
-                until=until,
-            )
+    with _index_pool(workers) as pool:
+        for collection in Collection.all():
+            if queue:
+                queue_reindex(
+                    collection,
+                    flush=flush,
+                    diff_only=diff_only,
+                    schema=schema,
+                    since=since,
+                    until=until,
+                    resume=resume,
+                )
+            else:
+                _reindex_collection(
+                    collection,
+                    flush=flush,
+                    diff_only=diff_only,
+                    model=model,
+                    mappings=mappings,
+                    queue_batches=queue_batches,
+                    batch_size=batch_size,
+                    schema=schema,
+                    since=since,
+                    until=until,
+                    pool=pool,
+                    resume=resume,
+                )
 
 
 @cli.command("reindex-casefiles")
@@ -1050,10 +1264,34 @@ def update():
 
 @cli.command()
 @click.argument("foreign_id")
-def xref(foreign_id):
+@click.option(
+    "--shards",
+    is_flag=True,
+    default=False,
+    help="Split the collection into shards and queue them across the workers",
+)
+@click.option(
+    "--incremental",
+    is_flag=True,
+    default=False,
+    help="Only re-match entities that changed since the last xref run",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="Resume an unfinished xref run from its last checkpoint",
+)
+def xref(foreign_id, shards=False, incremental=False, resume=False):
     """Cross-reference all entities and documents in a collection."""
     collection = get_collection(foreign_id)
-    xref_collection(collection)
+    xref_collection(collection, shards=shards, incremental=incremental, resume=resume)
+
+
+@cli.command("xref-blocking")
+def xref_blocking():
+    """Build the local blocking index used to find xref candidates."""
+    build_blocking_index()
 
 
 @cli.command("load-entities")
@@ -1322,6 +1560,7 @@ def publish(foreign_id):
 def upgrade(destructive):
     """Create or upgrade the search index and database."""
     upgrade_system()
+    delete_legacy_xref(destructive=destructive)
     # update_roles()
     upgrade_collections(cleanup_external=destructive)
 
@@ -1,5 +1,6 @@
 import cgi
 import logging
+from collections import defaultdict
 
 from banal import ensure_list, is_mapping
 from followthemoney import model
@@ -134,14 +135,55 @@ class Document(db.Model, DatedModel):
             raise ValueError("No unique criterion for document.")
 
         document = q.first()
+        parent_id = parent.id if parent is not None else None
+        return cls._save(
+            document, collection, parent_id, foreign_id, content_hash, meta, role_id
+        )
+
+    @classmethod
+    def save_many(cls, collection, items, role_id=None):
+        """Create or update many documents at once, looking up the existing
+        ones with a single query. The `items` are tuples of the parent ID, the
+        foreign ID, the content hash and the metadata of a document."""
+        foreign_ids = [sanitize_text(item[1]) for item in items]
+        q = cls.all()
+        q = q.filter(Document.collection_id == collection.id)
+        q = q.filter(Document.foreign_id.in_(foreign_ids))
+        existing = defaultdict(list)
+        for document in q:
+            existing[document.foreign_id].append(document)
+
+        documents = []
+        for (parent_id, _, content_hash, meta), foreign_id in zip(items, foreign_ids):
+            document = None
+            for candidate in existing[foreign_id]:
+                if parent_id is None or candidate.parent_id == parent_id:
+                    document = candidate
+                    break
+            document = cls._save(
+                document,
+                collection,
+                parent_id,
+                foreign_id,
+                content_hash,
+                meta,
+                role_id,
+            )
+            documents.append(document)
+        return documents
+
+    @classmethod
+    def _save(
+        cls, document, collection, parent_id, foreign_id, content_hash, meta, role_id
+    ):
         if document is None:
             document = cls()
             document.schema = cls.SCHEMA
             document.collection_id = collection.id
             document.role_id = role_id
 
-        if parent is not None:
-            document.parent_id = parent.id
+        if parent_id is not None:
+            document.parent_id = parent_id
 
         if foreign_id is not None:
             document.foreign_id = foreign_id
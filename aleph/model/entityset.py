@@ -1,4 +1,5 @@
 import logging
+from collections import defaultdict
 from datetime import datetime
 from enum import Enum
 
@@ -147,6 +148,24 @@ class EntitySet(db.Model, SoftDeleteModel):
             q = q.filter(EntitySetItem.collection_id == collection_id)
         return set([id_ for id_, in q.all()])
 
+    @classmethod
+    def entities_entitysets(cls, entity_ids):
+        """Returns a mapping of each of the given entity_ids to the EntitySets
+        it is linked positive to, loaded with a single query."""
+        entitysets = defaultdict(set)
+        entity_ids = list(entity_ids)
+        if not len(entity_ids):
+            return entitysets
+        q = db.session.query(cls.id, EntitySetItem.entity_id)
+        q = q.join(EntitySetItem)
+        q = q.filter(cls.deleted_at == None)  # noqa: E711
+        q = q.filter(EntitySetItem.deleted_at == None)  # noqa: E711
+        q = q.filter(EntitySetItem.entity_id.in_(entity_ids))
+        q = q.filter(EntitySetItem.judgement == Judgement.POSITIVE)
+        for entityset_id, entity_id in q.all():
+            entitysets[entity_id].add(entityset_id)
+        return entitysets
+
     @classmethod
     def all_profiles(cls, collection_id, entity_id=None):
         q = EntitySet.all_ids()
@@ -1,13 +1,15 @@
 from typing import Any, TypedDict
 
 import structlog
+from anystore.util import clean_dict as clean_job
 from banal import clean_dict
 from followthemoney.proxy import EntityProxy
 from openaleph_procrastinate import defer
-from openaleph_procrastinate.app import make_app
+from openaleph_procrastinate.app import make_app, run_sync_worker
 from openaleph_procrastinate.model import DatasetJob
 from openaleph_procrastinate.settings import DeferSettings, OpenAlephSettings
 from openaleph_procrastinate.tasks import Priorities
+from servicelayer.jobs import Job
 
 from aleph.logic.aggregator import get_aggregator_name
 from aleph.model.collection import Collection
@@ -60,6 +62,36 @@ def queue_ingest(collection: Collection, proxy: EntityProxy, **context: Any) ->
         defer.ingest(app, dataset, [proxy], **context)
 
 
+def queue_ingest_many(
+    collection: Collection, proxies: list[EntityProxy], **context: Any
+) -> None:
+    """Defer an ingest job for each of the given entities, all with a single
+    batched insert into the job queue."""
+    if not settings.ingest.defer or not len(proxies):
+        return
+    context = {**context, **get_context(collection)}
+    dataset = get_aggregator_name(collection)
+    jobs = [
+        DatasetJob.from_entities(
+            dataset=dataset,
+            queue=settings.ingest.queue,
+            task=settings.ingest.task,
+            entities=[proxy],
+            **context,
+        )
+        for proxy in proxies
+    ]
+    priority = context.get("priority") or settings.ingest.get_priority()
+    with app.open():
+        task = app.configure_task(
+            name=settings.ingest.task, queue=settings.ingest.queue, priority=priority
+        )
+        task.batch_defer(*(clean_job(job.model_dump(mode="json")) for job in jobs))
+        # like `Job.defer`, work off the queue right away in sync test runs
+        if oa_settings.debug and OpenAlephSettings().procrastinate_sync:
+            run_sync_worker(app)
+
+
 def queue_analyze(
     collection: Collection, entities: list[EntityProxy], **context: Any
 ) -> None:
@@ -121,10 +153,31 @@ def queue_reindex(collection: Collection, **context: Any) -> None:
         defer.reindex(app, dataset, **context)
 
 
-def queue_xref(collection: Collection) -> None:
+def queue_xref(collection: Collection, **context: Any) -> None:
+    # Retries of the job share the run ID, so only they resume its checkpoint
+    context.setdefault("run_id", Job.random_id())
+    dataset = get_aggregator_name(collection)
+    with app.open():
+        defer.xref(app, dataset, **context)
+
+
+def queue_xref_shard(collection: Collection, entity_ids: list[str], shard: str) -> None:
+    payload = {"entity_ids": entity_ids, "shard": shard}
+    dataset = get_aggregator_name(collection)
+    task = "aleph.procrastinate.tasks.xref_shard"
+    queue = settings.xref.queue
+    with app.open():
+        job = DatasetJob(dataset=dataset, payload=payload, queue=queue, task=task)
+        job.defer(app, priority=settings.xref.min_priority)
+
+
+def queue_xref_mentions(collection: Collection) -> None:
     dataset = get_aggregator_name(collection)
+    task = "aleph.procrastinate.tasks.xref_mentions"
+    queue = settings.xref.queue
     with app.open():
-        defer.xref(app, dataset)
+        job = DatasetJob(dataset=dataset, queue=queue, task=task)
+        job.defer(app, priority=settings.xref.min_priority)
 
 
 def queue_export_xref(collection: Collection, export_id: str) -> None:
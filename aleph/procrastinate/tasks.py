@@ -27,6 +27,7 @@ from aleph.logic import (
 from aleph.logic.aggregator import get_aggregator
 from aleph.model.collection import Collection
 from aleph.procrastinate.util import ensure_collection
+from aleph.settings import SETTINGS
 
 app = make_app(__loader__.name)
 aleph_flask_app = create_app()
@@ -84,6 +85,7 @@ def reindex_collection(job: DatasetJob, collection: Collection) -> None:
     queue_batches = job.context.get("queue_batches", True)
     batch_size = job.context.get("batch_size", 10_000)
     schema = job.context.get("schema", None)
+    resume = job.context.get("resume", False)
     collections.reindex_collection(
         collection,
         flush=bool(flush),
@@ -93,13 +95,36 @@ def reindex_collection(job: DatasetJob, collection: Collection) -> None:
         queue_batches=bool(queue_batches),
         batch_size=int(batch_size),
         schema=schema,
+        resume=bool(resume),
     )
     collections.refresh_collection(collection.id)
 
 
 @aleph_task(retry=defer.tasks.xref.max_retries)
 def xref_collection(job: DatasetJob, collection: Collection) -> None:
-    xref.xref_collection(collection)
+    shards = job.context.get("shards", SETTINGS.XREF_SHARDS)
+    incremental = job.context.get("incremental", SETTINGS.XREF_INCREMENTAL)
+    run_id = job.context.get("run_id", None)
+    xref.xref_collection(
+        collection,
+        shards=bool(shards),
+        incremental=bool(incremental),
+        resume=run_id is not None,
+        run_id=run_id,
+    )
+    collections.refresh_collection(collection.id)
+
+
+@aleph_task(retry=defer.tasks.xref.max_retries)
+def xref_shard(job: DatasetJob, collection: Collection) -> None:
+    entity_ids = job.payload.get("entity_ids", [])
+    if entity_ids:
+        xref.xref_shard(collection, entity_ids, job.payload.get("shard"))
+
+
+@aleph_task(retry=defer.tasks.xref.max_retries)
+def xref_mentions(job: DatasetJob, collection: Collection) -> None:
+    xref.xref_mentions(collection)
     collections.refresh_collection(collection.id)
 
 
@@ -178,6 +203,16 @@ def periodic_clean_and_compute(timestamp: int):
         collections.compute_collections()
 
 
+# every 10 minutes
+@app.periodic(cron="*/10 * * * *")
+@app.task(queue=OPENALEPH_MANAGEMENT_QUEUE, queueing_lock="periodic-delta-reindex")
+def periodic_delta_reindex(timestamp: int):
+    if not SETTINGS.INDEX_DELTA_REINDEX:
+        return
+    with aleph_flask_app.app_context():
+        collections.delta_reindex_collections()
+
+
 # every 15 minutes
 @app.periodic(cron="*/15 * * * *")
 @app.task(queue=OPENALEPH_MANAGEMENT_QUEUE, queueing_lock="periodic-retry-stalled")
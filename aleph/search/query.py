@@ -14,7 +14,7 @@ from openaleph_search.query.queries import EXCLUDE_DEHYDRATE, expand_include_fie
 
 from aleph.index.collections import collections_index
 from aleph.index.notifications import notifications_index
-from aleph.index.xref import XREF_SOURCE, xref_index
+from aleph.index.xref import XREF_SOURCE, xref_index, xref_routing
 from aleph.logic.notifications import get_role_channels
 from aleph.logic.xref import SCORE_CUTOFF
 
@@ -138,6 +138,15 @@ class XrefQuery(Query):
     def get_index(self):
         return xref_index()
 
+    def search(self):
+        # Matches are routed by collection, so only its shard is searched.
+        es = get_es()
+        return es.search(
+            index=self.get_index(),
+            body=self.get_body(),
+            routing=xref_routing(self.collection_id),
+        )
+
 
 def _entity_sort_date(entity: dict[str, Any]) -> str:
     """Sort key for chronological ordering of thread entities."""
@@ -193,6 +193,22 @@ class Settings:
         self.SQLALCHEMY_POOL_TIMEOUT = env.to_int("ALEPH_SQLALCHEMY_POOL_TIMEOUT", 30)
         self.XREF_SCROLL = env.get("ALEPH_XREF_SCROLL", "5m")
         self.XREF_SCROLL_SIZE = env.get("ALEPH_XREF_SCROLL_SIZE", "1000")
+        # Number of entities whose xref candidates are fetched per multi-search
+        self.XREF_BATCH_SIZE = env.to_int("ALEPH_XREF_BATCH_SIZE", 100)
+        # Distribute xref runs as shards of entity IDs across the workers
+        self.XREF_SHARDS = env.to_bool("ALEPH_XREF_SHARDS", False)
+        self.XREF_SHARD_SIZE = env.to_int("ALEPH_XREF_SHARD_SIZE", 10_000)
+        # Seconds after which an unfinished sharded xref run is given up
+        self.XREF_SHARDS_EXPIRE = env.to_int("ALEPH_XREF_SHARDS_EXPIRE", 86_400)
+        # Only re-match entities changed since the last xref run by default
+        self.XREF_INCREMENTAL = env.to_bool("ALEPH_XREF_INCREMENTAL", False)
+        # Run xref as a pipeline with this many candidate query threads (0: off)
+        self.XREF_PIPELINE_THREADS = env.to_int("ALEPH_XREF_PIPELINE_THREADS", 0)
+        # Score xref candidates in a pool of processes (0: on the xref thread)
+        self.XREF_PIPELINE_PROCESSES = env.to_int("ALEPH_XREF_PIPELINE_PROCESSES", 0)
+        # Local blocking index used to generate xref candidates (off if unset)
+        self.XREF_BLOCKING_PATH = env.get("ALEPH_XREF_BLOCKING_PATH", None)
+        self.XREF_BLOCKING_MAX_BLOCK = env.to_int("ALEPH_XREF_BLOCKING_MAX_BLOCK", 1000)
 
         # Number of replicas to maintain. '2' means 3 overall copies.
         self.INDEX_REPLICAS = env.to_int("ALEPH_INDEX_REPLICAS", 0)
@@ -205,6 +221,29 @@ class Settings:
         self.INDEX_DELETE_BY_QUERY_BATCHSIZE = env.to_int(
             "ALEPH_INDEX_DELETE_BY_QUERY_BATCHSIZE", 100
         )
+        # Seconds to wait for the sliced deletion of a collection's entities
+        self.INDEX_DELETE_TIMEOUT = env.to_int("ALEPH_INDEX_DELETE_TIMEOUT", 3600)
+        # Don't re-send entities whose indexed document would not change
+        self.INDEX_SKIP_UNCHANGED = env.to_bool("ALEPH_INDEX_SKIP_UNCHANGED", False)
+        # Size bulk indexing requests by bytes, following the index's feedback
+        self.INDEX_BULK_ADAPTIVE = env.to_bool("ALEPH_INDEX_BULK_ADAPTIVE", False)
+        self.INDEX_BULK_MIN_BYTES = env.to_int("ALEPH_INDEX_BULK_MIN_BYTES", 2**19)
+        self.INDEX_BULK_MAX_BYTES = env.to_int("ALEPH_INDEX_BULK_MAX_BYTES", 2**25)
+        self.INDEX_BULK_TARGET_SECONDS = env.to_int(
+            "ALEPH_INDEX_BULK_TARGET_SECONDS", 5
+        )
+        # Periodically index the aggregator changes since each collection's
+        # index watermark
+        self.INDEX_DELTA_REINDEX = env.to_bool("ALEPH_INDEX_DELTA_REINDEX", False)
+        # Seconds between checking the stats of all collections, not just the
+        # ones marked as changed
+        self.COLLECTION_STATS_SWEEP = env.to_int(
+            "ALEPH_COLLECTION_STATS_SWEEP", 24 * 60 * 60
+        )
+        # Number of files the directory crawler saves and queues at once
+        self.CRAWL_BATCH_SIZE = env.to_int("ALEPH_CRAWL_BATCH_SIZE", 1000)
+        # Threads archiving (and hashing) files while the crawler saves them
+        self.CRAWL_HASH_WORKERS = env.to_int("ALEPH_CRAWL_HASH_WORKERS", 4)
 
         ###############################################################################
         # XREF Model Selection
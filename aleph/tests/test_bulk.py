@@ -0,0 +1,48 @@
+import orjson
+
+from aleph.index.bulk import BulkItem, BulkSizer, _chunks
+from aleph.tests.util import TestCase
+
+
+class BulkTestCase(TestCase):
+    def test_sizer(self):
+        sizer = BulkSizer(1000, 10_000, target_seconds=5)
+        assert sizer.size == 10_000, sizer.size
+        sizer.rejected()
+        assert sizer.size == 5000, sizer.size
+        sizer.accepted(1)
+        assert sizer.size == 6000, sizer.size
+        sizer.accepted(10)
+        assert sizer.size == 4500, sizer.size
+        for _ in range(10):
+            sizer.rejected()
+        assert sizer.size == 1000, sizer.size
+
+    def test_chunks(self):
+        sizer = BulkSizer(1000, 1000, target_seconds=5)
+        actions = [
+            {"_index": "test", "_id": str(i), "_source": {"text": "x" * 300}}
+            for i in range(10)
+        ]
+        chunks = list(_chunks(actions, sizer))
+        assert len(chunks) == 5, chunks
+        assert sum(len(c) for c in chunks) == 10
+        for chunk in chunks:
+            assert sum(item.size for item in chunk) <= 1000
+
+    def test_item_metadata(self):
+        action = {
+            "_index": "test",
+            "_id": "a",
+            "_routing": "1",
+            "_source": {"text": "x"},
+        }
+        item = BulkItem(action)
+        meta = orjson.loads(item.lines[0])
+        assert meta == {"index": {"_index": "test", "_id": "a", "routing": "1"}}
+        assert orjson.loads(item.lines[1]) == {"text": "x"}
+        assert not item.is_delete
+
+        item = BulkItem({"_op_type": "delete", "_index": "test", "_id": "a"})
+        assert item.is_delete
+        assert len(item.lines) == 1
@@ -1,5 +1,16 @@
-from aleph.index.collections import delete_entities
-from aleph.logic.collections import delete_collection, reindex_collection
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from aleph.index.collections import _wait_for_task, count_entities, delete_entities
+from aleph.logic.aggregator import get_aggregator
+from aleph.logic.collections import (
+    aggregate_model,
+    delete_collection,
+    reindex_collection,
+)
+from aleph.model import Collection
+from aleph.settings import SETTINGS
 from aleph.tests.util import TestCase
 
 
@@ -13,6 +24,16 @@ class IndexTestCase(TestCase):
         res = self.client.get(url)
         assert res.json["total"] == 0, res.json
 
+    def test_flush_collection(self):
+        self.load_fixtures()
+        aggregator = get_aggregator(self.private_coll)
+        aggregate_model(self.private_coll, aggregator)
+        assert len(aggregator) > 0
+        delete_collection(self.private_coll, keep_metadata=True, sync=True)
+        assert len(aggregator) == 0
+        assert count_entities(self.private_coll.id) == 0
+        assert Collection.by_id(self.private_coll.id) is not None
+
     def test_collection_taggable_default(self):
         role, _ = self.login()
         collection = self.create_collection(role, label="Test Collection")
@@ -56,3 +77,16 @@ class IndexTestCase(TestCase):
             headers=headers,
         )
         assert res.json["total"] == 22, res.json
+
+    def test_wait_for_task_deadline(self):
+        es = MagicMock()
+        es.tasks.get.return_value = {"completed": False, "task": {}}
+        timeout = SETTINGS.INDEX_DELETE_TIMEOUT
+        SETTINGS.INDEX_DELETE_TIMEOUT = 0
+        try:
+            with patch("aleph.index.collections.es", es):
+                with pytest.raises(TimeoutError):
+                    _wait_for_task("node:1")
+        finally:
+            SETTINGS.INDEX_DELETE_TIMEOUT = timeout
+        es.tasks.get.assert_called_once_with(task_id="node:1")
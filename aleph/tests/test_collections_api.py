@@ -1,12 +1,42 @@
 import json
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from unittest.mock import patch
 
 import pytest
+from followthemoney import model
 from followthemoney.exc import InvalidData
 
 from aleph.authz import Authz
-from aleph.core import db
+from aleph.core import cache, db, es
+from aleph.index.admin import entities_version_index
+from aleph.index.collections import (
+    count_entities,
+    get_collection_stats,
+    get_collections,
+    get_content_hashes,
+    indexed_entity_ids,
+    update_collections_stats,
+)
 from aleph.logic.aggregator import get_aggregator
-from aleph.logic.collections import compute_collection, update_collection
+from aleph.logic.collections import (
+    _compute_collections,
+    _dirty_key,
+    aggregate_model,
+    compute_collection,
+    compute_collections,
+    delta_reindex_collection,
+    get_index_watermark,
+    get_reindex_checkpoint,
+    index_aggregator,
+    index_checksum_diff,
+    rebuild_index,
+    refresh_collection,
+    reindex_collection,
+    update_collection,
+)
 from aleph.model import EntitySet
 from aleph.model.role import Role
 from aleph.settings import SETTINGS
@@ -16,6 +46,21 @@ from aleph.views.util import validate
 # import os
 
 
+@contextmanager
+def _timezone(name):
+    previous = os.environ.get("TZ")
+    os.environ["TZ"] = name
+    time.tzset()
+    try:
+        yield
+    finally:
+        if previous is None:
+            os.environ.pop("TZ", None)
+        else:
+            os.environ["TZ"] = previous
+        time.tzset()
+
+
 class CollectionsApiTestCase(TestCase):
     def setUp(self):
         super(CollectionsApiTestCase, self).setUp()
@@ -528,3 +573,247 @@ class CollectionsApiTestCase(TestCase):
         assert not role.is_admin
         res = self.client.post(url, json=data, headers=headers)
         assert res.status_code == 200
+
+    def test_aggregate_model(self):
+        aggregator = get_aggregator(self.col)
+        stale = model.make_entity("Person")
+        stale.id = self.ent.id
+        stale.add("name", "Stale Pooh")
+        aggregator.put(stale, fragment="stale", origin="stale")
+
+        aggregate_model(self.col, aggregator)
+        proxies = list(aggregator.iterate(entity_id=self.ent.id))
+        assert len(proxies) == 1, proxies
+        assert proxies[0].get("name") == ["Winnie the Pooh"], proxies[0]
+
+    def test_index_checksum_diff(self):
+        # A consistent collection is compared without fetching any IDs
+        with patch(
+            "aleph.logic.collections.get_sorted_id_batches_after"
+        ) as get_batches:
+            diff = index_checksum_diff(self.col)
+        get_batches.assert_not_called()
+        assert diff.aggregator == diff.index, diff
+        assert not diff.only_in_aggregator, diff
+        assert not diff.only_in_index, diff
+
+        aggregator = get_aggregator(self.col)
+        missing = model.make_entity("Person")
+        missing.make_id("missing")
+        missing.add("name", "Piglet")
+        aggregator.put(missing)
+        diff = index_checksum_diff(self.col)
+        assert diff.only_in_aggregator == [missing.id], diff
+        assert not diff.only_in_index, diff
+        assert not diff.stale, diff
+
+        # An entity changed after it was indexed is found as well
+        changed = model.make_entity("Person")
+        changed.id = self.ent.id
+        changed.add("name", "Pooh Bear")
+        aggregator.put(changed, fragment="changed")
+        index_aggregator(self.col, aggregator, entity_ids=[self.ent.id], sync=True)
+        diff = index_checksum_diff(self.col)
+        assert not diff.stale, diff
+        changed.add("name", "Winnie")
+        aggregator.put(changed, fragment="changed")
+        diff = index_checksum_diff(self.col)
+        assert diff.stale == [self.ent.id], diff
+
+    def test_index_diff_timezone(self):
+        # The index time is written in local time, fragments in UTC
+        aggregator = get_aggregator(self.col)
+        for tz in ("America/New_York", "Asia/Tokyo"):
+            with _timezone(tz):
+                index_aggregator(
+                    self.col, aggregator, entity_ids=[self.ent.id], sync=True
+                )
+                indexed = indexed_entity_ids(self.col.id, [self.ent.id])
+                delta = abs(indexed[self.ent.id] - datetime.utcnow())
+                assert delta < timedelta(minutes=1), (tz, indexed)
+                diff = index_checksum_diff(self.col)
+                assert not diff.stale, (tz, diff)
+
+                changed = model.make_entity("Person")
+                changed.id = self.ent.id
+                changed.add("name", tz)
+                aggregator.put(changed, fragment=tz)
+                diff = index_checksum_diff(self.col)
+                assert diff.stale == [self.ent.id], (tz, diff)
+
+    def test_index_skip_unchanged(self):
+        aggregator = get_aggregator(self.col)
+        index_aggregator(self.col, aggregator, sync=True)
+        hashes = get_content_hashes(self.col.id, [self.ent.id])
+        assert self.ent.id in hashes, hashes
+
+        def _index_bulk(dataset, entities, **kwargs):
+            indexed.extend(entities)
+
+        indexed = []
+        with patch("aleph.logic.collections.bulk.index_bulk", _index_bulk):
+            index_aggregator(self.col, aggregator, sync=True, skip_unchanged=True)
+        assert not len(indexed), indexed
+
+        with patch("aleph.logic.collections.bulk.index_bulk", _index_bulk):
+            index_aggregator(self.col, aggregator, sync=True)
+        assert self.ent.id in [proxy.id for proxy in indexed], indexed
+
+        # A rollover to another index version has nothing to skip
+        assert get_content_hashes(self.col.id, [self.ent.id], version="next") == {}
+        indexed = []
+        with patch("aleph.logic.collections.bulk.index_bulk", _index_bulk):
+            index_aggregator(
+                self.col, aggregator, sync=True, skip_unchanged=True, version="next"
+            )
+        assert self.ent.id in [proxy.id for proxy in indexed], indexed
+
+    def test_index_skip_unchanged_touch(self):
+        aggregator = get_aggregator(self.col)
+        index_aggregator(self.col, aggregator, sync=True)
+        # A fragment written again without changing the entity
+        aggregator.put(aggregator.get(self.ent.id), fragment="again")
+        diff = index_checksum_diff(self.col)
+        assert diff.stale == [self.ent.id], diff
+
+        def _index_bulk(dataset, entities, **kwargs):
+            indexed.extend(entities)
+
+        indexed = []
+        with patch("aleph.logic.collections.bulk.index_bulk", _index_bulk):
+            index_aggregator(self.col, aggregator, sync=True, skip_unchanged=True)
+        assert not len(indexed), indexed
+        diff = index_checksum_diff(self.col)
+        assert not diff.stale, diff
+
+    def test_reindex_resume(self):
+        options = {"schema": None, "since": None, "until": None, "origin": None}
+        checkpoint = {
+            "options": options,
+            "since": None,
+            "until": None,
+            "cursor": self.ent.id,
+            "entities": 1,
+            "started": datetime.utcnow().isoformat(),
+        }
+        key = cache.object_key(type(self.col), self.col.id, "reindex_checkpoint")
+        cache.set_complex(key, checkpoint)
+
+        def _index_bulk(dataset, entities, **kwargs):
+            indexed.extend(entities)
+
+        indexed = []
+        with patch("aleph.logic.collections.bulk.index_bulk", _index_bulk):
+            reindex_collection(self.col, resume=True, sync=True)
+        assert self.ent.id not in [proxy.id for proxy in indexed], indexed
+        assert get_reindex_checkpoint(self.col) is None
+
+        cache.set_complex(key, checkpoint)
+        reindex_collection(self.col, sync=True)
+        assert get_reindex_checkpoint(self.col) is None
+
+        # Queued batches are not checkpointed before they are indexed
+        def _queue_index_batch(collection, entity_ids):
+            queued.append(get_reindex_checkpoint(collection))
+
+        queued = []
+        with patch("aleph.logic.collections.queue_index_batch", _queue_index_batch):
+            reindex_collection(self.col, queue_batches=True)
+        assert queued == [None], queued
+
+    def test_compute_collections_dirty(self):
+        compute_collections(full=True)
+        key = cache.object_key(type(self.col), self.col.id, "stats")
+        assert cache.get(key) is not None
+        assert not cache.kv.smembers(_dirty_key())
+
+        refresh_collection(self.col.id)
+        assert cache.get(key) is None
+        assert str(self.col.id) in cache.kv.smembers(_dirty_key())
+        compute_collections()
+        assert cache.get(key) is not None
+        assert not cache.kv.smembers(_dirty_key())
+
+        # A collection changed while the stats are computed stays dirty
+        def _compute(collections):
+            compute(collections)
+            refresh_collection(self.col.id)
+
+        compute = _compute_collections
+        refresh_collection(self.col.id)
+        with patch("aleph.logic.collections._compute_collections", _compute):
+            compute_collections()
+        assert cache.get(key) is None
+        assert str(self.col.id) in cache.kv.smembers(_dirty_key())
+        compute_collections()
+        assert cache.get(key) is not None
+        assert not cache.kv.smembers(_dirty_key())
+
+    def test_update_collections_stats(self):
+        other = self.create_collection(foreign_id="test_coll_stats_other")
+        update_collections_stats([self.col.id, other.id])
+        stats = get_collection_stats(self.col.id)
+        assert stats["schema"]["values"] == {"Person": 1}, stats
+        assert stats["countries"]["values"] == {"za": 1}, stats
+        stats = get_collection_stats(other.id)
+        assert stats["schema"]["total"] == 0, stats
+
+    def test_get_collections(self):
+        other = self.create_collection(foreign_id="test_coll_count_other")
+        cache.flush()
+        collections = get_collections([self.col.id, other.id, 999999])
+        assert 999999 not in collections, collections
+        assert collections[self.col.id]["count"] == 1, collections
+        assert collections[other.id]["count"] == 0, collections
+        key = cache.object_key(type(self.col), self.col.id)
+        assert cache.get_complex(key)["count"] == 1
+
+    def test_delta_reindex(self):
+        assert get_index_watermark(self.col) is None
+        delta_reindex_collection(self.col)
+        watermark = get_index_watermark(self.col)
+        assert watermark is not None
+
+        aggregator = get_aggregator(self.col)
+        added = model.make_entity("Person")
+        added.make_id("delta")
+        added.add("name", "Eeyore")
+        aggregator.put(added)
+        assert not indexed_entity_ids(self.col.id, [added.id])
+        delta_reindex_collection(self.col)
+        assert set(indexed_entity_ids(self.col.id, [added.id])) == {added.id}
+        assert get_index_watermark(self.col) > watermark
+
+        # Changes already indexed by the regular tasks are left out
+        def _index_bulk(dataset, entities, **kwargs):
+            indexed.extend(entities)
+
+        added.add("name", "Eeyore the Donkey")
+        aggregator.put(added)
+        index_aggregator(self.col, aggregator, entity_ids=[added.id], sync=True)
+        indexed = []
+        with patch("aleph.logic.collections.bulk.index_bulk", _index_bulk):
+            delta_reindex_collection(self.col)
+        assert not len(indexed), indexed
+
+        # Indexing the whole collection moves the watermark up as well
+        watermark = get_index_watermark(self.col)
+        index_aggregator(self.col, aggregator, sync=True)
+        assert get_index_watermark(self.col) > watermark
+
+    def test_rebuild_index(self):
+        aggregate_model(self.col, get_aggregator(self.col))
+        try:
+            mismatches = rebuild_index("rebuilt", "swapped")
+            assert mismatches == [], mismatches
+            assert (
+                count_entities(self.col.id, index=entities_version_index("swapped"))
+                == 1
+            )
+            assert get_index_watermark(self.col) is not None
+            with pytest.raises(ValueError):
+                rebuild_index("swapped", "rebuilt")
+        finally:
+            es.indices.delete(
+                index=entities_version_index("rebuilt"), ignore_unavailable=True
+            )
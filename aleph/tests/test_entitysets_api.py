@@ -4,6 +4,7 @@ from pprint import pprint  # noqa
 from unittest import skip  # noqa
 
 from aleph.logic.collections import delete_collection
+from aleph.model import EntitySet
 from aleph.tests.util import TestCase
 from aleph.views.util import validate
 
@@ -177,6 +178,11 @@ class EntitySetAPITest(TestCase):
         res = self.client.get(url, headers=self.headers)
         assert entityset_id in {e["id"] for e in res.json["results"]}, res.json
 
+        memberships = EntitySet.entities_entitysets([ent_id, "unknown"])
+        assert memberships[ent_id] == EntitySet.entity_entitysets(ent_id)
+        assert entityset_id in memberships[ent_id], memberships
+        assert "unknown" not in memberships, memberships
+
         url = f"/api/2/entities/{ent_id}/entitysets?filter:collection_id={colid}&filter:type=diagram&filter:judgement=positive"  # noqa: E501
         res = self.client.get(url, headers=self.headers)
         assert entityset_id in {e["id"] for e in res.json["results"]}, res.json
@@ -1,7 +1,11 @@
 # from datetime import datetime, timedelta
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
 
 from aleph.model import Document
 from aleph.logic.documents import crawl_directory
+from aleph.settings import SETTINGS
 from aleph.tests.util import TestCase
 
 
@@ -14,3 +18,19 @@ class IngestTestCase(TestCase):
         samples_path = self.get_fixture_path("samples")
         crawl_directory(self.collection, samples_path)
         assert Document.all().count() == 4, Document.all().count()
+
+    def test_crawl_batches(self):
+        with TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            (root / "sub").mkdir()
+            (root / "sub" / "a.txt").write_text("a")
+            (root / "sub" / "b.txt").write_text("b")
+            (root / "c.txt").write_text("c")
+            with patch.object(SETTINGS, "CRAWL_BATCH_SIZE", 1):
+                crawl_directory(self.collection, root)
+                crawl_directory(self.collection, root)
+        assert Document.all().count() == 4, Document.all().count()
+        folder = Document.all().filter(Document.foreign_id == "sub").one()
+        assert folder.schema == Document.SCHEMA_FOLDER
+        doc = Document.all().filter(Document.foreign_id == "sub/a.txt").one()
+        assert doc.parent_id == folder.id
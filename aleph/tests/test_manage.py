@@ -1,4 +1,7 @@
+import json
 import os
+from tempfile import TemporaryDirectory
+
 from click.testing import CliRunner
 
 from aleph.tests.util import TestCase
@@ -59,6 +62,23 @@ class ManageTestCase(TestCase):
         assert foreign_id not in result.output
         assert label not in result.output
 
+    def test_index_diff_all_manifest(self):
+        self.create_collection(foreign_id="test_coll_diff", creator=self.admin)
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "manifest.jsonl")
+            result = self.runner.invoke(manage.index_diff_all, ["--manifest", path])
+            assert result.exit_code == 0, result.output
+            with open(path) as fh:
+                records = [json.loads(line) for line in fh]
+            foreign_ids = [r["foreign_id"] for r in records]
+            assert "test_coll_diff" in foreign_ids, foreign_ids
+            for record in records:
+                assert "error" not in record, record
+                assert record["only_in_aggregator"] == [], record
+
+            result = self.runner.invoke(manage.index_diff_repair, [path])
+            assert result.exit_code == 0, result.output
+
     def test_createuser(self):
         email = "test@example.com"
 
@@ -1,10 +1,41 @@
 import json
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from tempfile import TemporaryDirectory
 from unittest import skip  # noqa
+from unittest.mock import patch
+
+from followthemoney import model
+from followthemoney.types import registry
+from nomenklatura.matching import RegressionV1
+from openaleph_procrastinate import defer
+from openaleph_search.index.util import index_name
 
 from aleph.authz import Authz
-from aleph.core import db
-from aleph.index.xref import iter_matches
-from aleph.logic.xref import xref_collection
+from aleph.core import cache, db, es
+from aleph.index.admin import delete_legacy_xref
+from aleph.index.xref import delete_xref, index_matches, iter_matches
+from aleph.logic.aggregator import get_aggregator
+from aleph.logic.blocking import (
+    build_blocking_index,
+    get_blocking_index,
+    get_warm_blocking_index,
+    update_blocking_collection,
+)
+from aleph.logic.xref import (
+    Match,
+    _clear_feature_cache,
+    _encode_pair,
+    _feature_entity,
+    _name_tokens,
+    get_xref_checkpoint,
+    get_xref_watermark,
+    xref_collection,
+    xref_mentions,
+    xref_shard,
+)
+from aleph.model import Collection
+from aleph.settings import SETTINGS
 from aleph.tests.util import JSON, TestCase
 
 
@@ -101,3 +132,365 @@ class XrefTestCase(TestCase):
             if match.get("id") == self.entity5.get_json().get("id"):
                 assert match.get("match_collection_id") == self.coll_c.id, match
                 assert match.get("collection_id") == self.coll_a.id, match
+
+    def test_xref_small_batches(self):
+        batch_size = SETTINGS.XREF_BATCH_SIZE
+        SETTINGS.XREF_BATCH_SIZE = 1
+        try:
+            xref_collection(self.coll_b)
+        finally:
+            SETTINGS.XREF_BATCH_SIZE = batch_size
+        matches = list(iter_matches(self.coll_b, self.authz))
+        entity_ids = set([match.get("entity_id") for match in matches])
+        assert entity_ids == {
+            self.entity2.get_json().get("id"),
+            self.entity3.get_json().get("id"),
+        }, entity_ids
+        match_ids = set([match.get("match_id") for match in matches])
+        assert self.entity1.get_json().get("id") in match_ids, match_ids
+        assert self.entity5.get_json().get("id") in match_ids, match_ids
+
+    def test_xref_symmetric_pairs(self):
+        xref_collection(self.coll_b)
+        matches = list(iter_matches(self.coll_b, self.authz))
+        pair = {self.entity2.get_json().get("id"), self.entity3.get_json().get("id")}
+        internal = [
+            m for m in matches if {m.get("entity_id"), m.get("match_id")} == pair
+        ]
+        # Both entities of coll_b match each other, but the pair is stored once
+        assert 1 == len(internal), internal
+
+    def test_xref_symmetric_scores(self):
+        entity2 = model.make_entity("Person")
+        entity2.id = self.entity2.get_json().get("id")
+        entity3 = model.make_entity("LegalEntity")
+        entity3.id = self.entity3.get_json().get("id")
+
+        def _match(entity, match, score):
+            return Match(
+                score=score,
+                method="test",
+                entity=entity,
+                collection_id=self.coll_b.id,
+                match=match,
+                entityset_ids=[],
+            )
+
+        # The lower scored direction does not replace the stored match
+        index_matches(self.coll_b, [_match(entity2, entity3, 0.9)], sync=True)
+        index_matches(self.coll_b, [_match(entity3, entity2, 0.6)], sync=True)
+        matches = list(iter_matches(self.coll_b, self.authz))
+        assert 1 == len(matches), matches
+        assert 0.9 == matches[0].get("score"), matches
+        assert entity2.id == matches[0].get("entity_id"), matches
+
+        index_matches(self.coll_b, [_match(entity3, entity2, 0.95)], sync=True)
+        matches = list(iter_matches(self.coll_b, self.authz))
+        assert 1 == len(matches), matches
+        assert 0.95 == matches[0].get("score"), matches
+        assert entity3.id == matches[0].get("entity_id"), matches
+        assert "Person" == matches[0].get("schema"), matches
+
+    def test_delete_legacy_xref(self):
+        legacy = index_name("xref", "v1")
+        es.indices.create(index=legacy)
+        delete_legacy_xref()
+        assert es.indices.exists(index=legacy)
+        delete_legacy_xref(destructive=True)
+        assert not es.indices.exists(index=legacy)
+
+    def test_feature_cache(self):
+        proxy = model.make_entity("Person")
+        proxy.id = "feature"
+        proxy.add("name", "Elim Garak")
+        proxy.add("nationality", "de")
+        entity = _feature_entity(proxy)
+        assert entity.get("name") == proxy.get("name")
+        assert entity.get_type_values(registry.name) == ["Elim Garak"]
+        assert entity.countries == proxy.countries
+        assert _feature_entity(proxy) is entity
+        _clear_feature_cache()
+        assert _feature_entity(proxy) is not entity
+
+    def test_feature_cache_encoding(self):
+        left = model.make_entity("Person")
+        left.id = "left"
+        left.add("name", ["Elim Garak", "Garak 2nd"])
+        left.add("firstName", "Elim")
+        left.add("lastName", "Garak")
+        left.add("birthPlace", "Cardassia Prime")
+        left.add("address", "12 Tailor Street, Deep Space 9")
+        right = model.make_entity("Person")
+        right.id = "right"
+        right.add("name", ["Elim Garrak", "Garak 3rd"])
+        right.add("lastName", "Garak")
+        right.add("birthPlace", "Cardassia")
+        right.add("address", "12 Tailor Str, Deep Space 9, 13")
+        # The cached features encode a pair just like nomenklatura
+        entity, candidate = _feature_entity(left), _feature_entity(right)
+        expected = RegressionV1.encode_pair(left, right)
+        assert _encode_pair(RegressionV1, entity, candidate) == expected
+        assert _encode_pair(RegressionV1, candidate, entity) == (
+            RegressionV1.encode_pair(right, left)
+        )
+        # ... and are computed from the entity values only once
+        tokens = entity.feature(_name_tokens)
+        assert len(tokens), tokens
+        assert entity.feature(_name_tokens) is tokens
+
+    def test_xref_pipeline(self):
+        threads = SETTINGS.XREF_PIPELINE_THREADS
+        SETTINGS.XREF_PIPELINE_THREADS = 2
+        try:
+            xref_collection(self.coll_a)
+        finally:
+            SETTINGS.XREF_PIPELINE_THREADS = threads
+        matches = list(iter_matches(self.coll_a, self.authz))
+        assert 3 == len(matches), len(matches)
+
+    def test_xref_pipeline_processes(self):
+        threads = SETTINGS.XREF_PIPELINE_THREADS
+        processes = SETTINGS.XREF_PIPELINE_PROCESSES
+        SETTINGS.XREF_PIPELINE_THREADS = 2
+        SETTINGS.XREF_PIPELINE_PROCESSES = 2
+        try:
+            xref_collection(self.coll_a)
+        finally:
+            SETTINGS.XREF_PIPELINE_THREADS = threads
+            SETTINGS.XREF_PIPELINE_PROCESSES = processes
+        matches = list(iter_matches(self.coll_a, self.authz))
+        assert 3 == len(matches), len(matches)
+
+    def test_xref_pipeline_pool(self):
+        # The scoring processes are started once for all batches of a run
+        pools = []
+
+        def _pool(*args, **kwargs):
+            pools.append(ProcessPoolExecutor(*args, **kwargs))
+            return pools[-1]
+
+        threads = SETTINGS.XREF_PIPELINE_THREADS
+        processes = SETTINGS.XREF_PIPELINE_PROCESSES
+        shard_size = SETTINGS.XREF_SHARD_SIZE
+        SETTINGS.XREF_PIPELINE_THREADS = 2
+        SETTINGS.XREF_PIPELINE_PROCESSES = 2
+        SETTINGS.XREF_SHARD_SIZE = 1
+        try:
+            with patch("aleph.logic.xref.ProcessPoolExecutor", _pool):
+                xref_collection(self.coll_a)
+        finally:
+            SETTINGS.XREF_PIPELINE_THREADS = threads
+            SETTINGS.XREF_PIPELINE_PROCESSES = processes
+            SETTINGS.XREF_SHARD_SIZE = shard_size
+        assert 1 == len(pools), pools
+        matches = list(iter_matches(self.coll_a, self.authz))
+        assert 3 == len(matches), len(matches)
+
+    def test_xref_blocking(self):
+        blocking_path = SETTINGS.XREF_BLOCKING_PATH
+        with TemporaryDirectory() as tmp:
+            SETTINGS.XREF_BLOCKING_PATH = str(Path(tmp) / "blocking.db")
+            try:
+                assert get_warm_blocking_index() is None
+                build_blocking_index()
+                blocking = get_warm_blocking_index()
+                assert blocking is not None
+                xref_collection(self.coll_a)
+            finally:
+                SETTINGS.XREF_BLOCKING_PATH = blocking_path
+        matches = list(iter_matches(self.coll_a, self.authz))
+        match_ids = set([match.get("match_id") for match in matches])
+        assert match_ids == {
+            self.entity2.get_json().get("id"),
+            self.entity3.get_json().get("id"),
+            self.entity5.get_json().get("id"),
+        }, match_ids
+
+    def test_xref_blocking_collections(self):
+        blocking_path = SETTINGS.XREF_BLOCKING_PATH
+        with TemporaryDirectory() as tmp:
+            SETTINGS.XREF_BLOCKING_PATH = str(Path(tmp) / "blocking.db")
+            try:
+                build_blocking_index()
+                assert get_warm_blocking_index() is not None
+
+                # A collection that has not been built is not covered
+                coll_d = self.create_collection(creator=self.user)
+                db.session.commit()
+                assert get_warm_blocking_index() is None
+                blocking = get_blocking_index()
+                update_blocking_collection(blocking, coll_d)
+                assert get_warm_blocking_index() is not None
+
+                proxy = model.make_entity("Person")
+                proxy.id = "probe"
+                proxy.add("name", "Carlos Danger")
+                entity2_id = self.entity2.get_json().get("id")
+                assert entity2_id in blocking.candidates(proxy, ["Person"])
+                blocking.delete_entities([entity2_id])
+                assert entity2_id not in blocking.candidates(proxy, ["Person"])
+
+                blocking.delete_collection(self.coll_c.id)
+                assert get_warm_blocking_index() is None
+            finally:
+                SETTINGS.XREF_BLOCKING_PATH = blocking_path
+
+    def test_xref_blocking_edit(self):
+        blocking_path = SETTINGS.XREF_BLOCKING_PATH
+        with TemporaryDirectory() as tmp:
+            SETTINGS.XREF_BLOCKING_PATH = str(Path(tmp) / "blocking.db")
+            try:
+                build_blocking_index()
+                assert get_warm_blocking_index() is not None
+                # Renamed after the blocking index was built
+                _, headers = self.login(foreign_id=self.user.foreign_id)
+                entity4_id = self.entity4.get_json().get("id")
+                data = {
+                    "schema": "Person",
+                    "properties": {"name": "Carlos Danger", "nationality": "US"},
+                }
+                res = self.client.post(
+                    f"/api/2/entities/{entity4_id}",
+                    data=json.dumps(data),
+                    headers=headers,
+                    content_type=JSON,
+                )
+                assert res.status_code == 200, res.json
+                xref_collection(self.coll_a)
+            finally:
+                SETTINGS.XREF_BLOCKING_PATH = blocking_path
+        matches = list(iter_matches(self.coll_a, self.authz))
+        match_ids = set([match.get("match_id") for match in matches])
+        assert entity4_id in match_ids, match_ids
+
+    def test_xref_resume(self):
+        xref_collection(self.coll_a)
+        assert get_xref_checkpoint(self.coll_a) is None
+        matches = list(iter_matches(self.coll_a, self.authz))
+        assert 3 == len(matches), len(matches)
+
+        # Pretend a run was interrupted after its only batch: resuming it must
+        # skip that batch rather than clearing and re-matching everything.
+        delete_xref(self.coll_a, sync=True)
+        entity_ids = list(get_aggregator(self.coll_a).get_sorted_ids())
+        checkpoint = {
+            "run_id": "interrupted",
+            "incremental": False,
+            "since": None,
+            "batches": 1,
+            "entities": len(entity_ids),
+            "cursor": entity_ids[-1],
+        }
+        key = cache.object_key(Collection, self.coll_a.id, "xref_checkpoint")
+        cache.set_complex(key, checkpoint)
+        xref_collection(self.coll_a, resume=True, run_id="interrupted")
+        assert get_xref_checkpoint(self.coll_a) is None
+        matches = list(iter_matches(self.coll_a, self.authz))
+        assert 0 == len(matches), len(matches)
+
+        # Another run, or one that is not resumed, starts over
+        cache.set_complex(key, checkpoint)
+        xref_collection(self.coll_a, resume=True, run_id="another")
+        matches = list(iter_matches(self.coll_a, self.authz))
+        assert 3 == len(matches), len(matches)
+
+        delete_xref(self.coll_a, sync=True)
+        cache.set_complex(key, checkpoint)
+        xref_collection(self.coll_a)
+        matches = list(iter_matches(self.coll_a, self.authz))
+        assert 3 == len(matches), len(matches)
+
+    def test_xref_incremental(self):
+        assert get_xref_watermark(self.coll_a) is None
+        xref_collection(self.coll_a, incremental=True)
+        assert get_xref_watermark(self.coll_a) is not None
+        matches = list(iter_matches(self.coll_a, self.authz))
+        assert 3 == len(matches), len(matches)
+
+        _, headers = self.login(foreign_id=self.user.foreign_id)
+        entity = {
+            "schema": "Person",
+            "collection_id": str(self.coll_a.id),
+            "properties": {"name": "Pure Risk", "nationality": "US"},
+        }
+        res = self.client.post(
+            "/api/2/entities",
+            data=json.dumps(entity),
+            headers=headers,
+            content_type=JSON,
+        )
+        xref_collection(self.coll_a, incremental=True)
+        matches = list(iter_matches(self.coll_a, self.authz))
+        match_ids = set([match.get("match_id") for match in matches])
+        assert self.entity4.get_json().get("id") in match_ids, match_ids
+        assert self.entity2.get_json().get("id") in match_ids, match_ids
+        entity_ids = set([match.get("entity_id") for match in matches])
+        assert res.get_json().get("id") in entity_ids, entity_ids
+
+    def test_xref_shards(self):
+        shards, reducers = [], []
+
+        def _queue_shard(collection, entity_ids, shard):
+            shards.append((entity_ids, shard))
+
+        def _queue_mentions(collection):
+            reducers.append(collection.id)
+
+        shard_size = SETTINGS.XREF_SHARD_SIZE
+        SETTINGS.XREF_SHARD_SIZE = 1
+        try:
+            with patch.multiple(
+                "aleph.logic.xref",
+                queue_xref_shard=_queue_shard,
+                queue_xref_mentions=_queue_mentions,
+            ):
+                xref_collection(self.coll_a, shards=True, run_id="run")
+                assert len(shards) > 1, shards
+                # Another sharded run is refused while this one is in flight
+                xref_collection(self.coll_a, shards=True, run_id="other")
+                assert len(set(shard for _, shard in shards)) == len(shards)
+                for entity_ids, shard in shards:
+                    assert not reducers, reducers
+                    xref_shard(self.coll_a, entity_ids, shard)
+                assert reducers == [self.coll_a.id], reducers
+                # A shard done twice does not trigger the reducer again
+                xref_shard(self.coll_a, *shards[0])
+                assert reducers == [self.coll_a.id], reducers
+                xref_mentions(self.coll_a)
+                assert get_xref_watermark(self.coll_a) is not None
+                # The reducer released the collection for the next run
+                shards.clear()
+                xref_collection(self.coll_a, shards=True, run_id="other")
+                assert len(shards), shards
+        finally:
+            SETTINGS.XREF_SHARD_SIZE = shard_size
+
+    def test_xref_shards_failed(self):
+        shards, reducers = [], []
+
+        def _queue_shard(collection, entity_ids, shard):
+            shards.append((entity_ids, shard))
+
+        def _queue_mentions(collection):
+            reducers.append(collection.id)
+
+        def _index_entities(*args, **kwargs):
+            raise RuntimeError("Shard failed")
+
+        with patch.multiple(
+            "aleph.logic.xref",
+            queue_xref_shard=_queue_shard,
+            queue_xref_mentions=_queue_mentions,
+        ):
+            xref_collection(self.coll_a, shards=True, run_id="run")
+            assert 1 == len(shards), shards
+            retries = max(0, defer.tasks.xref.max_retries)
+            with patch("aleph.logic.xref._index_entities", _index_entities):
+                for _ in range(retries + 1):
+                    assert not reducers, reducers
+                    with self.assertRaises(RuntimeError):
+                        xref_shard(self.coll_a, *shards[0])
+            # The shard is given up after its last retry
+            assert reducers == [self.coll_a.id], reducers
+            xref_mentions(self.coll_a)
+            assert get_xref_watermark(self.coll_a) is None
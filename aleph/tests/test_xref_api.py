@@ -1,6 +1,14 @@
-from aleph.core import db
+import csv
+
+import pyarrow.parquet as pq
+from rigour.mime.types import CSV
+
+from aleph.core import archive, db
 from aleph.index.util import index_entity
 from aleph.logic import xref
+from aleph.logic.export import create_export
+from aleph.model import Export
+from aleph.procrastinate.queues import OP_EXPORT_XREF
 from aleph.tests.util import TestCase, get_caption
 
 
@@ -76,6 +84,48 @@ class XrefApiTestCase(TestCase):
         res = self.client.post(url, headers=headers)
         assert res.status_code == 202, res
 
+    def test_export_csv(self):
+        xref.xref_collection(self.residents)
+        url = "/api/2/collections/%s/xref.csv" % self.obsidian.id
+        _, headers = self.login(foreign_id="creator")
+        res = self.client.post(url, headers=headers)
+        assert res.status_code == 202, res
+        res = self.client.get("/api/2/exports", headers=headers)
+        mime_types = [e["mime_type"] for e in res.json["results"]]
+        assert CSV in mime_types, mime_types
+
+    def _export_file(self, mime_type):
+        xref.xref_collection(self.residents)
+        export = create_export(
+            operation=OP_EXPORT_XREF,
+            role_id=self.creator.id,
+            label="Cross-reference results",
+            collection=self.residents,
+            mime_type=mime_type,
+        )
+        xref.export_matches(export.id)
+        export = Export.by_id(export.id)
+        return archive.load_file(export.content_hash)
+
+    def _check_rows(self, rows):
+        assert len(rows), rows
+        names = {(row["Entity Name"], row["Candidate Collection"]) for row in rows}
+        assert ("Leeta", "Dabo Girls") in names, names
+        for row in rows:
+            assert 0 < float(row["Score"]) <= 1, row
+
+    def test_export_csv_rows(self):
+        path = self._export_file(CSV)
+        with open(path, newline="", encoding="utf-8") as fh:
+            reader = csv.DictReader(fh)
+            assert reader.fieldnames == xref.EXPORT_HEADERS, reader.fieldnames
+            self._check_rows(list(reader))
+
+    def test_export_parquet_rows(self):
+        table = pq.read_table(self._export_file(xref.PARQUET))
+        assert table.column_names == xref.EXPORT_HEADERS, table.column_names
+        self._check_rows(table.to_pylist())
+
     def test_matches(self):
         xref.xref_collection(self.residents)
         url = "/api/2/collections/%s/xref" % self.residents.id
@@ -11,6 +11,7 @@ from servicelayer.archive.util import ensure_path
 from werkzeug.exceptions import BadRequest
 
 from aleph.core import archive, db
+from aleph.logic.blocking import get_blocking_index
 from aleph.logic.documents import ingest_flush
 from aleph.logic.notifications import channel_tag, publish
 from aleph.model import Document, Entity, Events
@@ -149,6 +150,9 @@ def ingest_upload(collection_id):
         proxy = document.to_proxy(ns=collection.ns)
         if proxy.schema.is_a(Document.SCHEMA_FOLDER) and sync and index:
             index_proxy(collection.name, proxy, sync=sync, collection_id=collection.id)
+            blocking = get_blocking_index()
+            if blocking is not None:
+                blocking.put_many(collection.id, [proxy])
         ingest_flush(collection, entity_id=proxy.id)
         queue_ingest(collection, proxy, batch=job_id, index=index)
         _notify(collection, proxy.id)
@@ -1,10 +1,11 @@
 import logging
 
 from flask import Blueprint, request
-from rigour.mime.types import XLSX
+from rigour.mime.types import CSV, XLSX
 
 from aleph.logic.export import create_export
 from aleph.logic.profiles import pairwise_judgements
+from aleph.logic.xref import PARQUET
 from aleph.procrastinate.queues import OP_EXPORT_XREF, queue_export_xref, queue_xref
 from aleph.search.query import XrefQuery
 from aleph.search.result import get_query_result
@@ -98,6 +99,20 @@ def generate(collection_id):
     return jsonify({"status": "accepted"}, status=202)
 
 
+def _export(collection_id, mime_type):
+    collection = get_db_collection(collection_id, request.authz.READ)
+    label = "%s - Cross-reference results" % collection.label
+    export = create_export(
+        operation=OP_EXPORT_XREF,
+        role_id=request.authz.id,
+        label=label,
+        collection=collection,
+        mime_type=mime_type,
+    )
+    queue_export_xref(collection, export.id)
+    return ("", 202)
+
+
 @blueprint.route("/api/2/collections/<int:collection_id>/xref.xlsx", methods=["POST"])
 def export(collection_id):
     """
@@ -118,14 +133,52 @@ def export(collection_id):
       - Xref
       - Collection
     """
-    collection = get_db_collection(collection_id, request.authz.READ)
-    label = "%s - Cross-reference results" % collection.label
-    export = create_export(
-        operation=OP_EXPORT_XREF,
-        role_id=request.authz.id,
-        label=label,
-        collection=collection,
-        mime_type=XLSX,
-    )
-    queue_export_xref(collection, export.id)
-    return ("", 202)
+    return _export(collection_id, XLSX)
+
+
+@blueprint.route("/api/2/collections/<int:collection_id>/xref.csv", methods=["POST"])
+def export_csv(collection_id):
+    """
+    ---
+    post:
+      summary: Download cross-reference results as CSV
+      description: Download results of cross-referencing as a CSV file
+      parameters:
+      - in: path
+        name: collection_id
+        required: true
+        schema:
+          type: integer
+      responses:
+        '202':
+          description: Accepted
+      tags:
+      - Xref
+      - Collection
+    """
+    return _export(collection_id, CSV)
+
+
+@blueprint.route(
+    "/api/2/collections/<int:collection_id>/xref.parquet", methods=["POST"]
+)
+def export_parquet(collection_id):
+    """
+    ---
+    post:
+      summary: Download cross-reference results as Parquet
+      description: Download results of cross-referencing as a Parquet file
+      parameters:
+      - in: path
+        name: collection_id
+        required: true
+        schema:
+          type: integer
+      responses:
+        '202':
+          description: Accepted
+      tags:
+      - Xref
+      - Collection
+    """
+    return _export(collection_id, PARQUET)